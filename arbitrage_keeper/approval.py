@@ -0,0 +1,76 @@
+# This file is part of Maker Keeper Framework.
+#
+# Copyright (C) 2018 reverendus
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from typing import Callable, List
+
+from web3 import Web3
+
+from arbitrage_keeper.batch import ContractCall, batch_call
+from pymaker import Address
+from pymaker.numeric import Wad
+from pymaker.token import ERC20Token
+
+
+class Approval:
+    """Approval of `spender` to access the balance of `token` held by `owner`."""
+
+    # the same threshold `pymaker.approval.directly` uses to decide whether to approve
+    SUFFICIENT_ALLOWANCE = Wad(2 ** 128 - 1)
+
+    def __init__(self, owner: Address, token: ERC20Token, spender: Address, spender_name: str):
+        assert(isinstance(owner, Address))
+        assert(isinstance(token, ERC20Token))
+        assert(isinstance(spender, Address))
+        assert(isinstance(spender_name, str))
+
+        self.owner = owner
+        self.token = token
+        self.spender = spender
+        self.spender_name = spender_name
+
+    def key(self) -> tuple:
+        return self.owner.address, self.token.address.address, self.spender.address
+
+    def allowance_call(self) -> ContractCall:
+        return ContractCall(self.token, 'allowance', [self.owner, self.spender], Wad)
+
+    def __repr__(self):
+        return f"Approval(owner={self.owner}, token={self.token.address}, spender={self.spender_name} {self.spender})"
+
+
+def recorded_approvals(owner: Address, approve: Callable[[Callable], None]) -> List[Approval]:
+    """Calls `approve` with an approval function which, instead of approving anything,
+    records the approvals `approve` asks for. `owner` is the address holding the tokens."""
+    assert(isinstance(owner, Address))
+    assert(callable(approve))
+
+    approvals = []
+    approve(lambda token, spender_address, spender_name: approvals.append(Approval(owner, token, spender_address, spender_name)))
+    return approvals
+
+
+def missing_approvals(web3: Web3, approvals: List[Approval], block_number: int) -> List[Approval]:
+    """Reads the allowances of all `approvals` in one batch, returning the ones which are not sufficient.
+    Duplicate approvals are only returned once."""
+    assert(isinstance(web3, Web3))
+    assert(isinstance(approvals, list))
+    assert(isinstance(block_number, int))
+
+    unique_approvals = list({approval.key(): approval for approval in approvals}.values())
+    allowances = batch_call(web3, list(map(lambda approval: approval.allowance_call(), unique_approvals)), block_number)
+    return [approval for approval, allowance in zip(unique_approvals, allowances)
+            if allowance < Approval.SUFFICIENT_ALLOWANCE]
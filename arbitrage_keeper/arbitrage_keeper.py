@@ -16,19 +16,32 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 import argparse
+import itertools
 import logging
 import sys
-import time
-from typing import List
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional
 
 from web3 import Web3, HTTPProvider
 
-from arbitrage_keeper.conversion import Conversion, OasisTakeConversion, ZrxFillOrderConversion
+from arbitrage_keeper.approval import Approval, missing_approvals, recorded_approvals
+from arbitrage_keeper.batch import ContractCall, batch_call
+from arbitrage_keeper.cache import CachedContract, prefetch
+from arbitrage_keeper.conversion import Conversion, OasisBookConversion, OasisTakeConversion, ZrxFillOrderConversion
 from arbitrage_keeper.conversion import TubBoomConversion, TubBustConversion, TubExitConversion, TubJoinConversion
-from arbitrage_keeper.opportunity import OpportunityFinder, Sequence
+from arbitrage_keeper.gas import ProfitScaledGasPrice
+from arbitrage_keeper.opportunity import NegativeCycleFinder, OpportunityFinder, Sequence, TemplateFinder
+from arbitrage_keeper.opportunity import always_current, most_profitable, select_non_conflicting
+from arbitrage_keeper.order_book import OasisOrderBook, ZrxOrderBook, zrx_order_hash
+from arbitrage_keeper.pipeline import BlockJob, LatestBlockPipeline
+from arbitrage_keeper.relayer import RelayerClient, RelayerFeed
+from arbitrage_keeper.sender import PipelinedSender
+from arbitrage_keeper.snapshot import Snapshot, oasis_order_from_json, oasis_order_to_json
+from arbitrage_keeper.speculation import PendingTransactions, is_still_valid, project_oasis_orders
+from arbitrage_keeper.speculation import project_zrx_unavailable_buy_amounts
 from arbitrage_keeper.transfer_formatter import TransferFormatter
 from pymaker import Address
-from pymaker.approval import via_tx_manager, directly
 from pymaker.gas import DefaultGasPrice, FixedGasPrice
 from pymaker.keys import register_keys
 from pymaker.lifecycle import Lifecycle
@@ -37,7 +50,7 @@ from pymaker.oasis import MatchingMarket
 from pymaker.sai import Tub, Tap
 from pymaker.token import ERC20Token
 from pymaker.transactional import TxManager
-from pymaker.zrx import ZrxExchange, ZrxRelayerApi
+from pymaker.zrx import ZrxExchange, Order as ZrxOrder
 
 
 class ArbitrageKeeper:
@@ -45,6 +58,19 @@ class ArbitrageKeeper:
 
     logger = logging.getLogger('arbitrage-keeper')
 
+    # sequences with total rate not exceeding this one are never considered
+    MIN_RATE = Ray.from_number(1.000001)
+
+    # rough amount of gas used by one transaction of an opportunity, used to bid a share of its profit
+    ESTIMATED_GAS_PER_TRANSACTION = 150000
+
+    # gas limit of each approval transaction, as they are sent all at once without estimating gas
+    APPROVAL_GAS = 200000
+
+    # number of candidates considered for each opportunity to be executed in one block,
+    # as some of them will conflict with the ones already picked
+    CANDIDATES_PER_OPPORTUNITY = 10
+
     def __init__(self, args, **kwargs):
         parser = argparse.ArgumentParser("arbitrage-keeper")
 
@@ -78,6 +104,13 @@ class ArbitrageKeeper:
         parser.add_argument("--oasis-support-address", type=str, required=False,
                             help="Ethereum address of the OasisDEX support contract")
 
+        parser.add_argument("--oasis-order-book", dest='oasis_order_book', action='store_true',
+                            help="Keep a local copy of the OasisDEX order book updated from events, instead of"
+                                 " downloading the whole book on each block")
+
+        parser.add_argument("--oasis-book-edges", dest='oasis_book_edges', action='store_true',
+                            help="Represent all OasisDEX orders on a token pair as one conversion walking the book depth")
+
         parser.add_argument("--relayer-api-server", type=str,
                             help="Address of the 0x Relayer API")
 
@@ -87,9 +120,25 @@ class ArbitrageKeeper:
         parser.add_argument("--tx-manager", type=str,
                             help="Ethereum address of the TxManager contract to use for multi-step arbitrage")
 
+        parser.add_argument("--pipelined-steps", dest='pipelined_steps', action='store_true',
+                            help="Send all steps at once with consecutive nonces when no TxManager is used")
+
+        parser.add_argument("--step-gas", type=int, default=500000,
+                            help="Gas limit of each step sent with `--pipelined-steps' (default: 500000)")
+
         parser.add_argument("--gas-price", type=int, default=0,
                             help="Gas price in Wei (default: node default)")
 
+        parser.add_argument("--gas-profit-share", type=float,
+                            help="Share of the expected profit to bid as the transaction fee, e.g. 0.2"
+                                 " (default: use `--gas-price')")
+
+        parser.add_argument("--gas-price-max", type=int, default=200000000000,
+                            help="Maximum gas price in Wei used with `--gas-profit-share' (default: 200 GWei)")
+
+        parser.add_argument("--gas-price-increase-every", type=int, default=10,
+                            help="Interval (in seconds) of gas price increases with `--gas-profit-share' (default: 10)")
+
         parser.add_argument("--base-token", type=str, required=True,
                             help="The token all arbitrage sequences will start and end with")
 
@@ -99,6 +148,32 @@ class ArbitrageKeeper:
         parser.add_argument("--max-engagement", type=float, required=True,
                             help="Maximum engagement (in base token) in one arbitrage operation")
 
+        parser.add_argument("--max-steps", type=int,
+                            help="Maximum number of steps in one arbitrage operation (default: no limit)")
+
+        parser.add_argument("--search-engine", type=str, choices=['paths', 'negative-cycles', 'templates'],
+                            default='paths',
+                            help="Engine used to look for arbitrage opportunities (default: `paths')")
+
+        parser.add_argument("--max-opportunities", type=int, default=1,
+                            help="Maximum number of non-conflicting opportunities to execute in one block (default: 1)")
+
+        parser.add_argument("--fetch-threads", type=int, default=8,
+                            help="Maximum number of concurrent requests used to fetch market data (default: 8)")
+
+        parser.add_argument("--speculative", dest='speculative', action='store_true',
+                            help="Precompute opportunities on the state projected from pending OasisDEX and 0x transactions")
+
+        parser.add_argument("--block-deadline", type=float,
+                            help="Maximum time (in seconds) to spend on one block, opportunities found"
+                                 " after it passes are not executed (default: no limit)")
+
+        parser.add_argument("--snapshot-file", type=str,
+                            help="File to checkpoint the order books and the contract metadata to, and to warm-start from")
+
+        parser.add_argument("--snapshot-interval", type=int, default=60,
+                            help="Interval (in seconds) between checkpoints written to `--snapshot-file' (default: 60)")
+
         parser.add_argument("--max-errors", type=int, default=100,
                             help="Maximum number of allowed errors before the keeper terminates (default: 100)")
 
@@ -113,27 +188,65 @@ class ArbitrageKeeper:
         register_keys(self.web3, self.arguments.eth_key)
         self.our_address = Address(self.arguments.eth_from)
 
-        self.tub = Tub(web3=self.web3, address=Address(self.arguments.tub_address))
-        self.tap = Tap(web3=self.web3, address=Address(self.arguments.tap_address))
+        self.tub = CachedContract(Tub(web3=self.web3, address=Address(self.arguments.tub_address)),
+                                  immutable=['gem', 'skr', 'sai'], mutable=['ask', 'bid'])
+        self.tap = CachedContract(Tap(web3=self.web3, address=Address(self.arguments.tap_address)),
+                                  immutable=[], mutable=['ask', 'bid', 'joy', 'woe', 'fog'])
+        self.snapshot = self.load_snapshot() if self.arguments.snapshot_file else None
+        if self.snapshot is not None:
+            self.restore_metadata(self.snapshot)
+
         self.gem = ERC20Token(web3=self.web3, address=self.tub.gem())
         self.sai = ERC20Token(web3=self.web3, address=self.tub.sai())
         self.skr = ERC20Token(web3=self.web3, address=self.tub.skr())
 
         self.zrx_exchange = ZrxExchange(web3=self.web3, address=Address(self.arguments.exchange_address)) \
             if self.arguments.exchange_address is not None else None
-        self.zrx_relayer_api = ZrxRelayerApi(exchange=self.zrx_exchange, api_server=self.arguments.relayer_api_server) \
+        self.zrx_relayer_api = RelayerClient(exchange=self.zrx_exchange,
+                                             api_server=self.arguments.relayer_api_server,
+                                             per_page=self.arguments.relayer_per_page,
+                                             pool_size=self.arguments.fetch_threads,
+                                             timeout=float(self.arguments.rpc_timeout)) \
             if self.arguments.relayer_api_server is not None else None
 
         self.otc = MatchingMarket(web3=self.web3,
                                   address=Address(self.arguments.oasis_address),
                                   support_address=Address(self.arguments.oasis_support_address)
                                     if self.arguments.oasis_support_address is not None else None)
+        self.otc_order_book = OasisOrderBook(self.otc, self.tokens()) if self.arguments.oasis_order_book else None
 
         self.base_token = ERC20Token(web3=self.web3, address=Address(self.arguments.base_token))
         self.min_profit = Wad.from_number(self.arguments.min_profit)
         self.max_engagement = Wad.from_number(self.arguments.max_engagement)
+        self.max_steps = self.arguments.max_steps
+        self.templates = TemplateFinder.templates(self.tokens(), self.base_token.address, self.max_steps) \
+            if self.arguments.search_engine == 'templates' else None
         self.max_errors = self.arguments.max_errors
         self.errors = 0
+        self.pipeline = LatestBlockPipeline(process=self.process_block, deadline=self.arguments.block_deadline)
+        self.pending_transactions = PendingTransactions(self.web3, [self.otc.address] +
+                                                        ([self.zrx_exchange.address] if self.zrx_exchange else [])) \
+            if self.arguments.speculative else None
+        self.speculative_opportunity = None
+        self.speculation_state = None
+
+        # the venue state fetched by the pipeline for the latest block, which speculation projects
+        # pending transactions on, as `(block_number, venues)`
+        self.latest_venues = None
+        self.speculation_lock = threading.Lock()
+
+        # venues are fetched on a separate pool, so waiting for token pairs fetched
+        # on the other one can never exhaust the threads and deadlock
+        self.venue_executor = ThreadPoolExecutor(max_workers=3)
+        self.fetch_executor = ThreadPoolExecutor(max_workers=self.arguments.fetch_threads)
+
+        self.zrx_order_book = ZrxOrderBook(RelayerFeed(self.zrx_relayer_api,
+                                                       self.token_pairs([self.sai.address, self.gem.address]),
+                                                       self.fetch_executor)) \
+            if self.zrx_exchange is not None and self.zrx_relayer_api is not None else None
+
+        if self.snapshot is not None:
+            self.restore_order_books(self.snapshot)
 
         if self.arguments.tx_manager:
             self.tx_manager = TxManager(web3=self.web3, address=Address(self.arguments.tx_manager))
@@ -142,6 +255,9 @@ class ArbitrageKeeper:
         else:
             self.tx_manager = None
 
+        self.pipelined_sender = PipelinedSender(self.web3, self.our_address, self.fetch_executor, self.arguments.step_gas) \
+            if self.arguments.pipelined_steps and self.tx_manager is None else None
+
         logging.basicConfig(format='%(asctime)-15s %(levelname)-8s %(message)s',
                             level=(logging.DEBUG if self.arguments.debug else logging.INFO))
 
@@ -149,22 +265,130 @@ class ArbitrageKeeper:
         with Lifecycle(self.web3) as lifecycle:
             self.lifecycle = lifecycle
             lifecycle.on_startup(self.startup)
-            lifecycle.on_block(self.process_block)
+            lifecycle.on_block(self.on_block)
+            if self.pending_transactions:
+                lifecycle.every(1, self.speculate)
+            if self.arguments.snapshot_file:
+                lifecycle.every(self.arguments.snapshot_interval, self.save_snapshot)
+            lifecycle.on_shutdown(self.shutdown)
 
     def startup(self):
         self.approve()
+        self.pipeline.start()
+
+    def shutdown(self):
+        self.pipeline.stop()
+        if self.arguments.snapshot_file:
+            self.save_snapshot()
+
+    def snapshot_contracts(self) -> dict:
+        """Addresses of the contracts the market state depends on, a snapshot can only be used if they match."""
+        return {'tub': self.tub.address.address,
+                'tap': self.tap.address.address,
+                'otc': Address(self.arguments.oasis_address).address,
+                'exchange': Address(self.arguments.exchange_address).address
+                            if self.arguments.exchange_address is not None else None}
+
+    def load_snapshot(self) -> Optional[Snapshot]:
+        snapshot = Snapshot.load(self.arguments.snapshot_file)
+        if snapshot is None:
+            return None
+
+        if not snapshot.is_for(self.snapshot_contracts()):
+            self.logger.warning(f"Ignoring snapshot {self.arguments.snapshot_file} as it has been taken for different contracts")
+            return None
+
+        if snapshot.block_number > self.web3.eth.blockNumber:
+            self.logger.warning(f"Ignoring snapshot {self.arguments.snapshot_file} as it has been taken"
+                                f" at block #{snapshot.block_number}, which is ahead of the chain")
+            return None
+
+        return snapshot
+
+    def restore_metadata(self, snapshot: Snapshot):
+        for function_name, value in snapshot.metadata.get('tub', {}).items():
+            self.tub.store(self.tub.call(function_name, [], Address), Address(value))
+
+    def restore_order_books(self, snapshot: Snapshot):
+        """Restore the order books from `snapshot`, so only the blocks missed since then need to be caught up on."""
+        if self.otc_order_book is not None and snapshot.oasis_orders is not None:
+            self.otc_order_book.restore(list(map(lambda data: oasis_order_from_json(self.otc, data), snapshot.oasis_orders)),
+                                        snapshot.block_number)
+
+        if self.zrx_order_book is not None:
+            zrx_orders = list(map(lambda data: ZrxOrder.from_json(self.zrx_exchange, data), snapshot.zrx_orders))
+            self.zrx_order_book.restore(zrx_orders)
+            self.zrx_order_book.feed.restore(zrx_orders)
+
+        self.logger.info(f"Restored {len(snapshot.oasis_orders or [])} OasisDEX orders and {len(snapshot.zrx_orders)}"
+                         f" 0x orders from snapshot taken at block #{snapshot.block_number}")
+
+    def save_snapshot(self):
+        """Checkpoint the order books and the contract metadata to `--snapshot-file`."""
+        try:
+            if self.otc_order_book is not None:
+                oasis_orders, block_number = self.otc_order_book.snapshot()
+                if block_number is None:
+                    return
+            else:
+                oasis_orders, block_number = None, self.web3.eth.blockNumber
+
+            snapshot = Snapshot(block_number=block_number,
+                                contracts=self.snapshot_contracts(),
+                                metadata={'tub': {function_name: getattr(self.tub, function_name)().address
+                                                  for function_name in sorted(self.tub.immutable)}},
+                                oasis_orders=list(map(oasis_order_to_json, oasis_orders)) if oasis_orders is not None else None,
+                                zrx_orders=list(map(lambda order: order.to_json(), self.zrx_order_book.get_orders()))
+                                           if self.zrx_order_book is not None else [])
+            snapshot.save(self.arguments.snapshot_file)
+
+            self.logger.debug(f"Saved snapshot at block #{block_number} to {self.arguments.snapshot_file}")
+        except Exception as e:
+            self.logger.warning(f"Failed to save snapshot to {self.arguments.snapshot_file}: {e}")
+
+    def on_block(self):
+        """Callback called on each new block, hands the newest block over to the pipeline."""
+        self.pipeline.submit(self.web3.eth.blockNumber)
 
     def approve(self):
-        """Approve all components that need to access our balances"""
-        approval_method = via_tx_manager(self.tx_manager, gas_price=self.gas_price()) if self.tx_manager \
-            else directly(gas_price=self.gas_price())
-        self.tub.approve(approval_method)
-        self.tap.approve(approval_method)
-        self.otc.approve([self.gem, self.sai, self.skr], approval_method)
-        if self.zrx_exchange:
-            self.zrx_exchange.approve([self.gem, self.sai], approval_method)
+        """Approve all components that need to access our balances.
+        All allowances are read in one batch, and only the missing approvals get sent,
+        all at once with consecutive nonces."""
+        def approve_venues(approval_method):
+            self.tub.approve(approval_method)
+            self.tap.approve(approval_method)
+            self.otc.approve([self.gem, self.sai, self.skr], approval_method)
+            if self.zrx_exchange:
+                self.zrx_exchange.approve([self.gem, self.sai], approval_method)
+
+        # if the TxManager is used, it is the TxManager which holds the tokens during arbitrage
+        approvals = recorded_approvals(self.tx_manager.address if self.tx_manager else self.our_address, approve_venues)
         if self.tx_manager:
-            self.tx_manager.approve([self.gem, self.sai, self.skr], directly(gas_price=self.gas_price()))
+            approvals += recorded_approvals(self.our_address, lambda approval_method: self.tx_manager.approve([self.gem, self.sai, self.skr],
+                                                                                                             approval_method))
+
+        approvals = missing_approvals(self.web3, approvals, self.web3.eth.blockNumber)
+        if len(approvals) == 0:
+            return
+
+        for approval in approvals:
+            self.logger.info(f"Approving {approval.spender_name} ({approval.spender}) to access {approval.token.address}"
+                             f" held by {approval.owner}")
+
+        # approvals do not depend on each other, so a failed one must not cancel the other ones
+        sender = PipelinedSender(self.web3, self.our_address, self.fetch_executor, self.APPROVAL_GAS)
+        receipts = sender.execute(list(map(self.approval_transaction, approvals)), self.gas_price(), independent=True)
+        for approval, receipt in zip(approvals, receipts):
+            if receipt is None:
+                self.logger.warning(f"Failed to approve {approval.spender_name} ({approval.spender})"
+                                    f" to access {approval.token.address} held by {approval.owner}")
+
+    def approval_transaction(self, approval: Approval) -> dict:
+        invocation = approval.token.approve(approval.spender).invocation()
+        if approval.owner != self.our_address:
+            invocation = self.tx_manager.execute([], [invocation]).invocation()
+
+        return {'to': invocation.address.address, 'data': invocation.calldata.value}
 
     def token_name(self, address: Address) -> str:
         if address == self.sai.address:
@@ -179,70 +403,242 @@ class ArbitrageKeeper:
         else:
             return str(address)
 
+    def tokens(self) -> List[Address]:
+        return [self.sai.address, self.skr.address, self.gem.address]
+
+    @staticmethod
+    def token_pairs(tokens) -> list:
+        return [(token1, token2) for token1 in tokens for token2 in tokens if token1 != token2]
+
+    @staticmethod
+    def concurrently(executor: ThreadPoolExecutor, functions: list) -> list:
+        """Run all `functions` on `executor` and return their results, in the same order."""
+        return list(executor.map(lambda function: function(), functions))
+
+    def prefetch_tub_and_tap(self, block_number: int):
+        """Read all the `tub` and `tap` state needed by the conversions in one batch, as of `block_number`."""
+        one = Wad.from_number(1)
+        prefetch(self.web3, block_number, [(self.tub, self.tub.call('gem', [], Address)),
+                                           (self.tub, self.tub.call('skr', [], Address)),
+                                           (self.tub, self.tub.call('sai', [], Address)),
+                                           (self.tub, self.tub.call('ask', [one], Wad)),
+                                           (self.tub, self.tub.call('bid', [one], Wad)),
+                                           (self.tap, self.tap.call('ask', [one], Wad)),
+                                           (self.tap, self.tap.call('bid', [one], Wad)),
+                                           (self.tap, self.tap.call('joy', [], Wad)),
+                                           (self.tap, self.tap.call('woe', [], Wad)),
+                                           (self.tap, self.tap.call('fog', [], Wad))])
+
     def tub_conversions(self) -> List[Conversion]:
+        self.prefetch_tub_and_tap(self.web3.eth.blockNumber)
         return [TubJoinConversion(self.tub),
                 TubExitConversion(self.tub),
                 TubBoomConversion(self.tub, self.tap),
                 TubBustConversion(self.tub, self.tap)]
 
     def otc_orders(self, tokens):
-        orders = []
-
-        for token1 in tokens:
-            for token2 in tokens:
-                if token1 != token2:
-                    orders = orders + self.otc.get_orders(token1, token2)
+        if self.otc_order_book:
+            self.otc_order_book.sync()
+            get_orders = self.otc_order_book.get_orders
+        else:
+            get_orders = self.otc.get_orders
 
-        return orders
+        orders_by_pair = self.concurrently(self.fetch_executor, [lambda pair=pair: get_orders(pair[0], pair[1])
+                                                                 for pair in self.token_pairs(tokens)])
 
-    def otc_conversions(self, tokens) -> List[Conversion]:
-        return list(map(lambda order: OasisTakeConversion(self.otc, order), self.otc_orders(tokens)))
+        return list(itertools.chain.from_iterable(orders_by_pair))
 
-    def zrx_orders(self, tokens):
-        if self.zrx_exchange is None or self.zrx_relayer_api is None:
-            return []
+    def otc_conversions(self, orders: list, pending_transactions: list = None) -> List[Conversion]:
+        if pending_transactions:
+            orders = project_oasis_orders(orders, pending_transactions)
 
-        orders = []
+        if self.arguments.oasis_book_edges:
+            def pair(order):
+                return order.buy_token.address, order.pay_token.address
 
-        for token1 in tokens:
-            for token2 in tokens:
-                if token1 != token2:
-                    orders = orders + self.zrx_relayer_api.get_orders(token1, token2)
+            orders = sorted(orders, key=pair)
+            return list(map(lambda group: OasisBookConversion(self.otc, list(group[1])), itertools.groupby(orders, key=pair)))
+        else:
+            return list(map(lambda order: OasisTakeConversion(self.otc, order), orders))
 
-        return list(filter(lambda order: order.expiration <= time.time(), orders))
+    def zrx_orders(self, tokens):
+        if self.zrx_order_book is None:
+            return []
 
-    def zrx_conversions(self, tokens) -> List[Conversion]:
-        return list(map(lambda order: ZrxFillOrderConversion(self.zrx_exchange, order), self.zrx_orders(tokens)))
+        self.zrx_order_book.sync()
+        return list(filter(lambda order: order.pay_token in tokens and order.buy_token in tokens, self.zrx_order_book.get_orders()))
 
-    def all_conversions(self):
-        return self.tub_conversions() + \
-               self.otc_conversions([self.sai.address, self.skr.address, self.gem.address]) + \
-               self.zrx_conversions([self.sai.address, self.gem.address])
+    def zrx_unavailable_buy_amounts(self, orders: list) -> List[Wad]:
+        """Read the unavailable (filled or cancelled) amounts of all `orders` in one batch.
+        Order hashes are calculated locally, so they do not have to be read first."""
+        if len(orders) == 0:
+            return []
 
-    def process_block(self):
-        """Callback called on each new block.
+        order_hashes = map(lambda order: zrx_order_hash(self.zrx_exchange.address, order), orders)
+        return batch_call(self.web3, list(map(lambda order_hash: ContractCall(self.zrx_exchange, 'getUnavailableTakerTokenAmount',
+                                                                              [order_hash], Wad), order_hashes)),
+                          self.web3.eth.blockNumber)
+
+    def zrx_orders_and_unavailable_buy_amounts(self, tokens) -> tuple:
+        """Read the 0x orders between `tokens` together with their unavailable buy amounts,
+        removing the fully filled or cancelled ones from the local order book."""
+        orders = self.zrx_orders(tokens)
+        unavailable_buy_amounts = self.zrx_unavailable_buy_amounts(orders)
+        if self.zrx_order_book is not None:
+            for order, unavailable_buy_amount in zip(orders, unavailable_buy_amounts):
+                if unavailable_buy_amount >= order.buy_amount:
+                    self.zrx_order_book.remove(order)
+
+        return orders, unavailable_buy_amounts
+
+    def zrx_conversions(self, orders: list, unavailable_buy_amounts: List[Wad],
+                        pending_transactions: list = None) -> List[Conversion]:
+        if pending_transactions:
+            unavailable_buy_amounts = project_zrx_unavailable_buy_amounts(orders, unavailable_buy_amounts, pending_transactions)
+
+        return list(map(lambda order, unavailable_buy_amount: ZrxFillOrderConversion(self.zrx_exchange, order, unavailable_buy_amount),
+                        orders, unavailable_buy_amounts))
+
+    def fetch_venues(self) -> tuple:
+        """Fetch the state of all venues concurrently: the `tub` conversions, the OasisDEX orders,
+        and the 0x orders together with their unavailable buy amounts."""
+        tub_conversions, otc_orders, zrx_orders = self.concurrently(self.venue_executor, [
+            lambda: self.tub_conversions(),
+            lambda: self.otc_orders(self.tokens()),
+            lambda: self.zrx_orders_and_unavailable_buy_amounts([self.sai.address, self.gem.address])
+        ])
+
+        return tub_conversions, otc_orders, zrx_orders
+
+    def venue_conversions(self, venues: tuple, pending_transactions: list = None) -> List[Conversion]:
+        """Build the conversions from the state of all venues returned by `fetch_venues`.
+        If `pending_transactions` are given, their effects on the order books are projected."""
+        tub_conversions, otc_orders, (zrx_orders, zrx_unavailable_buy_amounts) = venues
+        return tub_conversions + \
+               self.otc_conversions(otc_orders, pending_transactions) + \
+               self.zrx_conversions(zrx_orders, zrx_unavailable_buy_amounts, pending_transactions)
+
+    def all_conversions(self, pending_transactions: list = None):
+        """Fetch the conversions from all venues concurrently.
+        If `pending_transactions` are given, their effects on the order books are projected."""
+        return self.venue_conversions(self.fetch_venues(), pending_transactions)
+
+    def process_block(self, job: BlockJob = None):
+        """Process a new block, called by the pipeline.
         If too many errors, terminate the keeper to minimize potential damage."""
         if self.errors >= self.max_errors:
             self.lifecycle.terminate()
         else:
-            self.execute_best_opportunity_available()
-
-    def execute_best_opportunity_available(self):
-        """Find the best arbitrage opportunity present and execute it."""
-        opportunity = self.best_opportunity(self.profitable_opportunities())
-        if opportunity:
+            self.execute_best_opportunity_available(job)
+
+    def execute_best_opportunity_available(self, job: BlockJob = None):
+        """Find the best non-conflicting arbitrage opportunities present and execute them.
+        Nothing gets executed if, by the time the opportunities are found, the state has already moved
+        to a newer block or the block deadline has passed."""
+        block_number = job.block_number if job is not None else self.web3.eth.blockNumber
+        venues = self.fetch_venues()
+        with self.speculation_lock:
+            self.latest_venues = (block_number, venues)
+
+        conversions = self.venue_conversions(venues)
+        speculative_opportunity = self.speculative_candidate(block_number, conversions)
+        opportunities = [speculative_opportunity] if speculative_opportunity else self.scheduled_opportunities(conversions, job)
+        for opportunity in opportunities:
             self.print_opportunity(opportunity)
+            if job is not None and not job.is_current():
+                self.logger.info(f"Not executing the opportunity found for block #{job.block_number},"
+                                 f" as it is {'superseded by a newer block' if job.is_superseded() else 'past the deadline'}")
+                return
+
             self.execute_opportunity(opportunity)
 
-    def profitable_opportunities(self):
-        """Identify all profitable arbitrage opportunities within given limits."""
+    def scheduled_opportunities(self, conversions: List[Conversion], job: BlockJob = None) -> List[Sequence]:
+        """Pick up to `--max-opportunities` most profitable opportunities which do not share any orders
+        or actions, and which can all be executed with our balance of the base token."""
+        max_opportunities = self.arguments.max_opportunities
+        limit = max_opportunities * self.CANDIDATES_PER_OPPORTUNITY if max_opportunities > 1 else 1
+        opportunities = self.profitable_opportunities(limit=limit, conversions=conversions, job=job)
+        return select_non_conflicting(opportunities, max_opportunities, self.base_token.balance_of(self.our_address))
+
+    def profitable_opportunities(self, limit: int = 1, conversions: List[Conversion] = None,
+                                 job: BlockJob = None) -> List[Sequence]:
+        """Identify at most `limit` most profitable arbitrage opportunities within given limits.
+
+        Candidates are streamed from the opportunity finder and the profit of each of them
+        gets calculated only once, only the best `limit` ones are being kept in memory.
+        If `conversions` are not given, they get fetched from all venues. If `job` is given,
+        both the search and the sizing stop as soon as it is no longer current.
+        """
+        assert(isinstance(limit, int))
+        assert(limit > 0)
+        assert(isinstance(conversions, list) or (conversions is None))
+        assert(isinstance(job, BlockJob) or (job is None))
+
+        if conversions is None:
+            conversions = self.all_conversions()
+
         entry_amount = Wad.min(self.base_token.balance_of(self.our_address), self.max_engagement)
-        opportunity_finder = OpportunityFinder(conversions=self.all_conversions())
-        opportunities = opportunity_finder.find_opportunities(self.base_token.address, entry_amount)
-        opportunities = filter(lambda op: op.total_rate() > Ray.from_number(1.000001), opportunities)
-        opportunities = filter(lambda op: op.profit(self.base_token.address) > self.min_profit, opportunities)
-        opportunities = sorted(opportunities, key=lambda op: op.profit(self.base_token.address), reverse=True)
-        return opportunities
+        opportunity_finder = self.opportunity_finder(conversions)
+        is_current = job.is_current if job is not None else always_current
+        opportunities = opportunity_finder.iterate_opportunities(self.base_token.address, self.max_steps, is_current)
+        return most_profitable(opportunities, self.base_token.address, entry_amount, self.MIN_RATE, self.min_profit,
+                               limit, is_current)
+
+    def speculate(self):
+        """Precompute the best opportunity on the state projected from pending transactions,
+        so it is ready to be executed the moment the next block arrives.
+
+        Venues are not fetched again, the pending transactions get projected on the state
+        fetched by the pipeline for the latest block it has processed."""
+        with self.speculation_lock:
+            latest_venues = self.latest_venues
+            speculation_state = self.speculation_state
+
+        if latest_venues is None:
+            return
+
+        block_number, venues = latest_venues
+        if speculation_state is None or speculation_state[0] != block_number:
+            self.pending_transactions.prune()
+
+        transactions = self.pending_transactions.poll()
+        state = (block_number, frozenset(self.pending_transactions.transactions.keys()))
+        if len(transactions) == 0 or state == speculation_state:
+            return
+
+        opportunity = self.best_opportunity(self.profitable_opportunities(conversions=self.venue_conversions(venues, transactions)))
+        with self.speculation_lock:
+            self.speculation_state = state
+            self.speculative_opportunity = (block_number, opportunity) if opportunity else None
+
+        if opportunity:
+            self.logger.debug(f"Precomputed opportunity with id={opportunity.id()} on block #{block_number}"
+                              f" with {len(transactions)} pending transaction(s) projected")
+
+    def speculative_candidate(self, block_number: int, conversions: List[Conversion]) -> Optional[Sequence]:
+        """Return the opportunity precomputed on a previous block, if it is still valid with `conversions`."""
+        with self.speculation_lock:
+            speculative_opportunity = self.speculative_opportunity
+            self.speculative_opportunity = None
+
+        if speculative_opportunity is None:
+            return None
+
+        speculation_block_number, opportunity = speculative_opportunity
+        if speculation_block_number < block_number and is_still_valid(opportunity, conversions):
+            self.logger.info(f"Using opportunity precomputed on block #{speculation_block_number}")
+            return opportunity
+        else:
+            return None
+
+    def opportunity_finder(self, conversions: List[Conversion]):
+        """Create the opportunity finder selected with the `--search-engine` argument."""
+        if self.arguments.search_engine == 'negative-cycles':
+            return NegativeCycleFinder(conversions=conversions)
+        elif self.arguments.search_engine == 'templates':
+            return TemplateFinder(conversions=conversions, templates=self.templates)
+        else:
+            return OpportunityFinder(conversions=conversions, min_rate=self.MIN_RATE)
 
     def best_opportunity(self, opportunities: List[Sequence]):
         """Pick the best opportunity, or return None if no profitable opportunities."""
@@ -263,6 +659,8 @@ class ArbitrageKeeper:
         Depending on whether `tx_manager` is available."""
         if self.tx_manager:
             self.execute_opportunity_in_one_transaction(opportunity)
+        elif self.pipelined_sender:
+            self.execute_opportunity_pipelined(opportunity)
         else:
             self.execute_opportunity_step_by_step(opportunity)
 
@@ -277,33 +675,75 @@ class ArbitrageKeeper:
 
         all_transfers = []
         for step in opportunity.steps:
-            receipt = step.transact().transact(gas_price=self.gas_price())
+            for transact in step.transacts():
+                receipt = transact.transact(gas_price=self.gas_price(opportunity))
+                if receipt:
+                    all_transfers += receipt.transfers
+                    outgoing = TransferFormatter().format(filter(outgoing_transfer(self.our_address), receipt.transfers), self.token_name)
+                    incoming = TransferFormatter().format(filter(incoming_transfer(self.our_address), receipt.transfers), self.token_name)
+                    self.logger.info(f"Exchanged {outgoing} to {incoming}")
+                else:
+                    self.errors += 1
+                    return
+        self.logger.info(f"The profit we made is {TransferFormatter().format_net(all_transfers, self.our_address, self.token_name)}")
+
+    def execute_opportunity_pipelined(self, opportunity: Sequence):
+        """Execute the opportunity by sending all the steps at once, with consecutive nonces."""
+        invocations = [transact.invocation() for step in opportunity.steps for transact in step.transacts()]
+        receipts = self.pipelined_sender.execute(list(map(lambda invocation: {'to': invocation.address.address,
+                                                                              'data': invocation.calldata.value}, invocations)),
+                                                 self.gas_price(opportunity))
+
+        all_transfers = []
+        for receipt in receipts:
             if receipt:
                 all_transfers += receipt.transfers
-                outgoing = TransferFormatter().format(filter(outgoing_transfer(self.our_address), receipt.transfers), self.token_name)
-                incoming = TransferFormatter().format(filter(incoming_transfer(self.our_address), receipt.transfers), self.token_name)
+                outgoing = TransferFormatter().format(filter(lambda transfer: transfer.from_address == self.our_address, receipt.transfers), self.token_name)
+                incoming = TransferFormatter().format(filter(lambda transfer: transfer.to_address == self.our_address, receipt.transfers), self.token_name)
                 self.logger.info(f"Exchanged {outgoing} to {incoming}")
-            else:
-                self.errors += 1
-                return
+
+        if not all(receipts):
+            self.errors += 1
         self.logger.info(f"The profit we made is {TransferFormatter().format_net(all_transfers, self.our_address, self.token_name)}")
 
     def execute_opportunity_in_one_transaction(self, opportunity: Sequence):
         """Execute the opportunity in one transaction, using the `tx_manager`."""
-        tokens = [self.sai.address, self.skr.address, self.gem.address]
-        invocations = list(map(lambda step: step.transact().invocation(), opportunity.steps))
-        receipt = self.tx_manager.execute(tokens, invocations).transact(gas_price=self.gas_price())
+        tokens = self.tokens()
+        invocations = [transact.invocation() for step in opportunity.steps for transact in step.transacts()]
+        receipt = self.tx_manager.execute(tokens, invocations).transact(gas_price=self.gas_price(opportunity))
         if receipt:
             self.logger.info(f"The profit we made is {TransferFormatter().format_net(receipt.transfers, self.our_address, self.token_name)}")
         else:
             self.errors += 1
 
-    def gas_price(self):
-        if self.arguments.gas_price > 0:
+    def gas_price(self, opportunity: Sequence = None):
+        """Gas price strategy to use. If `--gas-profit-share` has been specified, transactions
+        executing `opportunity` bid a share of its expected profit."""
+        if opportunity is not None and self.arguments.gas_profit_share is not None:
+            number_of_transactions = sum(map(lambda step: len(step.transacts()), opportunity.steps))
+            return ProfitScaledGasPrice(profit=self.eth_value(opportunity.profit(self.base_token.address), self.base_token.address),
+                                        gas=number_of_transactions * self.ESTIMATED_GAS_PER_TRANSACTION,
+                                        share=self.arguments.gas_profit_share,
+                                        min_price=self.web3.eth.gasPrice,
+                                        max_price=self.arguments.gas_price_max,
+                                        every_secs=self.arguments.gas_price_increase_every)
+        elif self.arguments.gas_price > 0:
             return FixedGasPrice(self.arguments.gas_price)
         else:
             return DefaultGasPrice()
 
+    def eth_value(self, amount: Wad, token: Address) -> Wad:
+        """Approximate value of `amount` of `token` in ETH, based on the `tub` and `tap` prices."""
+        one = Wad.from_number(1)
+        if token == self.gem.address:
+            return amount
+        elif token == self.skr.address:
+            return amount * self.tub.bid(one)
+        elif token == self.sai.address:
+            return amount / self.tap.bid(one) * self.tub.bid(one)
+        else:
+            raise Exception(f"Unknown token {token}")
+
 
 if __name__ == '__main__':
     ArbitrageKeeper(sys.argv[1:]).main()
@@ -0,0 +1,121 @@
+# This file is part of Maker Keeper Framework.
+#
+# Copyright (C) 2018 reverendus
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from typing import List
+
+import requests
+from eth_abi import decode_single
+from eth_utils import decode_hex
+from web3 import Web3, HTTPProvider
+
+from pymaker import Address, Contract
+from pymaker.numeric import Wad, Ray
+
+
+def _raw(value):
+    if isinstance(value, Address):
+        return value.address
+    elif isinstance(value, Wad) or isinstance(value, Ray):
+        return value.value
+    elif isinstance(value, list) or isinstance(value, tuple):
+        return list(map(_raw, value))
+    else:
+        return value
+
+
+def _frozen(value):
+    if isinstance(value, list):
+        return tuple(map(_frozen, value))
+    else:
+        return value
+
+
+def call_key(function_name: str, args: list) -> tuple:
+    """Returns a hashable key identifying a call of `function_name` with `args`."""
+    return function_name, _frozen(_raw(args))
+
+
+class ContractCall:
+    """Read-only call of a contract function, to be executed as part of a batch.
+
+    Results are returned as `result_type`, which can be either `Address`, `Wad`, `Ray`, `int`
+    or `bytes` (for `bytes32` results).
+    """
+
+    def __init__(self, contract: Contract, function_name: str, args: list, result_type: type):
+        assert(isinstance(contract, Contract))
+        assert(isinstance(function_name, str))
+        assert(isinstance(args, list))
+        assert(result_type in [Address, Wad, Ray, int, bytes])
+
+        self.contract = contract
+        self.function_name = function_name
+        self.args = args
+        self.result_type = result_type
+
+    def key(self) -> tuple:
+        return call_key(self.function_name, self.args)
+
+    def transaction(self) -> dict:
+        return {'to': self.contract.address.address,
+                'data': self.contract._contract.encodeABI(fn_name=self.function_name, args=_raw(self.args))}
+
+    def decode(self, data: bytes):
+        if self.result_type == Address:
+            return Address(decode_single('address', data))
+        elif self.result_type == int:
+            return decode_single('uint256', data)
+        elif self.result_type == bytes:
+            return decode_single('bytes32', data)
+        else:
+            return self.result_type(decode_single('uint256', data))
+
+
+def batch_call(web3: Web3, calls: List[ContractCall], block_number: int) -> list:
+    """Executes all `calls` against the state at `block_number`, returning their results in the same order.
+
+    If the node is reached over HTTP, all calls are sent as one JSON-RPC batch request.
+    Otherwise they get executed one by one, still pinned to the same block.
+    """
+    assert(isinstance(web3, Web3))
+    assert(isinstance(calls, list))
+    assert(isinstance(block_number, int))
+
+    if len(calls) == 0:
+        return []
+
+    provider = web3.providers[0]
+    if isinstance(provider, HTTPProvider):
+        payload = [{'jsonrpc': '2.0',
+                    'method': 'eth_call',
+                    'params': [call.transaction(), hex(block_number)],
+                    'id': index} for index, call in enumerate(calls)]
+
+        response = requests.post(provider.endpoint_uri, json=payload, **dict(provider.get_request_kwargs()))
+        response.raise_for_status()
+
+        results = {}
+        for item in response.json():
+            if 'error' in item:
+                raise Exception(f"Batch call #{item['id']} failed: {item['error']}")
+            results[item['id']] = decode_hex(item['result'])
+
+        return [call.decode(results[index]) for index, call in enumerate(calls)]
+
+    else:
+        return [call.decode(bytes(web3.eth.call(call.transaction(), block_number))) for call in calls]
+
@@ -0,0 +1,101 @@
+# This file is part of Maker Keeper Framework.
+#
+# Copyright (C) 2018 reverendus
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from typing import List
+
+from web3 import Web3
+
+from arbitrage_keeper.batch import ContractCall, batch_call, call_key
+from pymaker import Contract
+
+
+class CachedContract:
+    """Caches the reads of a contract, delegating everything else to it.
+
+    Values returned by the functions listed in `immutable` (like token addresses) are read only
+    once and then kept for the lifetime of the process. Values returned by the functions listed
+    in `mutable` are kept only until `on_block` gets called with a different block number.
+    All other attributes and functions, including the ones sending transactions, are not cached.
+    """
+
+    def __init__(self, contract: Contract, immutable: List[str], mutable: List[str]):
+        assert(isinstance(contract, Contract))
+        assert(isinstance(immutable, list))
+        assert(isinstance(mutable, list))
+
+        self.contract = contract
+        self.immutable = set(immutable)
+        self.mutable = set(mutable)
+        self.pinned_values = {}
+        self.block_values = {}
+        self.block_number = None
+
+    def on_block(self, block_number: int):
+        """Invalidates all mutable values if `block_number` is different from the current one."""
+        assert(isinstance(block_number, int))
+
+        if block_number != self.block_number:
+            self.block_values = {}
+            self.block_number = block_number
+
+    def call(self, function_name: str, args: list, result_type: type) -> ContractCall:
+        return ContractCall(self.contract, function_name, args, result_type)
+
+    def is_cached(self, call: ContractCall) -> bool:
+        return call.key() in self.pinned_values or call.key() in self.block_values
+
+    def store(self, call: ContractCall, value):
+        if call.function_name in self.immutable:
+            self.pinned_values[call.key()] = value
+        elif call.function_name in self.mutable and self.block_number is not None:
+            self.block_values[call.key()] = value
+
+    def __getattr__(self, name):
+        attribute = getattr(self.contract, name)
+        if name in self.immutable:
+            values = self.pinned_values
+        elif name in self.mutable and self.block_number is not None:
+            values = self.block_values
+        else:
+            return attribute
+
+        def method(*args):
+            key = call_key(name, list(args))
+            if key not in values:
+                values[key] = attribute(*args)
+            return values[key]
+
+        return method
+
+
+def prefetch(web3: Web3, block_number: int, reads: list):
+    """Reads all values not cached yet in one batch and stores them in their caches.
+
+    `reads` is a list of (`CachedContract`, `ContractCall`) tuples. Caches get moved to `block_number`
+    first, so mutable values cached for any previous block are invalidated.
+    """
+    assert(isinstance(web3, Web3))
+    assert(isinstance(block_number, int))
+    assert(isinstance(reads, list))
+
+    for cache, _ in reads:
+        cache.on_block(block_number)
+
+    missing = list(filter(lambda read: not read[0].is_cached(read[1]), reads))
+    results = batch_call(web3, list(map(lambda read: read[1], missing)), block_number)
+    for (cache, call), result in zip(missing, results):
+        cache.store(call, result)
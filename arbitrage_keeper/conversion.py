@@ -15,13 +15,88 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+from typing import List, Tuple
+
 from pymaker import Address, zrx
 from pymaker.numeric import Wad, Ray
 from pymaker.oasis import SimpleMarket, Order
 from pymaker.sai import Tub, Tap
 
+RAY = 10**27
+WAD_TO_RAY = 10**9
+
+# significant digits of the default `decimal` context, in which pymaker multiplies and divides `Ray`s
+DECIMAL_PRECISION = 28
+
+
+def decimal_round(numerator: int, denominator: int = 1) -> Tuple[int, int]:
+    """Rounds `numerator / denominator` half-even to `DECIMAL_PRECISION` significant digits,
+    exactly like each operation of the default `decimal` context does.
+
+    Both arguments have to be non-negative. The result is returned as `(coefficient, exponent)`,
+    its value being `coefficient * 10**exponent`.
+    """
+    if numerator == 0:
+        return 0, 0
+
+    exponent = len(str(numerator)) - len(str(denominator)) - DECIMAL_PRECISION
+    while True:
+        if exponent >= 0:
+            scaled_denominator = denominator * 10**exponent
+            coefficient, remainder = divmod(numerator, scaled_denominator)
+        else:
+            scaled_denominator = denominator
+            coefficient, remainder = divmod(numerator * 10**-exponent, denominator)
+
+        if coefficient < 10**DECIMAL_PRECISION:
+            break
+        exponent += 1
+
+    if remainder * 2 > scaled_denominator or (remainder * 2 == scaled_denominator and coefficient % 2 == 1):
+        coefficient += 1
+
+    return coefficient, exponent
+
+
+def decimal_floor(coefficient: int, exponent: int) -> int:
+    """Truncates `coefficient * 10**exponent` to an integer, like quantizing it with `ROUND_DOWN` does."""
+    return coefficient * 10**exponent if exponent >= 0 else coefficient // 10**-exponent
+
+
+def raw_ray_mul(value1: int, value2: int) -> int:
+    """Multiplies two raw `Ray` values exactly the same way `Ray * Ray` does.
+
+    `Ray * Ray` multiplies the values as `Decimal`s, which rounds the product half-even to
+    `DECIMAL_PRECISION` significant digits, and only then truncates the result of the division.
+    """
+    coefficient, exponent = decimal_round(value1 * value2)
+    return decimal_floor(coefficient, exponent - 27)
+
+
+def raw_ray_div(value1: int, value2: int) -> int:
+    """Divides two raw `Ray` values exactly the same way `Ray / Ray` does.
+
+    `Ray / Ray` scales the dividend by `10**27` and then divides it, both as `Decimal`s,
+    so both results get rounded half-even to `DECIMAL_PRECISION` significant digits.
+    """
+    coefficient, exponent = decimal_round(value1 * RAY)
+    coefficient, exponent = decimal_round(coefficient * 10**max(exponent, 0), value2 * 10**max(-exponent, 0))
+    return decimal_floor(coefficient, exponent)
+
+
+def raw_wad_mul_ray(amount: int, rate: int) -> int:
+    """Calculates the raw value of `Wad(Ray(amount) * rate)` for a raw `Wad` amount and a raw `Ray` rate."""
+    return raw_ray_mul(decimal_floor(*decimal_round(amount * WAD_TO_RAY)), rate) // WAD_TO_RAY
+
+
+def raw_wad_div_ray(amount: int, rate: int) -> int:
+    """Calculates the raw value of `Wad(Ray(amount) / rate)` for a raw `Wad` amount and a raw `Ray` rate."""
+    return raw_ray_div(decimal_floor(*decimal_round(amount * WAD_TO_RAY)), rate) // WAD_TO_RAY
+
 
 class Conversion:
+    __slots__ = ('source_amount', 'source_token', 'target_amount', 'target_token', 'rate', 'max_source_amount', 'method')
+
     def __init__(self, source_token: Address, target_token: Address, rate: Ray, max_source_amount: Wad, method: str):
         self.source_amount = None
         self.source_token = source_token
@@ -31,12 +106,43 @@ class Conversion:
         self.max_source_amount = max_source_amount
         self.method = method
 
+    def target_amount_for(self, source_amount: Wad) -> Wad:
+        """Calculates the amount of `target_token` we get for `source_amount` of `source_token`."""
+        return Wad(Ray(source_amount) * self.rate)
+
+    def source_amount_for(self, target_amount: Wad) -> Wad:
+        """Calculates the amount of `source_token` we have to give to get `target_amount` of `target_token`."""
+        return Wad(Ray(target_amount) / self.rate)
+
+    def raw_target_amount_for(self, source_amount: int) -> int:
+        """Same as `target_amount_for`, but operating on raw integer amounts."""
+        return raw_wad_mul_ray(source_amount, self.rate.value)
+
+    def raw_source_amount_for(self, target_amount: int) -> int:
+        """Same as `source_amount_for`, but operating on raw integer amounts."""
+        return raw_wad_div_ray(target_amount, self.rate.value)
+
+    def breakpoints(self) -> List[Wad]:
+        """Returns the source amounts at which the marginal rate of this conversion changes."""
+        return [self.max_source_amount]
+
+    def resources(self) -> List[str]:
+        """Returns the identifiers of orders or actions used by this conversion.
+
+        Two conversions sharing any of them can not be executed independently of each other.
+        """
+        return [self.method]
+
     def name(self):
         raise NotImplementedError("name() not implemented")
 
     def transact(self):
         raise NotImplementedError("transact() not implemented")
 
+    def transacts(self) -> list:
+        """Returns the list of transactions which need to be executed in order to perform this conversion."""
+        return [self.transact()]
+
     def __str__(self):
         def amt(amount: Wad) -> str:
             return f"{amount} " if amount is not None else ""
@@ -46,6 +152,8 @@ class Conversion:
 
 
 class TubJoinConversion(Conversion):
+    __slots__ = ('tub',)
+
     def __init__(self, tub: Tub):
         self.tub = tub
         super().__init__(source_token=self.tub.gem(),
@@ -65,6 +173,8 @@ class TubJoinConversion(Conversion):
 
 
 class TubExitConversion(Conversion):
+    __slots__ = ('tub',)
+
     def __init__(self, tub: Tub):
         self.tub = tub
         super().__init__(source_token=self.tub.skr(),
@@ -84,6 +194,8 @@ class TubExitConversion(Conversion):
 
 
 class TubBoomConversion(Conversion):
+    __slots__ = ('tub', 'tap')
+
     def __init__(self, tub: Tub, tap: Tap):
         self.tub = tub
         self.tap = tap
@@ -113,6 +225,8 @@ class TubBoomConversion(Conversion):
 
 
 class TubBustConversion(Conversion):
+    __slots__ = ('tub', 'tap')
+
     def __init__(self, tub: Tub, tap: Tap):
         self.tub = tub
         self.tap = tap
@@ -145,6 +259,8 @@ class TubBustConversion(Conversion):
 
 
 class OasisTakeConversion(Conversion):
+    __slots__ = ('otc', 'order')
+
     def __init__(self, otc: SimpleMarket, order: Order):
         self.otc = otc
         self.order = order
@@ -182,15 +298,147 @@ class OasisTakeConversion(Conversion):
         return quantity
 
 
+class OasisBookConversion(Conversion):
+    """Takes a number of OasisDEX orders on one token pair, best ones first.
+
+    All the orders have to have the same `buy_token` and `pay_token`. The conversion behaves
+    like a piecewise-linear price curve: its `rate` is the rate of the best order, but the
+    amounts are calculated by walking through the depth of the book.
+    """
+
+    __slots__ = ('otc', 'orders', 'rates')
+
+    def __init__(self, otc: SimpleMarket, orders: List[Order]):
+        assert(isinstance(orders, list))
+        assert(len(orders) > 0)
+        assert(all(map(lambda order: order.buy_token == orders[0].buy_token, orders)))
+        assert(all(map(lambda order: order.pay_token == orders[0].pay_token, orders)))
+
+        self.otc = otc
+        self.orders = sorted(orders, key=lambda order: Ray(order.pay_amount) / Ray(order.buy_amount), reverse=True)
+        self.rates = list(map(lambda order: Ray(order.pay_amount) / Ray(order.buy_amount), self.orders))
+        super().__init__(source_token=orders[0].buy_token,
+                         target_token=orders[0].pay_token,
+                         rate=self.rates[0],
+                         max_source_amount=sum(map(lambda order: order.buy_amount, self.orders), Wad(0)),
+                         method=f"otc.take({','.join(map(lambda order: str(order.order_id), self.orders))})")
+
+    def target_amount_for(self, source_amount: Wad) -> Wad:
+        target_amount = Wad(0)
+        for order, rate in zip(self.orders, self.rates):
+            if source_amount <= Wad(0):
+                break
+
+            if source_amount >= order.buy_amount:
+                target_amount += order.pay_amount
+                source_amount -= order.buy_amount
+            else:
+                target_amount += Wad(Ray(source_amount) * rate)
+                source_amount = Wad(0)
+
+        return target_amount
+
+    def source_amount_for(self, target_amount: Wad) -> Wad:
+        source_amount = Wad(0)
+        for order, rate in zip(self.orders, self.rates):
+            if target_amount <= Wad(0):
+                break
+
+            if target_amount >= order.pay_amount:
+                source_amount += order.buy_amount
+                target_amount -= order.pay_amount
+            else:
+                source_amount += Wad(Ray(target_amount) / rate)
+                target_amount = Wad(0)
+
+        return source_amount
+
+    def raw_target_amount_for(self, source_amount: int) -> int:
+        target_amount = 0
+        for order, rate in zip(self.orders, self.rates):
+            if source_amount <= 0:
+                break
+
+            if source_amount >= order.buy_amount.value:
+                target_amount += order.pay_amount.value
+                source_amount -= order.buy_amount.value
+            else:
+                target_amount += raw_wad_mul_ray(source_amount, rate.value)
+                source_amount = 0
+
+        return target_amount
+
+    def raw_source_amount_for(self, target_amount: int) -> int:
+        source_amount = 0
+        for order, rate in zip(self.orders, self.rates):
+            if target_amount <= 0:
+                break
+
+            if target_amount >= order.pay_amount.value:
+                source_amount += order.buy_amount.value
+                target_amount -= order.pay_amount.value
+            else:
+                source_amount += raw_wad_div_ray(target_amount, rate.value)
+                target_amount = 0
+
+        return source_amount
+
+    def breakpoints(self) -> List[Wad]:
+        result = []
+        total = Wad(0)
+        for order in self.orders:
+            total += order.buy_amount
+            result.append(total)
+        return result
+
+    def id(self):
+        return self.method
+
+    def resources(self) -> List[str]:
+        return list(map(lambda order: f"otc.take({order.order_id})", self.orders))
+
+    def name(self):
+        return ", ".join(map(lambda item: f"otc.take({item[0].order_id}, '{item[1]}')", self.quantities()))
+
+    def transacts(self) -> list:
+        return list(map(lambda item: self.otc.take(item[0].order_id, item[1]), self.quantities()))
+
+    def quantities(self) -> list:
+        """Splits `target_amount` into quantities to take from each order, best orders first."""
+        result = []
+        remaining = self.target_amount
+        for order in self.orders:
+            if remaining <= Wad(0):
+                break
+
+            quantity = Wad.min(remaining, order.pay_amount)
+
+            # if by any chance rounding makes us want to buy only slightly less than the available lot,
+            # we buy everything as this is probably what we wanted in the first place
+            if order.pay_amount - quantity < Wad.from_number(0.0000000001):
+                quantity = order.pay_amount
+
+            result.append((order, quantity))
+            remaining = Wad.max(remaining - quantity, Wad(0))
+
+        return result
+
+
 class ZrxFillOrderConversion(Conversion):
-    def __init__(self, exchange: zrx.ZrxExchange, order: zrx.Order):
+    __slots__ = ('exchange', 'order')
+
+    def __init__(self, exchange: zrx.ZrxExchange, order: zrx.Order, unavailable_buy_amount: Wad = None):
         self.exchange = exchange
         self.order = order
 
+        # `unavailable_buy_amount` can be passed if it has already been fetched together with other orders
+        if unavailable_buy_amount is None:
+            unavailable_buy_amount = self.exchange.get_unavailable_buy_amount(self.order)
+
         super().__init__(source_token=order.buy_token,
                          target_token=order.pay_token,
                          rate=Ray(order.pay_amount) / Ray(order.buy_amount),
-                         max_source_amount=order.buy_amount - self.exchange.get_unavailable_buy_amount(self.order),
+                         max_source_amount=order.buy_amount - unavailable_buy_amount,
                          method=f"zrx.fill_order({hash(self.order)})")
 
     def id(self):
@@ -0,0 +1,91 @@
+# This file is part of Maker Keeper Framework.
+#
+# Copyright (C) 2018 reverendus
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from typing import Optional
+
+from pymaker.gas import GasPrice
+from pymaker.numeric import Wad
+
+
+class ProfitScaledGasPrice(GasPrice):
+    """Gas price bidding a share of the expected profit of an opportunity.
+
+    The initial gas price is chosen so that the transaction fee, for `gas` units of gas, is equal
+    to `share` of `profit` (expressed in ETH). If the transaction does not get mined, the price gets
+    increased by `increase_by` every `every_secs` seconds, which makes the transaction get replaced.
+    The price never exceeds `max_price`, nor the level at which the fee would eat up the whole profit.
+    If reaching that cap would mean an increase of less than 10%, the price does not get increased at all.
+    It never goes below `min_price` either, as long as the latter is still below the caps.
+
+    Attributes:
+        profit: Expected profit, in ETH.
+        gas: Expected number of units of gas used.
+        share: Share of the profit to bid initially, between 0 and 1.
+        min_price: Minimum gas price (in Wei).
+        max_price: Maximum gas price (in Wei).
+        increase_by: Multiplier applied to the price on each increase, needs to be at least 1.1
+            for nodes to accept the replacement transactions.
+        every_secs: Gas price increase interval (in seconds).
+    """
+
+    def __init__(self, profit: Wad, gas: int, share: float, min_price: int, max_price: int,
+                 increase_by: float = 1.125, every_secs: int = 10):
+        assert(isinstance(profit, Wad))
+        assert(isinstance(gas, int))
+        assert(gas > 0)
+        assert(isinstance(share, float))
+        assert(0 < share <= 1)
+        assert(isinstance(min_price, int))
+        assert(isinstance(max_price, int))
+        assert(isinstance(increase_by, float))
+        assert(increase_by >= 1.1)
+        assert(isinstance(every_secs, int))
+        assert(every_secs > 0)
+
+        self.profit = profit
+        self.gas = gas
+        self.share = share
+        self.min_price = min_price
+        self.max_price = max_price
+        self.increase_by = increase_by
+        self.every_secs = every_secs
+
+    def max_gas_price(self) -> int:
+        """Returns the gas price at which we would bid the whole profit, or `max_price` if lower."""
+        return max(min(self.max_price, self.profit.value // self.gas), 0)
+
+    def initial_gas_price(self) -> int:
+        return min(max(int(self.profit.value * self.share) // self.gas, self.min_price), self.max_gas_price())
+
+    def get_gas_price(self, time_elapsed: int) -> Optional[int]:
+        assert(isinstance(time_elapsed, int))
+
+        max_gas_price = self.max_gas_price()
+        gas_price = self.initial_gas_price()
+        for _ in range(time_elapsed // self.every_secs):
+            next_gas_price = min(int(gas_price * self.increase_by), max_gas_price)
+
+            # once capped, the increase can be too small for the nodes to accept the replacement
+            if next_gas_price * 10 < gas_price * 11:
+                break
+
+            gas_price = next_gas_price
+
+        return gas_price
+
+    def __repr__(self):
+        return f"ProfitScaledGasPrice(profit={self.profit}, gas={self.gas}, share={self.share})"
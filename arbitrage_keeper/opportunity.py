@@ -16,87 +16,422 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 import copy
+import heapq
+import itertools
+import math
 import operator
 from functools import reduce
-from typing import List
+from typing import Callable, Iterable, Iterator, List, Optional
 
 import networkx
 
-from arbitrage_keeper.conversion import Conversion
+from arbitrage_keeper.conversion import Conversion, RAY, raw_ray_mul
 from pymaker import Address
 from pymaker.numeric import Wad, Ray
 
 
+def always_current() -> bool:
+    """Default `is_current` check, letting the search and the sizing run until they are complete."""
+    return True
+
+
 class Sequence:
+    """Sequence of conversions, starting and ending with the same token.
+
+    Conversions are shared between all the sequences found in one block, so they never get copied
+    or modified. Amounts of each step are kept in `source_amounts` and `target_amounts` instead,
+    and only get applied to (copies of) the conversions when `steps` are accessed.
+    """
+
     def __init__(self, conversions: List[Conversion]):
         assert(isinstance(conversions, list))
-        self.steps = list(map(lambda conversion: copy.copy(conversion), conversions))
+        self.conversions = conversions
+        self.source_amounts = list(map(lambda conversion: conversion.source_amount, conversions))
+        self.target_amounts = list(map(lambda conversion: conversion.target_amount, conversions))
+        self._steps = None
         self._validate_token_chain()
 
+    @property
+    def steps(self) -> List[Conversion]:
+        """Conversions forming this sequence, with their `source_amount` and `target_amount` set."""
+        if self._steps is None:
+            self._steps = []
+            for conversion, source_amount, target_amount in zip(self.conversions, self.source_amounts, self.target_amounts):
+                step = copy.copy(conversion)
+                step.source_amount = source_amount
+                step.target_amount = target_amount
+                self._steps.append(step)
+
+        return self._steps
+
     def id(self):
-        return "->".join(map(lambda conversion: conversion.id(), self.steps))
+        return "->".join(map(lambda conversion: conversion.id(), self.conversions))
+
+    def resources(self) -> set:
+        """Returns the identifiers of all orders and actions used by this sequence."""
+        return set(itertools.chain.from_iterable(map(lambda conversion: conversion.resources(), self.conversions)))
 
     def total_rate(self) -> Ray:
         """Calculates the multiplication of all conversion rates forming this sequence.
 
         A `total_rate` > 1.0 is a general indication that executing this sequence may be profitable.
         """
-        return reduce(operator.mul, map(lambda step: step.rate, self.steps), Ray.from_number(1.0))
+        return reduce(operator.mul, map(lambda conversion: conversion.rate, self.conversions), Ray.from_number(1.0))
 
     def profit(self, token: Address) -> Wad:
         """Calculates the expected profit brought by executing this sequence (in token `token`)."""
-        return sum(map(lambda s: s.target_amount, filter(lambda s: s.target_token == token, self.steps)), Wad(0)) \
-               - sum(map(lambda s: s.source_amount, filter(lambda s: s.source_token == token, self.steps)), Wad(0))
+        profit = Wad(0)
+        for conversion, source_amount, target_amount in zip(self.conversions, self.source_amounts, self.target_amounts):
+            if conversion.target_token == token:
+                profit += target_amount
+            if conversion.source_token == token:
+                profit -= source_amount
+        return profit
 
     def set_amounts(self, initial_amount: Wad):
         def recalculate_previous_amounts(from_step_id: int):
             for id in range(from_step_id, -1, -1):
-                self.steps[id].target_amount = self.steps[id + 1].source_amount
-                self.steps[id].source_amount = Wad(Ray(self.steps[id].target_amount) / self.steps[id].rate)
+                self.target_amounts[id] = self.source_amounts[id + 1]
+                self.source_amounts[id] = self.conversions[id].source_amount_for(self.target_amounts[id])
 
         assert(isinstance(initial_amount, Wad))
-        for i in range(len(self.steps)):
+        self._steps = None
+        for i in range(len(self.conversions)):
             if i == 0:
-                self.steps[0].source_amount = initial_amount
+                self.source_amounts[0] = initial_amount
             else:
-                self.steps[i].source_amount = self.steps[i - 1].target_amount
-            if self.steps[i].source_amount > self.steps[i].max_source_amount:
-                self.steps[i].source_amount = self.steps[i].max_source_amount
+                self.source_amounts[i] = self.target_amounts[i - 1]
+            if self.source_amounts[i] > self.conversions[i].max_source_amount:
+                self.source_amounts[i] = self.conversions[i].max_source_amount
                 recalculate_previous_amounts(i - 1)
-            self.steps[i].target_amount = Wad(Ray(self.steps[i].source_amount) * self.steps[i].rate)
+            self.target_amounts[i] = self.conversions[i].target_amount_for(self.source_amounts[i])
+
+    def raw_total_rate(self) -> int:
+        """Same as `total_rate`, but returns the raw integer value of the resulting `Ray`."""
+        total_rate = RAY
+        for conversion in self.conversions:
+            total_rate = raw_ray_mul(total_rate, conversion.rate.value)
+        return total_rate
+
+    def raw_amounts(self, initial_amount: int) -> tuple:
+        """Calculates the same amounts as `set_amounts`, but on raw integers and without modifying the steps.
+
+        Returns two lists, with raw source and target amounts of each step. Only the last step which
+        had to be capped with its `max_source_amount` affects the amounts of all the steps before it,
+        so it is enough to go forward once and then to go back once from that step.
+        """
+        source_amounts = [0] * len(self.conversions)
+        target_amounts = [0] * len(self.conversions)
+        last_capped_step = 0
+
+        amount = initial_amount
+        for i, conversion in enumerate(self.conversions):
+            if amount > conversion.max_source_amount.value:
+                amount = conversion.max_source_amount.value
+                last_capped_step = i
+            source_amounts[i] = amount
+            amount = target_amounts[i] = conversion.raw_target_amount_for(amount)
+
+        for i in range(last_capped_step - 1, -1, -1):
+            target_amounts[i] = source_amounts[i + 1]
+            source_amounts[i] = self.conversions[i].raw_source_amount_for(target_amounts[i])
+
+        return source_amounts, target_amounts
+
+    def raw_profit(self, initial_amount: int, token: Address) -> int:
+        """Calculates the raw integer value of `profit` we would get after calling `set_amounts(Wad(initial_amount))`."""
+        source_amounts, target_amounts = self.raw_amounts(initial_amount)
+
+        profit = 0
+        for conversion, source_amount, target_amount in zip(self.conversions, source_amounts, target_amounts):
+            if conversion.target_token == token:
+                profit += target_amount
+            if conversion.source_token == token:
+                profit -= source_amount
+        return profit
+
+    def set_optimal_amounts(self, max_initial_amount: Wad, token: Address):
+        """Sets the amounts so the profit (in token `token`) is maximized, starting with at most `max_initial_amount`.
+
+        All conversions are piecewise-linear functions, so the profit is maximized at one of their
+        breakpoints mapped back to the first step, or at `max_initial_amount` itself. The profit is not
+        necessarily concave though (a book getting worse followed by a capped step makes it rise, fall
+        and then stay flat), so all these candidates get evaluated.
+
+        Candidates are evaluated on raw integers, only the chosen one gets applied with `set_amounts`.
+        """
+        assert(isinstance(max_initial_amount, Wad))
+        assert(isinstance(token, Address))
+
+        candidates = {max_initial_amount.value}
+        for index, conversion in enumerate(self.conversions):
+            for breakpoint in conversion.breakpoints():
+                amount = breakpoint.value
+                for previous_conversion in reversed(self.conversions[:index]):
+                    amount = previous_conversion.raw_source_amount_for(amount)
+                if 0 < amount < max_initial_amount.value:
+                    candidates.add(amount)
+        candidates = sorted(candidates)
+
+        # on a plateau we prefer the higher amount, as this is what `set_amounts` would have used
+        best = 0
+        best_profit = None
+        for index, candidate in enumerate(candidates):
+            profit = self.raw_profit(candidate, token)
+            if best_profit is None or profit >= best_profit:
+                best, best_profit = index, profit
+
+        self.set_amounts(Wad(candidates[best]))
 
     def _validate_token_chain(self):
-        for i in range(1, len(self.steps)):
-            assert(self.steps[i - 1].target_token == self.steps[i].source_token)
+        for i in range(1, len(self.conversions)):
+            assert(self.conversions[i - 1].target_token == self.conversions[i].source_token)
+
+
+def most_profitable(opportunities: Iterable[Sequence], token: Address, max_initial_amount: Wad, min_rate: Ray,
+                    min_profit: Wad, limit: int, is_current: Callable[[], bool] = always_current) -> List[Sequence]:
+    """Returns at most `limit` most profitable of `opportunities`, best first, each one of them sized
+    to engage at most `max_initial_amount` of `token`.
+
+    `opportunities` get consumed lazily. Only the ones with total rate above `min_rate` get sized
+    and only the ones bringing more than `min_profit` are considered, the profit of each of them
+    gets calculated only once. As soon as `is_current` returns `False`, no more opportunities get
+    consumed and the best ones found so far are returned.
+    """
+    assert(isinstance(token, Address))
+    assert(isinstance(max_initial_amount, Wad))
+    assert(isinstance(min_rate, Ray))
+    assert(isinstance(min_profit, Wad))
+    assert(isinstance(limit, int))
+    assert(limit > 0)
+    assert(callable(is_current))
+
+    def sized(opportunity: Sequence) -> Sequence:
+        opportunity.set_optimal_amounts(max_initial_amount, token)
+        return opportunity
+
+    opportunities = itertools.takewhile(lambda op: is_current(), opportunities)
+    opportunities = filter(lambda op: op.raw_total_rate() > min_rate.value, opportunities)
+    opportunities = map(sized, opportunities)
+    candidates = map(lambda op: (op.profit(token), op), opportunities)
+    candidates = filter(lambda candidate: candidate[0] > min_profit, candidates)
+    return [op for profit, op in heapq.nlargest(limit, candidates, key=lambda candidate: candidate[0])]
+
+
+def select_non_conflicting(opportunities: List[Sequence], max_count: int, available_amount: Wad) -> List[Sequence]:
+    """Selects up to `max_count` opportunities which can all be executed within one block.
+
+    Opportunities are considered in the order given, so the best ones should come first. An opportunity
+    gets selected only if it does not share any order or action with the ones selected before, and if
+    the combined amount engaged in all of them does not exceed `available_amount`.
+    """
+    assert(isinstance(opportunities, list))
+    assert(isinstance(max_count, int))
+    assert(isinstance(available_amount, Wad))
+
+    selected = []
+    used_resources = set()
+    engaged_amount = Wad(0)
+    for opportunity in opportunities:
+        if len(selected) >= max_count:
+            break
+
+        resources = opportunity.resources()
+        amount = opportunity.source_amounts[0]
+        if resources.isdisjoint(used_resources) and engaged_amount + amount <= available_amount:
+            selected.append(opportunity)
+            used_resources |= resources
+            engaged_amount += amount
+
+    return selected
 
 
 class OpportunityFinder:
-    def __init__(self, conversions):
+    """Finds profitable sequences by enumerating the paths in a graph of conversions.
+
+    If `min_rate` is specified, conversions which can not be part of any sequence with
+    total rate above `min_rate` are being pruned first. Then, instead of enumerating
+    all the paths, a depth-first search is used which abandons a partial sequence as soon
+    as it becomes clear that it can not be completed with total rate above `min_rate`.
+    This way the search time depends on the useful top of each order book, not on its depth.
+    """
+
+    # margin (in the logarithmic domain) protecting the pruning from floating point errors
+    PRUNING_MARGIN = 1e-9
+
+    def __init__(self, conversions, min_rate: Ray = None):
         assert(isinstance(conversions, list))
+        assert(isinstance(min_rate, Ray) or (min_rate is None))
         self.conversions = conversions
+        self.min_rate = min_rate
+
+    def find_opportunities(self, base_token: Address, max_engagement: Wad, max_steps: int = None):
+        """Finds all sequences of conversions starting and ending with `base_token`.
+
+        If `max_steps` is specified, only sequences having at most `max_steps` conversions
+        will be generated, which keeps the cost of the search predictable regardless
+        of how many conversions are available.
+        """
+        opportunities = list(self.iterate_opportunities(base_token, max_steps))
+        for opportunity in opportunities:
+            opportunity.set_amounts(max_engagement)
+        return opportunities
 
-    def find_opportunities(self, base_token: Address, max_engagement: Wad):
-        graph_links = self._prepare_graph_links()
+    def iterate_opportunities(self, base_token: Address, max_steps: int = None,
+                              is_current: Callable[[], bool] = always_current) -> Iterator[Sequence]:
+        """Lazily generates the same sequences as `find_opportunities`, without setting their amounts.
+
+        Paths are only enumerated as the consumer asks for them, so it is up to the caller
+        to decide how many of them it is interested in and how to size them. If `min_rate`
+        is specified, only the sequences which can have total rate above it get generated.
+        The search stops early as soon as `is_current` returns `False`.
+        """
+        assert(isinstance(max_steps, int) or (max_steps is None))
+        assert(callable(is_current))
+
+        if self.min_rate is not None:
+            yield from self._search(self._prune_conversions(base_token, max_steps), base_token, max_steps, is_current)
+            return
+
+        graph_links = self._prepare_graph_links(self.conversions)
         graph = networkx.DiGraph(graph_links)
-        try:
-            paths = list(networkx.shortest_simple_paths(graph, base_token.address, base_token.address + "-pre"))
+        source = base_token.address
+        target = base_token.address + "-pre"
+        if source not in graph or target not in graph:
+            return
+
+        if max_steps is None:
+            paths = networkx.shortest_simple_paths(graph, source, target)
+        else:
+            # each conversion is represented by three edges in the graph, apart from
+            # the last one which ends at the `-pre` node of the base token
+            paths = networkx.all_simple_paths(graph, source, target, cutoff=3*max_steps - 1)
 
-            opportunities = []
+        try:
             for path in paths:
+                if not is_current():
+                    return
+
                 conversions = []
                 for i in range(0, len(path)-1):
                     if 'conversion' in graph_links[path[i]][path[i+1]]:
                         conversions.append(graph_links[path[i]][path[i+1]]['conversion'])
 
-                sequence = Sequence(conversions=conversions)
-                sequence.set_amounts(max_engagement)
-                opportunities.append(sequence)
-
-            return opportunities
+                yield Sequence(conversions=conversions)
         except networkx.exception.NetworkXNoPath:
-            return []
+            return
+
+    def _search(self, conversions: List[Conversion], base_token: Address, max_steps: Optional[int],
+                is_current: Callable[[], bool]) -> Iterator[Sequence]:
+        """Depth-first search for sequences with total rate above `min_rate`, with branch-and-bound pruning.
+
+        The search carries the product of rates of the partial sequence. A branch gets cut off
+        if even the best walk back to `base_token` within the remaining number of steps can not
+        bring the total rate above `min_rate`. As this bound never underestimates, no sequence
+        with total rate above `min_rate` gets lost. Sequences visit each token at most once,
+        exactly like the paths enumerated in the graph. Once `is_current` returns `False`,
+        no more branches get expanded.
+        """
+        threshold = math.log(float(self.min_rate)) - self.PRUNING_MARGIN
+        best_rates = self._best_rates(conversions)
+        max_length = self._max_length(best_rates, max_steps)
+        to_base = self._best_walks(best_rates, base_token.address, max_length - 1, reverse=True)
+        log_rates = {id(conversion): math.log(float(conversion.rate)) for conversion in conversions}
+
+        # conversions having the same target token and the same method are represented by the
+        # same node in the graph, we keep the same semantics here
+        outgoing = {}
+        for conversion in conversions:
+            src = conversion.source_token.address
+            outgoing.setdefault(src, {})[conversion.target_token.address + "-via-" + conversion.method] = conversion
 
-    def _prepare_graph_links(self):
+        def expand(path: list, visited: set, rate: float):
+            token = path[-1].target_token.address if len(path) > 0 else base_token.address
+            for conversion in outgoing.get(token, {}).values():
+                if not is_current():
+                    return
+
+                dst = conversion.target_token.address
+                total_rate = rate + log_rates[id(conversion)]
+                if dst == base_token.address:
+                    if total_rate >= threshold:
+                        yield Sequence(conversions=path + [conversion])
+
+                elif len(path) + 1 < max_length and dst not in visited:
+                    if total_rate + to_base[max_length - len(path) - 1].get(dst, -math.inf) >= threshold:
+                        yield from expand(path + [conversion], visited | {dst}, total_rate)
+
+        yield from expand([], {base_token.address}, 0.0)
+
+    def _prune_conversions(self, base_token: Address, max_steps: Optional[int]) -> List[Conversion]:
+        """Drops the conversions which can not be part of a sequence with total rate above `min_rate`.
+
+        For each pair of tokens only the best rate is taken into account. Based on these,
+        the best possible rates of getting from `base_token` to each token and from each token
+        back to `base_token` are calculated. As the walks considered this way include all
+        the simple paths, a conversion for which even these best rates can not make a sequence
+        with total rate above `min_rate` can be safely dropped. Dropping conversions can lower
+        the best rates, so the process gets repeated until nothing else can be dropped.
+        """
+        threshold = math.log(float(self.min_rate)) - self.PRUNING_MARGIN
+        conversions = list(filter(lambda conversion: conversion.rate > Ray(0), self.conversions))
+        while True:
+            best_rates = self._best_rates(conversions)
+            max_length = self._max_length(best_rates, max_steps)
+            from_base = self._best_walks(best_rates, base_token.address, max_length - 1, reverse=False)[-1]
+            to_base = self._best_walks(best_rates, base_token.address, max_length - 1, reverse=True)[-1]
+
+            def bound(conversion: Conversion) -> float:
+                return from_base.get(conversion.source_token.address, -math.inf) \
+                       + math.log(float(conversion.rate)) \
+                       + to_base.get(conversion.target_token.address, -math.inf)
+
+            pruned = list(filter(lambda conversion: bound(conversion) >= threshold, conversions))
+            if len(pruned) == len(conversions):
+                return pruned
+
+            conversions = pruned
+
+    @staticmethod
+    def _best_rates(conversions: List[Conversion]) -> dict:
+        """Returns the best log rate for each pair of tokens."""
+        best_rates = {}
+        for conversion in conversions:
+            pair = (conversion.source_token.address, conversion.target_token.address)
+            best_rates[pair] = max(best_rates.get(pair, -math.inf), math.log(float(conversion.rate)))
+        return best_rates
+
+    @staticmethod
+    def _max_length(best_rates: dict, max_steps: Optional[int]) -> int:
+        """Returns the maximum number of steps a sequence can have, as it can not visit a token twice."""
+        tokens = set(map(lambda pair: pair[0], best_rates)) | set(map(lambda pair: pair[1], best_rates))
+        return min(max_steps, len(tokens)) if max_steps is not None else len(tokens)
+
+    @staticmethod
+    def _best_walks(best_rates: dict, token: str, max_length: int, reverse: bool) -> List[dict]:
+        """Calculates the best log rates of walks from (or to) `token`.
+
+        The k-th element of the result holds the best log rates of walks of at most k steps.
+        """
+        result = [{token: 0.0}]
+        current = {token: 0.0}
+        for _ in range(max_length):
+            following = {}
+            for (src, dst), rate in best_rates.items():
+                start, end = (dst, src) if reverse else (src, dst)
+                if start in current and current[start] + rate > following.get(end, -math.inf):
+                    following[end] = current[start] + rate
+
+            walks = dict(result[-1])
+            for end, rate in following.items():
+                walks[end] = max(walks.get(end, -math.inf), rate)
+            result.append(walks)
+            current = following
+
+        return result
+
+    @staticmethod
+    def _prepare_graph_links(conversions: List[Conversion]):
         def add_empty_link(dod, link_from, link_to):
             if link_from not in dod:
                 dod[link_from] = {}
@@ -108,10 +443,162 @@ class OpportunityFinder:
             dod[link_from][link_to] = {'conversion': conversion}
 
         links = {}
-        for conversion in self.conversions:
+        for conversion in conversions:
             src = conversion.source_token.address
             dst = conversion.target_token.address
             add_empty_link(links, src + "-pre", src)
             add_conversion_link(links, src, dst + "-via-" + conversion.method, conversion)
             add_empty_link(links, dst + "-via-" + conversion.method, dst + "-pre")
         return links
+
+
+class NegativeCycleFinder:
+    """Finds profitable sequences using Bellman-Ford over negative logarithms of conversion rates.
+
+    A sequence is profitable if the product of its rates is greater than one, which is the same
+    as the sum of `-log(rate)` being negative. The search relaxes the edges layer by layer, so
+    for each number of steps and each conversion leading back to the base token it identifies
+    the best simple cycle, instead of enumerating all the paths.
+
+    Paths reaching a token through different sets of tokens are kept apart, as the best of them
+    may be blocked later on by a token it has already visited. The number of paths kept grows with
+    the number of subsets of tokens, but not with the number of conversions between them.
+    """
+
+    def __init__(self, conversions):
+        assert(isinstance(conversions, list))
+        self.conversions = conversions
+
+    def find_opportunities(self, base_token: Address, max_engagement: Wad, max_steps: int = None):
+        opportunities = list(self.iterate_opportunities(base_token, max_steps))
+        for opportunity in opportunities:
+            opportunity.set_amounts(max_engagement)
+        return opportunities
+
+    def iterate_opportunities(self, base_token: Address, max_steps: int = None,
+                              is_current: Callable[[], bool] = always_current) -> Iterator[Sequence]:
+        assert(isinstance(max_steps, int) or (max_steps is None))
+        assert(callable(is_current))
+
+        edges = list(filter(lambda conversion: conversion.rate > Ray(0), self.conversions))
+        tokens = set(map(lambda conversion: conversion.source_token.address, edges)) | \
+                 set(map(lambda conversion: conversion.target_token.address, edges))
+        max_length = min(max_steps, len(tokens)) if max_steps is not None else len(tokens)
+
+        weights = {id(conversion): -math.log(float(conversion.rate)) for conversion in edges}
+        closing_edges = list(filter(lambda conversion: conversion.target_token == base_token, edges))
+        inner_edges = {}
+        for conversion in edges:
+            if conversion.target_token != base_token and conversion.target_token != conversion.source_token:
+                inner_edges.setdefault(conversion.source_token.address, []).append(conversion)
+
+        # `layers[k]` maps (`token`, tokens visited before it) to the weight of the best simple path
+        # of `k` steps from `base_token` to `token` through exactly these tokens, the last conversion
+        # of that path and the key of the path it extends
+        layers = [{(base_token.address, frozenset()): (0.0, None, None)}]
+        for length in range(1, max_length + 1):
+            if not is_current():
+                return
+
+            previous_layer = layers[length - 1]
+
+            for conversion in closing_edges:
+                src = conversion.source_token.address
+                if src == base_token.address:
+                    continue
+
+                keys = list(filter(lambda key: key[0] == src, previous_layer.keys()))
+                if len(keys) > 0:
+                    key = min(keys, key=lambda key: previous_layer[key][0])
+                    if previous_layer[key][0] + weights[id(conversion)] < 0:
+                        yield Sequence(conversions=self._path(layers, length - 1, key) + [conversion])
+
+            if length == max_length:
+                break
+
+            layer = {}
+            for key, (weight, _, _) in previous_layer.items():
+                if not is_current():
+                    return
+
+                src, visited = key
+                for conversion in inner_edges.get(src, []):
+                    dst = conversion.target_token.address
+                    if dst in visited:
+                        continue
+
+                    next_key = (dst, visited | {src})
+                    next_weight = weight + weights[id(conversion)]
+                    if next_key not in layer or next_weight < layer[next_key][0]:
+                        layer[next_key] = (next_weight, conversion, key)
+            layers.append(layer)
+
+    @staticmethod
+    def _path(layers: list, length: int, key: tuple) -> List[Conversion]:
+        path = []
+        for index in range(length, 0, -1):
+            _, conversion, key = layers[index][key]
+            path.insert(0, conversion)
+        return path
+
+
+class TemplateFinder:
+    """Finds profitable sequences by filling precomputed token-level cycles with the best conversions.
+
+    The set of tokens the keeper trades is small and fixed, so all the cycles of tokens starting
+    and ending with the base token (templates) can be enumerated only once, using `templates()`.
+    Finding opportunities then comes down to picking the conversion with the best rate for
+    each hop of each template, instead of traversing a graph of all the conversions.
+    """
+
+    def __init__(self, conversions, templates: List[List[Address]]):
+        assert(isinstance(conversions, list))
+        assert(isinstance(templates, list))
+        self.conversions = conversions
+        self.templates = templates
+
+    @staticmethod
+    def templates(tokens: List[Address], base_token: Address, max_steps: int = None) -> List[List[Address]]:
+        """Enumerates all cycles of `tokens` starting and ending with `base_token`.
+
+        Each template is a list of tokens starting with `base_token`, with the last hop
+        going back to `base_token` implied. Templates are sorted by the number of hops.
+        """
+        assert(isinstance(tokens, list))
+        assert(isinstance(base_token, Address))
+        assert(isinstance(max_steps, int) or (max_steps is None))
+
+        other_tokens = list(filter(lambda token: token != base_token, tokens))
+        max_length = min(max_steps - 1, len(other_tokens)) if max_steps is not None else len(other_tokens)
+        return [[base_token] + list(permutation)
+                for length in range(1, max_length + 1)
+                for permutation in itertools.permutations(other_tokens, length)]
+
+    def find_opportunities(self, base_token: Address, max_engagement: Wad, max_steps: int = None):
+        opportunities = list(self.iterate_opportunities(base_token, max_steps))
+        for opportunity in opportunities:
+            opportunity.set_amounts(max_engagement)
+        return opportunities
+
+    def iterate_opportunities(self, base_token: Address, max_steps: int = None,
+                              is_current: Callable[[], bool] = always_current) -> Iterator[Sequence]:
+        assert(isinstance(max_steps, int) or (max_steps is None))
+        assert(callable(is_current))
+
+        best_conversions = {}
+        for conversion in self.conversions:
+            pair = (conversion.source_token.address, conversion.target_token.address)
+            if conversion.rate > Ray(0) and (pair not in best_conversions or conversion.rate > best_conversions[pair].rate):
+                best_conversions[pair] = conversion
+
+        for template in self.templates:
+            if not is_current():
+                return
+
+            if template[0] != base_token or (max_steps is not None and len(template) > max_steps):
+                continue
+
+            tokens = list(map(lambda token: token.address, template))
+            hops = list(zip(tokens, tokens[1:] + tokens[:1]))
+            if all(hop in best_conversions for hop in hops):
+                yield Sequence(conversions=[best_conversions[hop] for hop in hops])
@@ -0,0 +1,231 @@
+# This file is part of Maker Keeper Framework.
+#
+# Copyright (C) 2018 reverendus
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import heapq
+import logging
+import threading
+import time
+from typing import List, Optional, Tuple
+
+from eth_utils import decode_hex, encode_hex, event_abi_to_log_topic, keccak
+
+from pymaker import Address
+from pymaker.numeric import Wad
+from pymaker.oasis import SimpleMarket, Order
+from pymaker.zrx import Order as ZrxOrder
+
+
+class OasisOrderBook:
+    """Local mirror of the OasisDEX order book, limited to the orders between `tokens`.
+
+    The book is downloaded only once, pair by pair, so `MatchingMarket` can use the support
+    contract or its sorted lists of orders instead of reading every order ever made. After that,
+    on each synchronization only the orders mentioned in `LogMake`, `LogTake` and `LogKill` events
+    emitted since the previous one get read again, so the cost of keeping the book up to date
+    depends on the number of changes and not on the size of the book.
+    """
+
+    logger = logging.getLogger('oasis-order-book')
+
+    # events emitted whenever an order gets created, taken or cancelled, each one of them has the order `id`
+    ORDER_EVENTS = ['LogMake', 'LogTake', 'LogKill']
+
+    def __init__(self, otc: SimpleMarket, tokens: List[Address]):
+        assert(isinstance(otc, SimpleMarket))
+        assert(isinstance(tokens, list))
+
+        self.otc = otc
+        self.tokens = tokens
+        self.orders = {}
+        self.last_block_number = None
+        self._lock = threading.Lock()
+
+    def sync(self):
+        """Brings the local order book up to date with the latest block."""
+        with self._lock:
+            self._sync()
+
+    def _sync(self):
+        block_number = self.otc.web3.eth.blockNumber
+
+        if self.last_block_number is None:
+            self.orders = {order.order_id: order
+                           for pay_token in self.tokens for buy_token in self.tokens if pay_token != buy_token
+                           for order in self.otc.get_orders(pay_token, buy_token)}
+            self.logger.info(f"Downloaded {len(self.orders)} OasisDEX orders at block #{block_number}")
+
+        elif block_number > self.last_block_number:
+            # we start from the last block we have already seen, as some of its events could have been
+            # emitted after we read it. reading the same order twice does not do any harm.
+            order_ids = self._changed_order_ids(self.last_block_number, block_number)
+            for order_id in order_ids:
+                self._update_order(order_id, self.otc.get_order(order_id))
+
+            self.logger.debug(f"Applied changes to {len(order_ids)} OasisDEX orders up to block #{block_number}")
+
+        self.last_block_number = block_number
+
+    def snapshot(self) -> Tuple[List[Order], Optional[int]]:
+        """Returns all the orders and the number of the last block they reflect, consistent with each other."""
+        with self._lock:
+            return list(self.orders.values()), self.last_block_number
+
+    def restore(self, orders: List[Order], block_number: int):
+        """Replaces the local order book with `orders` as of `block_number`.
+        The next synchronization will only read the changes which happened since then."""
+        assert(isinstance(orders, list))
+        assert(isinstance(block_number, int))
+
+        with self._lock:
+            self.orders = {order.order_id: order for order in orders}
+            self.last_block_number = block_number
+
+    def get_orders(self, pay_token: Address = None, buy_token: Address = None) -> List[Order]:
+        """Returns the orders from the local order book, optionally filtered by `pay_token` and `buy_token`."""
+        with self._lock:
+            orders = list(self.orders.values())
+
+        if pay_token is not None:
+            orders = list(filter(lambda order: order.pay_token == pay_token, orders))
+        if buy_token is not None:
+            orders = list(filter(lambda order: order.buy_token == buy_token, orders))
+        return sorted(orders, key=lambda order: order.order_id)
+
+    def _changed_order_ids(self, from_block: int, to_block: int) -> set:
+        """Reads the ids of the orders mentioned in the `ORDER_EVENTS` emitted from `from_block` to `to_block`.
+
+        The block range is passed explicitly, as opposed to a number of past blocks which would get counted
+        back from whatever the latest block is at the moment of the call, so no block can slip in between.
+        All the events are read with one `eth_getLogs` call.
+        """
+        contract = self.otc._contract
+        event_abis = list(filter(lambda abi: abi['type'] == 'event' and abi['name'] in self.ORDER_EVENTS, contract.abi))
+        logs = self.otc.web3.eth.getLogs({'address': self.otc.address.address,
+                                          'fromBlock': from_block,
+                                          'toBlock': to_block,
+                                          'topics': [list(map(lambda abi: encode_hex(event_abi_to_log_topic(abi)), event_abis))]})
+
+        receipt = {'logs': logs}
+        return set(int.from_bytes(event['args']['id'], byteorder='big')
+                   for event_name in self.ORDER_EVENTS
+                   for event in getattr(contract.events, event_name)().processReceipt(receipt))
+
+    def _update_order(self, order_id: int, order: Optional[Order]):
+        if order is not None and order.pay_amount > Wad(0) and \
+                order.pay_token in self.tokens and order.buy_token in self.tokens:
+            self.orders[order_id] = order
+        elif order_id in self.orders:
+            del self.orders[order_id]
+
+
+def zrx_order_key(maker: str, salt: int) -> Tuple[str, int]:
+    """Identifies a 0x order by its maker and salt, the same way pending transactions refer to it."""
+    return maker.lower(), int(salt)
+
+
+def zrx_order_hash(exchange_address: Address, order: ZrxOrder) -> bytes:
+    """Calculates the hash of a 0x order locally, exactly like `getOrderHash` of the 0x v1 exchange does.
+
+    The hash is the keccak of the tightly packed exchange address, the order addresses and the order values.
+    """
+    assert(isinstance(exchange_address, Address))
+    assert(isinstance(order, ZrxOrder))
+
+    addresses = [exchange_address, order.maker, order.taker, order.pay_token, order.buy_token, order.fee_recipient]
+    values = [order.pay_amount.value, order.buy_amount.value, order.maker_fee.value, order.taker_fee.value,
+              order.expiration, order.salt]
+    return keccak(b''.join(map(lambda address: decode_hex(address.address), addresses)) +
+                  b''.join(map(lambda value: int(value).to_bytes(32, byteorder='big'), values)))
+
+
+class ZrxOrderBook:
+    """Local mirror of the 0x order book of a relayer.
+
+    Orders are received incrementally from `feed`, which needs to have a `poll()` method returning
+    the orders which appeared since the previous call and the keys (see `zrx_order_key`) of the
+    ones which have disappeared. Orders are indexed by expiration time in a heap, so expired orders
+    get evicted without having to look at the remaining ones.
+    """
+
+    logger = logging.getLogger('zrx-order-book')
+
+    def __init__(self, feed):
+        assert(callable(getattr(feed, 'poll', None)))
+
+        self.feed = feed
+        self.orders = {}
+        self.expirations = []
+        self._lock = threading.Lock()
+
+    def sync(self, now: Optional[int] = None):
+        """Applies the changes received from the feed and evicts the orders expired by `now`."""
+        added_orders, removed_keys = self.feed.poll()
+
+        with self._lock:
+            for key in removed_keys:
+                self.orders.pop(key, None)
+
+            for order in added_orders:
+                self._add_order(order)
+
+            self._evict_expired(now if now is not None else int(time.time()))
+
+            # entries of orders removed before they expired stay in the heap until they expire,
+            # so we rebuild it if they become the majority
+            if len(self.expirations) > 2 * len(self.orders) + 64:
+                self.expirations = list(map(lambda item: (item[1].expiration, item[0]), self.orders.items()))
+                heapq.heapify(self.expirations)
+
+        self.logger.debug(f"Received {len(added_orders)} new and {len(removed_keys)} removed 0x orders,"
+                          f" {len(self.orders)} orders in the book")
+
+    def get_orders(self, pay_token: Address = None, buy_token: Address = None) -> List[ZrxOrder]:
+        """Returns the orders from the local order book, optionally filtered by `pay_token` and `buy_token`."""
+        with self._lock:
+            orders = list(self.orders.values())
+
+        if pay_token is not None:
+            orders = list(filter(lambda order: order.pay_token == pay_token, orders))
+        if buy_token is not None:
+            orders = list(filter(lambda order: order.buy_token == buy_token, orders))
+        return orders
+
+    def restore(self, orders: List[ZrxOrder]):
+        """Adds `orders`, for example loaded from a snapshot, to the local order book."""
+        assert(isinstance(orders, list))
+
+        with self._lock:
+            for order in orders:
+                self._add_order(order)
+
+    def remove(self, order: ZrxOrder):
+        """Removes `order` from the local order book, for example after it has been fully filled or cancelled."""
+        with self._lock:
+            self.orders.pop(zrx_order_key(order.maker.address, order.salt), None)
+
+    def _add_order(self, order: ZrxOrder):
+        key = zrx_order_key(order.maker.address, order.salt)
+        if key not in self.orders:
+            self.orders[key] = order
+            heapq.heappush(self.expirations, (order.expiration, key))
+
+    def _evict_expired(self, now: int):
+        while len(self.expirations) > 0 and self.expirations[0][0] <= now:
+            expiration, key = heapq.heappop(self.expirations)
+            order = self.orders.get(key)
+            if order is not None and order.expiration == expiration:
+                del self.orders[key]
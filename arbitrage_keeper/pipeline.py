@@ -0,0 +1,140 @@
+# This file is part of Maker Keeper Framework.
+#
+# Copyright (C) 2018 reverendus
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import logging
+import threading
+import time
+from typing import Callable, Optional
+
+
+class BlockJob:
+    """Processing of one block by the `LatestBlockPipeline`.
+
+    Lets the processing function check if the work it is doing is still relevant, i.e. if no
+    newer block has arrived in the meantime and if the computation deadline has not passed.
+    """
+
+    def __init__(self, pipeline, block_number: int, deadline: Optional[float]):
+        assert(isinstance(pipeline, LatestBlockPipeline))
+        assert(isinstance(block_number, int))
+        assert(isinstance(deadline, float) or (deadline is None))
+
+        self.pipeline = pipeline
+        self.block_number = block_number
+        self.deadline = deadline
+
+    def is_superseded(self) -> bool:
+        return self.pipeline.latest_block_number > self.block_number
+
+    def is_overdue(self) -> bool:
+        return self.deadline is not None and time.time() > self.deadline
+
+    def is_current(self) -> bool:
+        return not self.is_superseded() and not self.is_overdue()
+
+    def __repr__(self):
+        return f"BlockJob({self.block_number})"
+
+
+class LatestBlockPipeline:
+    """Processes blocks on a separate thread, always jumping to the newest one.
+
+    Blocks are submitted by the `Lifecycle` callback, which returns immediately. If more than one
+    block arrives while the previous one is being processed, only the newest one gets processed
+    and the intermediate ones are dropped and counted as skipped. If `deadline` (in seconds)
+    is specified, each `BlockJob` expires that long after its processing started.
+    """
+
+    logger = logging.getLogger('latest-block-pipeline')
+
+    def __init__(self, process: Callable[[BlockJob], None], deadline: Optional[float] = None):
+        assert(callable(process))
+        assert(isinstance(deadline, float) or isinstance(deadline, int) or (deadline is None))
+
+        self.process = process
+        self.deadline = deadline
+        self.latest_block_number = None
+        self.last_processed_block_number = None
+        self.processed_blocks = 0
+        self.skipped_blocks = 0
+        self.overdue_blocks = 0
+
+        self._condition = threading.Condition()
+        self._running = False
+        self._thread = None
+
+    def start(self):
+        with self._condition:
+            self._running = True
+        self._thread = threading.Thread(target=self._run, name='latest-block-pipeline', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        with self._condition:
+            self._running = False
+            self._condition.notify()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def submit(self, block_number: int):
+        """Makes `block_number` the block to be processed next, unless a newer one has been submitted already."""
+        assert(isinstance(block_number, int))
+
+        with self._condition:
+            if self.latest_block_number is None or block_number > self.latest_block_number:
+                self.latest_block_number = block_number
+                self._condition.notify()
+
+    def _next_block_number(self) -> Optional[int]:
+        with self._condition:
+            while self._running and not self._has_new_block():
+                self._condition.wait()
+
+            return self.latest_block_number if self._running else None
+
+    def _has_new_block(self) -> bool:
+        return self.latest_block_number is not None and \
+               (self.last_processed_block_number is None or self.latest_block_number > self.last_processed_block_number)
+
+    def _run(self):
+        while True:
+            block_number = self._next_block_number()
+            if block_number is None:
+                break
+
+            self.process_block(block_number)
+
+    def process_block(self, block_number: int):
+        if self.last_processed_block_number is not None and block_number > self.last_processed_block_number + 1:
+            self.skipped_blocks += block_number - self.last_processed_block_number - 1
+            self.logger.info(f"Skipped blocks #{self.last_processed_block_number + 1}-#{block_number - 1},"
+                             f" jumping to the newest block #{block_number}"
+                             f" ({self.skipped_blocks} skipped, {self.processed_blocks} processed so far)")
+
+        self.last_processed_block_number = block_number
+        job = BlockJob(self, block_number, time.time() + self.deadline if self.deadline is not None else None)
+        try:
+            self.process(job)
+        except Exception as e:
+            self.logger.exception(f"Failed to process block #{block_number}: {e}")
+
+        self.processed_blocks += 1
+        if job.is_overdue():
+            self.overdue_blocks += 1
+            self.logger.warning(f"Processing of block #{block_number} exceeded the deadline of {self.deadline}s"
+                                f" ({self.overdue_blocks} overdue so far)")
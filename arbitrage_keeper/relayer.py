@@ -0,0 +1,139 @@
+# This file is part of Maker Keeper Framework.
+#
+# Copyright (C) 2018 reverendus
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Tuple
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from arbitrage_keeper.order_book import zrx_order_key
+from pymaker import Address
+from pymaker.zrx import ZrxExchange, Order
+
+
+class RelayerClient:
+    """Client of a 0x Standard Relayer API (v0), fetching pages of orders in parallel.
+
+    All the requests go through one `requests.Session`, so the keep-alive connections to the relayer
+    get reused between pages, token pairs and blocks. The first page is requested on its own, as most
+    books fit in it. Only if it is full, the following pages are requested in waves of `pages_per_wave`
+    concurrent requests. The next wave is only requested if all pages of the previous one were full.
+    """
+
+    logger = logging.getLogger('relayer-client')
+
+    def __init__(self, exchange: ZrxExchange, api_server: str, per_page: int = 100, pages_per_wave: int = 4,
+                 pool_size: int = 8, timeout: float = 10.0):
+        assert(isinstance(exchange, ZrxExchange))
+        assert(isinstance(api_server, str))
+        assert(isinstance(per_page, int))
+        assert(isinstance(pages_per_wave, int))
+        assert(isinstance(pool_size, int))
+        assert(isinstance(timeout, float))
+
+        self.exchange = exchange
+        self.api_server = api_server
+        self.per_page = per_page
+        self.pages_per_wave = pages_per_wave
+        self.timeout = timeout
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+        # pages are fetched on a pool of their own, as token pairs can be fetched
+        # concurrently on a shared one, waiting for the pages
+        self.executor = ThreadPoolExecutor(max_workers=pool_size)
+
+    def get_orders(self, pay_token: Address, buy_token: Address) -> List[Order]:
+        """Returns all the orders selling `pay_token` for `buy_token` available on the relayer."""
+        assert(isinstance(pay_token, Address))
+        assert(isinstance(buy_token, Address))
+
+        return list(map(lambda item: Order.from_json(self.exchange, item), self.get_raw_orders(pay_token, buy_token)))
+
+    def get_raw_orders(self, pay_token: Address, buy_token: Address) -> List[dict]:
+        """Returns all the orders selling `pay_token` for `buy_token`, as received from the relayer."""
+        assert(isinstance(pay_token, Address))
+        assert(isinstance(buy_token, Address))
+
+        result = self._get_page(pay_token, buy_token, 1)
+        if len(result) < self.per_page:
+            return result
+
+        first_page = 2
+        while True:
+            pages = list(self.executor.map(lambda page: self._get_page(pay_token, buy_token, page),
+                                           range(first_page, first_page + self.pages_per_wave)))
+            for page in pages:
+                result += page
+                if len(page) < self.per_page:
+                    return result
+
+            first_page += self.pages_per_wave
+
+    def _get_page(self, pay_token: Address, buy_token: Address, page: int) -> List[dict]:
+        response = self.session.get(f"{self.api_server}/orders", params={'exchangeContractAddress': self.exchange.address.address,
+                                                                          'makerTokenAddress': pay_token.address,
+                                                                          'takerTokenAddress': buy_token.address,
+                                                                          'page': page,
+                                                                          'per_page': self.per_page}, timeout=self.timeout)
+        response.raise_for_status()
+        return response.json()
+
+
+class RelayerFeed:
+    """Feed of changes to the 0x order book of a relayer, to be consumed by `ZrxOrderBook`.
+
+    The Standard Relayer API (v0) does not let us ask only for the orders changed since a given
+    moment, so the feed polls the books of all `token_pairs` and compares them with what it has
+    seen previously. Only the orders it has not seen yet get decoded and passed on.
+    """
+
+    def __init__(self, relayer: RelayerClient, token_pairs: list, executor: ThreadPoolExecutor):
+        assert(isinstance(relayer, RelayerClient))
+        assert(isinstance(token_pairs, list))
+        assert(isinstance(executor, ThreadPoolExecutor))
+
+        self.relayer = relayer
+        self.token_pairs = token_pairs
+        self.executor = executor
+        self.seen_keys = set()
+
+    def restore(self, orders: List[Order]):
+        """Marks `orders`, restored to the order book from elsewhere, as already seen."""
+        assert(isinstance(orders, list))
+
+        self.seen_keys = set(map(lambda order: zrx_order_key(order.maker.address, order.salt), orders))
+
+    def poll(self) -> Tuple[List[Order], List[tuple]]:
+        """Returns the orders which appeared since the previous poll and the keys of the ones which have disappeared."""
+        raw_orders_by_pair = list(self.executor.map(lambda pair: self.relayer.get_raw_orders(pair[0], pair[1]), self.token_pairs))
+
+        raw_orders = {}
+        for raw_order in [item for items in raw_orders_by_pair for item in items]:
+            raw_orders[zrx_order_key(raw_order['maker'], raw_order['salt'])] = raw_order
+
+        added_orders = [Order.from_json(self.relayer.exchange, raw_order)
+                        for key, raw_order in raw_orders.items() if key not in self.seen_keys]
+        removed_keys = list(self.seen_keys.difference(raw_orders.keys()))
+
+        self.seen_keys = set(raw_orders.keys())
+        return added_orders, removed_keys
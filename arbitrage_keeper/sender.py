@@ -0,0 +1,177 @@
+# This file is part of Maker Keeper Framework.
+#
+# Copyright (C) 2018 reverendus
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+from typing import List, Optional
+
+from web3 import Web3
+
+from pymaker import Address, Receipt
+from pymaker.gas import GasPrice
+
+
+class PipelinedSender:
+    """Sends a number of transactions back to back, using consecutive nonces.
+
+    All the transactions get broadcast before any of them is mined, so they can all end up
+    in the same block. The gas limit has to be given upfront, as gas can not be estimated for
+    transactions depending on the effects of the preceding ones. Receipts are waited for
+    concurrently on `executor`. While they are being waited for, the transactions not mined yet
+    get resent with the same nonces every time the gas price strategy comes up with a higher price.
+    If a transaction fails, the ones following it which have not been mined yet get replaced with
+    empty transactions, so they do not get executed on their own.
+    """
+
+    logger = logging.getLogger('pipelined-sender')
+
+    # gas price increase needed by the nodes to accept a replacement transaction
+    REPLACEMENT_GAS_PRICE_INCREASE = 1.125
+
+    def __init__(self, web3: Web3, our_address: Address, executor: ThreadPoolExecutor, gas: int, timeout: int = 600):
+        assert(isinstance(web3, Web3))
+        assert(isinstance(our_address, Address))
+        assert(isinstance(executor, ThreadPoolExecutor))
+        assert(isinstance(gas, int))
+        assert(isinstance(timeout, int))
+
+        self.web3 = web3
+        self.our_address = our_address
+        self.executor = executor
+        self.gas = gas
+        self.timeout = timeout
+
+    def send(self, transactions: List[dict], gas_price: int) -> List[bytes]:
+        """Broadcasts `transactions` (dictionaries with `to` and `data`) with consecutive nonces.
+
+        Returns the transaction hashes, does not wait for them to get mined.
+        """
+        assert(isinstance(transactions, list))
+        assert(isinstance(gas_price, int))
+
+        return self._send(transactions, gas_price, self.web3.eth.getTransactionCount(self.our_address.address, 'pending'))
+
+    def _send(self, transactions: List[dict], gas_price: int, nonce: int) -> List[bytes]:
+        tx_hashes = []
+        for index, transaction in enumerate(transactions):
+            tx_hash = self.web3.eth.sendTransaction({'from': self.our_address.address,
+                                                     'to': transaction['to'],
+                                                     'data': transaction['data'],
+                                                     'nonce': nonce + index,
+                                                     'gas': self.gas,
+                                                     'gasPrice': gas_price})
+            self.logger.info(f"Sent transaction {self.web3.toHex(tx_hash)} with nonce={nonce + index}")
+            tx_hashes.append(tx_hash)
+
+        return tx_hashes
+
+    def execute(self, transactions: List[dict], gas_price: GasPrice, independent: bool = False) -> List[Optional[Receipt]]:
+        """Sends `transactions` with consecutive nonces and waits until all of them get mined.
+
+        Returns the receipt of each transaction, or `None` for each one which has failed
+        or has not been executed because one of the preceding transactions has failed.
+        If the transactions are `independent`, a failed one does not affect the ones following it.
+        """
+        assert(isinstance(transactions, list))
+        assert(isinstance(gas_price, GasPrice))
+        assert(isinstance(independent, bool))
+
+        if len(transactions) == 0:
+            return []
+
+        started = time.time()
+        current_gas_price = gas_price.get_gas_price(0) or self.web3.eth.gasPrice
+        first_nonce = self.web3.eth.getTransactionCount(self.our_address.address, 'pending')
+        tx_hashes = [[tx_hash] for tx_hash in self._send(transactions, current_gas_price, first_nonce)]
+        futures = [self.executor.submit(self._wait_for_receipt, tx_hashes[index], first_nonce + index)
+                   for index in range(len(transactions))]
+
+        receipts = []
+        failed = False
+        for index, future in enumerate(futures):
+            if failed and not future.done():
+                self._cancel(first_nonce + index, current_gas_price)
+
+            while not failed and not future.done():
+                new_gas_price = gas_price.get_gas_price(int(time.time() - started))
+                if new_gas_price is not None and new_gas_price > current_gas_price:
+                    current_gas_price = new_gas_price
+                    for other_index in range(index, len(futures)):
+                        if not futures[other_index].done():
+                            self._replace(transactions[other_index], tx_hashes[other_index],
+                                          first_nonce + other_index, current_gas_price)
+
+                wait([future], timeout=1)
+
+            receipt = future.result()
+            if receipt is not None and receipt['status'] == 1:
+                receipts.append(Receipt(receipt))
+            elif independent:
+                self.logger.warning(f"Transaction with nonce={first_nonce + index} failed")
+                receipts.append(None)
+            else:
+                if not failed:
+                    self.logger.warning(f"Transaction with nonce={first_nonce + index} failed,"
+                                        f" cancelling the ones following it")
+                receipts.append(None)
+                failed = True
+
+        return receipts
+
+    def _replace(self, transaction: dict, tx_hashes: List[bytes], nonce: int, gas_price: int):
+        try:
+            tx_hashes.append(self._send([transaction], gas_price, nonce)[0])
+        except Exception as e:
+            # the original transaction has most probably been mined in the meantime
+            self.logger.info(f"Failed to resend transaction with nonce={nonce} at gas price {gas_price}: {e}")
+
+    def _wait_for_receipt(self, tx_hashes: List[bytes], nonce: int) -> Optional[dict]:
+        """Waits until one of `tx_hashes`, all sent with `nonce`, gets mined. More of them can get
+        appended to the list while waiting, if the transaction gets resent with a higher gas price."""
+        started = time.time()
+        while time.time() - started < self.timeout:
+            for tx_hash in list(tx_hashes):
+                receipt = self.web3.eth.getTransactionReceipt(tx_hash)
+                if receipt is not None:
+                    return receipt
+
+            # if the nonce has been used, but not by any of our transactions, it must have been replaced
+            if self.web3.eth.getTransactionCount(self.our_address.address, 'latest') > nonce:
+                for tx_hash in list(tx_hashes):
+                    receipt = self.web3.eth.getTransactionReceipt(tx_hash)
+                    if receipt is not None:
+                        return receipt
+                return None
+
+            time.sleep(1)
+
+        self.logger.warning(f"Transaction with nonce={nonce} has not been mined in {self.timeout}s")
+        return None
+
+    def _cancel(self, nonce: int, gas_price: int):
+        try:
+            tx_hash = self.web3.eth.sendTransaction({'from': self.our_address.address,
+                                                     'to': self.our_address.address,
+                                                     'value': 0,
+                                                     'nonce': nonce,
+                                                     'gas': 21000,
+                                                     'gasPrice': int(gas_price * self.REPLACEMENT_GAS_PRICE_INCREASE) + 1})
+            self.logger.info(f"Sent replacement transaction {self.web3.toHex(tx_hash)} with nonce={nonce}")
+        except Exception as e:
+            # the original transaction has most probably been mined in the meantime
+            self.logger.info(f"Failed to replace transaction with nonce={nonce}: {e}")
@@ -0,0 +1,128 @@
+# This file is part of Maker Keeper Framework.
+#
+# Copyright (C) 2018 reverendus
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import gzip
+import json
+import logging
+import os
+from typing import List, Optional
+
+from pymaker import Address
+from pymaker.numeric import Wad
+from pymaker.oasis import SimpleMarket, Order
+
+
+def oasis_order_to_json(order: Order) -> dict:
+    return {'orderId': order.order_id,
+            'maker': order.maker.address,
+            'payToken': order.pay_token.address,
+            'payAmount': str(order.pay_amount.value),
+            'buyToken': order.buy_token.address,
+            'buyAmount': str(order.buy_amount.value),
+            'timestamp': order.timestamp}
+
+
+def oasis_order_from_json(market: SimpleMarket, data: dict) -> Order:
+    return Order(market=market,
+                 order_id=data['orderId'],
+                 maker=Address(data['maker']),
+                 pay_token=Address(data['payToken']),
+                 pay_amount=Wad(int(data['payAmount'])),
+                 buy_token=Address(data['buyToken']),
+                 buy_amount=Wad(int(data['buyAmount'])),
+                 timestamp=data['timestamp'])
+
+
+class Snapshot:
+    """Market state of the keeper checkpointed to disk, so it can start warm after a restart.
+
+    Holds the OasisDEX and 0x order books as of `block_number`, plus the static contract metadata
+    (like the token addresses read from the Tub). The snapshot only gets used if it has been taken
+    for the same `contracts` as the ones the keeper is configured with. It is stored as gzipped JSON.
+
+    Attributes:
+        block_number: Number of the last block reflected in the order books.
+        contracts: Addresses of the contracts the snapshot has been taken for, by name.
+        metadata: Values of the immutable contract functions, by contract name and function name.
+        oasis_orders: OasisDEX orders, as returned by `oasis_order_to_json`, or `None` if the keeper
+            was not keeping a local OasisDEX order book.
+        zrx_orders: 0x orders, in the Standard Relayer API format.
+    """
+
+    logger = logging.getLogger('snapshot')
+
+    VERSION = 1
+
+    def __init__(self, block_number: int, contracts: dict, metadata: dict, oasis_orders: Optional[List[dict]],
+                 zrx_orders: List[dict]):
+        assert(isinstance(block_number, int))
+        assert(isinstance(contracts, dict))
+        assert(isinstance(metadata, dict))
+        assert(isinstance(oasis_orders, list) or oasis_orders is None)
+        assert(isinstance(zrx_orders, list))
+
+        self.block_number = block_number
+        self.contracts = contracts
+        self.metadata = metadata
+        self.oasis_orders = oasis_orders
+        self.zrx_orders = zrx_orders
+
+    def save(self, path: str):
+        """Writes the snapshot to `path`, replacing the previous one only once it has been fully written."""
+        assert(isinstance(path, str))
+
+        temporary_path = f"{path}.tmp"
+        with gzip.open(temporary_path, 'wt') as file:
+            json.dump({'version': self.VERSION,
+                       'blockNumber': self.block_number,
+                       'contracts': self.contracts,
+                       'metadata': self.metadata,
+                       'oasisOrders': self.oasis_orders,
+                       'zrxOrders': self.zrx_orders}, file, separators=(',', ':'))
+
+        os.replace(temporary_path, path)
+
+    @classmethod
+    def load(cls, path: str) -> Optional['Snapshot']:
+        """Reads the snapshot from `path`. Returns `None` if there is none, or if it can not be read."""
+        assert(isinstance(path, str))
+
+        if not os.path.isfile(path):
+            return None
+
+        try:
+            with gzip.open(path, 'rt') as file:
+                data = json.load(file)
+
+            if data['version'] != cls.VERSION:
+                cls.logger.warning(f"Ignoring snapshot {path} as it has an unsupported version ({data['version']})")
+                return None
+
+            return Snapshot(block_number=data['blockNumber'],
+                            contracts=data['contracts'],
+                            metadata=data['metadata'],
+                            oasis_orders=data['oasisOrders'],
+                            zrx_orders=data['zrxOrders'])
+        except Exception as e:
+            cls.logger.warning(f"Ignoring snapshot {path} as it can not be read: {e}")
+            return None
+
+    def is_for(self, contracts: dict) -> bool:
+        """Checks if the snapshot has been taken for the same contracts as `contracts`."""
+        assert(isinstance(contracts, dict))
+
+        return self.contracts == contracts
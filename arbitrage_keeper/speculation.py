@@ -0,0 +1,168 @@
+# This file is part of Maker Keeper Framework.
+#
+# Copyright (C) 2018 reverendus
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import copy
+import logging
+from typing import List, Optional, Tuple
+
+from eth_abi import decode_abi
+from eth_utils import decode_hex, function_signature_to_4byte_selector
+from web3 import Web3
+
+from arbitrage_keeper.conversion import Conversion
+from arbitrage_keeper.opportunity import Sequence
+from pymaker import Address
+from pymaker.numeric import Wad
+from pymaker.oasis import Order
+
+OASIS_TAKE = function_signature_to_4byte_selector('take(bytes32,uint128)')
+OASIS_BUY = function_signature_to_4byte_selector('buy(uint256,uint256)')
+OASIS_KILL = function_signature_to_4byte_selector('kill(bytes32)')
+OASIS_CANCEL = function_signature_to_4byte_selector('cancel(uint256)')
+ZRX_FILL_ORDER = function_signature_to_4byte_selector('fillOrder(address[5],uint256[6],uint256,bool,uint8,bytes32,bytes32)')
+ZRX_CANCEL_ORDER = function_signature_to_4byte_selector('cancelOrder(address[5],uint256[6],uint256)')
+
+
+def _decode(transaction, selectors: dict) -> Tuple[Optional[bytes], Optional[tuple]]:
+    data = transaction['input']
+    data = decode_hex(data) if isinstance(data, str) else bytes(data)
+    selector = data[:4]
+    if selector not in selectors:
+        return None, None
+
+    try:
+        return selector, decode_abi(selectors[selector], data[4:])
+    except Exception:
+        return None, None
+
+
+def _order_id(value) -> int:
+    return int.from_bytes(value, byteorder='big') if isinstance(value, bytes) else value
+
+
+class PendingTransactions:
+    """Pending transactions sent to any of the watched contracts.
+
+    Transactions get collected from the `pending` filter of the node on each `poll()`. The ones
+    which have been mined in the meantime, or have disappeared from the pool, are dropped
+    by `prune()`, which should be called whenever a new block arrives.
+    """
+
+    logger = logging.getLogger('pending-transactions')
+
+    def __init__(self, web3: Web3, addresses: List[Address]):
+        assert(isinstance(web3, Web3))
+        assert(isinstance(addresses, list))
+
+        self.web3 = web3
+        self.addresses = set(map(lambda address: address.address.lower(), addresses))
+        self.transactions = {}
+        self._filter = None
+
+    def poll(self) -> list:
+        """Collects new pending transactions and returns all the ones still known to be pending."""
+        if self._filter is None:
+            self._filter = self.web3.eth.filter('pending')
+
+        for tx_hash in self._filter.get_new_entries():
+            transaction = self.web3.eth.getTransaction(tx_hash)
+            if transaction is not None and transaction['to'] is not None and transaction['to'].lower() in self.addresses:
+                self.transactions[tx_hash] = transaction
+
+        return list(self.transactions.values())
+
+    def prune(self):
+        """Drops the transactions which are not pending anymore."""
+        for tx_hash in list(self.transactions.keys()):
+            transaction = self.web3.eth.getTransaction(tx_hash)
+            if transaction is None or transaction['blockNumber'] is not None:
+                del self.transactions[tx_hash]
+
+
+def project_oasis_orders(orders: List[Order], transactions: list) -> List[Order]:
+    """Applies the effects of pending OasisDEX takes and kills to `orders`.
+
+    Orders which would be fully taken or killed are removed, partially taken ones are
+    returned as copies with their amounts reduced. `orders` themselves are left intact.
+    """
+    assert(isinstance(orders, list))
+    assert(isinstance(transactions, list))
+
+    projected = {order.order_id: order for order in orders}
+    for transaction in transactions:
+        selector, args = _decode(transaction, {OASIS_TAKE: ['bytes32', 'uint128'],
+                                               OASIS_BUY: ['uint256', 'uint256'],
+                                               OASIS_KILL: ['bytes32'],
+                                               OASIS_CANCEL: ['uint256']})
+        if selector is None or _order_id(args[0]) not in projected:
+            continue
+
+        order_id = _order_id(args[0])
+        if selector in [OASIS_TAKE, OASIS_BUY]:
+            order = projected[order_id]
+            quantity = Wad.min(Wad(args[1]), order.pay_amount)
+            if quantity >= order.pay_amount:
+                del projected[order_id]
+            else:
+                projected_order = copy.copy(order)
+                projected_order.buy_amount = order.buy_amount - Wad(quantity.value * order.buy_amount.value // order.pay_amount.value)
+                projected_order.pay_amount = order.pay_amount - quantity
+                projected[order_id] = projected_order
+
+        else:
+            del projected[order_id]
+
+    return list(projected.values())
+
+
+def project_zrx_unavailable_buy_amounts(orders: list, unavailable_buy_amounts: List[Wad], transactions: list) -> List[Wad]:
+    """Applies the effects of pending 0x fills and cancellations to `unavailable_buy_amounts` of `orders`.
+
+    Orders are matched with the pending transactions by their maker and salt.
+    """
+    assert(isinstance(orders, list))
+    assert(isinstance(unavailable_buy_amounts, list))
+    assert(isinstance(transactions, list))
+
+    pending_amounts = {}
+    for transaction in transactions:
+        selector, args = _decode(transaction, {ZRX_FILL_ORDER: ['address[5]', 'uint256[6]', 'uint256', 'bool', 'uint8', 'bytes32', 'bytes32'],
+                                               ZRX_CANCEL_ORDER: ['address[5]', 'uint256[6]', 'uint256']})
+        if selector is not None:
+            key = (args[0][0].lower(), args[1][5])
+            pending_amounts[key] = pending_amounts.get(key, 0) + args[2]
+
+    return [Wad.min(order.buy_amount, unavailable_buy_amount + Wad(pending_amounts.get((order.maker.address.lower(), order.salt), 0)))
+            for order, unavailable_buy_amount in zip(orders, unavailable_buy_amounts)]
+
+
+def is_still_valid(opportunity: Sequence, conversions: List[Conversion]) -> bool:
+    """Checks if `opportunity` found speculatively can still be executed as-is with `conversions`.
+
+    Each step has to be available among `conversions`, at the same or better rate
+    and with enough capacity for the amount the step has been sized for.
+    """
+    assert(isinstance(opportunity, Sequence))
+    assert(isinstance(conversions, list))
+
+    conversions_by_id = {conversion.id(): conversion for conversion in conversions}
+    for step in opportunity.steps:
+        conversion = conversions_by_id.get(step.id())
+        if conversion is None or conversion.rate < step.rate or conversion.max_source_amount < step.source_amount:
+            return False
+
+    return True
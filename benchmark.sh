@@ -0,0 +1,4 @@
+#!/bin/bash
+
+# Benchmark the opportunity engine on synthetic conversions, does not need ganache
+PYTHONPATH=$PYTHONPATH:.:./lib/pymaker python3 benchmarks/opportunity_engine.py "$@"
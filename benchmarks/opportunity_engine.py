@@ -0,0 +1,193 @@
+# This file is part of Maker Keeper Framework.
+#
+# Copyright (C) 2018 reverendus
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Offline benchmark of the opportunity engine, run on synthetic conversions.
+
+Does not need a node nor any deployment. For each combination of the number of tokens and the number
+of orders per token pair, it measures three stages the keeper goes through on every block:
+
+    find_opportunities       enumerating the candidate sequences (`find_opportunities` of the finder)
+    set_amounts              sizing all the candidates found (`Sequence.set_amounts`)
+    profitable_opportunities streaming, sizing and ranking candidates, as `profitable_opportunities` does
+
+For each stage the best and the median wall time out of `--repeat` runs get reported, followed by
+the peak memory traced during one separate run and the number and size of memory blocks allocated
+by the stage and still alive after it (the latter two measured with `tracemalloc`).
+"""
+
+import argparse
+import math
+import random
+import statistics
+import sys
+import time
+import tracemalloc
+from typing import Callable, List
+
+from arbitrage_keeper.conversion import Conversion
+from arbitrage_keeper.opportunity import NegativeCycleFinder, OpportunityFinder, TemplateFinder, most_profitable
+from pymaker import Address
+from pymaker.numeric import Wad, Ray
+
+
+def token_address(index: int) -> Address:
+    return Address('0x' + format(index + 1, '040x'))
+
+
+def synthetic_conversions(tokens: int, orders_per_pair: int, dispersion: float, seed: int) -> List[Conversion]:
+    """Generates `orders_per_pair` conversions for every ordered pair of `tokens` tokens.
+
+    Every token gets a random reference price. Rates of the conversions deviate from the ones implied
+    by these prices by a random factor, drawn from a log-normal distribution slightly biased against us,
+    with `dispersion` being its standard deviation. The higher the dispersion, the more sequences
+    end up with a total rate above one.
+    """
+    assert(isinstance(tokens, int))
+    assert(isinstance(orders_per_pair, int))
+    assert(isinstance(dispersion, float))
+
+    generator = random.Random(seed)
+    prices = [math.exp(generator.uniform(-5, 5)) for _ in range(tokens)]
+
+    conversions = []
+    for source in range(tokens):
+        for target in range(tokens):
+            if source == target:
+                continue
+
+            for order in range(orders_per_pair):
+                rate = prices[source] / prices[target] * math.exp(generator.gauss(-dispersion / 2, dispersion))
+                max_source_amount = Wad.from_number(generator.uniform(1, 100) / prices[source])
+                conversions.append(Conversion(source_token=token_address(source),
+                                              target_token=token_address(target),
+                                              rate=Ray.from_number(rate),
+                                              max_source_amount=max_source_amount,
+                                              method=f"order-{source}-{target}-{order}"))
+
+    return conversions
+
+
+def opportunity_finder(search_engine: str, conversions: List[Conversion], tokens: int, max_steps: int, min_rate: Ray):
+    if search_engine == 'negative-cycles':
+        return NegativeCycleFinder(conversions=conversions)
+    elif search_engine == 'templates':
+        return TemplateFinder(conversions=conversions,
+                              templates=TemplateFinder.templates(list(map(token_address, range(tokens))), token_address(0), max_steps))
+    else:
+        return OpportunityFinder(conversions=conversions, min_rate=min_rate)
+
+
+def measure(function: Callable, repeat: int) -> dict:
+    """Runs `function` `repeat` times to measure its wall time, then once more under `tracemalloc`."""
+    durations = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        function()
+        durations.append(time.perf_counter() - started)
+
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    result = function()
+    after = tracemalloc.take_snapshot()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    differences = after.compare_to(before, 'filename')
+    return {'best': min(durations),
+            'median': statistics.median(durations),
+            'peak': peak,
+            'blocks': sum(map(lambda difference: difference.count_diff, differences)),
+            'retained': sum(map(lambda difference: difference.size_diff, differences)),
+            'result': result}
+
+
+def report(tokens: int, orders_per_pair: int, stage: str, measurement: dict, count: int):
+    print(f"{tokens:>6} {orders_per_pair:>6} {stage:<26} {count:>8}"
+          f" {measurement['best'] * 1000:>10.2f} {measurement['median'] * 1000:>10.2f}"
+          f" {measurement['peak'] / 1024:>10.1f} {measurement['blocks']:>9} {measurement['retained'] / 1024:>10.1f}")
+    sys.stdout.flush()
+
+
+def main(args: list):
+    parser = argparse.ArgumentParser("opportunity-engine-benchmark")
+
+    parser.add_argument("--tokens", type=str, default="3,4,5",
+                        help="Comma-separated numbers of tokens to benchmark with (default: `3,4,5')")
+
+    parser.add_argument("--orders-per-pair", type=str, default="1,5,20",
+                        help="Comma-separated numbers of orders per token pair to benchmark with (default: `1,5,20')")
+
+    parser.add_argument("--dispersion", type=float, default=0.01,
+                        help="Standard deviation of the log of the rates around the reference prices (default: 0.01)")
+
+    parser.add_argument("--search-engine", type=str, choices=['paths', 'negative-cycles', 'templates'], default='paths',
+                        help="Engine used to look for arbitrage opportunities (default: `paths')")
+
+    parser.add_argument("--max-steps", type=int, default=4,
+                        help="Maximum number of steps of an opportunity (default: 4)")
+
+    parser.add_argument("--max-engagement", type=float, default=1000.0,
+                        help="Maximum engagement (in base token) in one opportunity (default: 1000.0)")
+
+    parser.add_argument("--repeat", type=int, default=5,
+                        help="Number of timed runs of each stage (default: 5)")
+
+    parser.add_argument("--seed", type=int, default=0,
+                        help="Seed of the synthetic conversions generator (default: 0)")
+
+    arguments = parser.parse_args(args)
+
+    base_token = token_address(0)
+    max_engagement = Wad.from_number(arguments.max_engagement)
+    min_rate = Ray.from_number(1.000001)
+
+    print(f"search engine: {arguments.search_engine}, max steps: {arguments.max_steps},"
+          f" dispersion: {arguments.dispersion}, repeat: {arguments.repeat}, seed: {arguments.seed}")
+    print(f"{'tokens':>6} {'orders':>6} {'stage':<26} {'results':>8} {'best ms':>10} {'median ms':>10}"
+          f" {'peak KiB':>10} {'blocks':>9} {'kept KiB':>10}")
+
+    for tokens in map(int, arguments.tokens.split(',')):
+        for orders_per_pair in map(int, arguments.orders_per_pair.split(',')):
+            conversions = synthetic_conversions(tokens, orders_per_pair, arguments.dispersion, arguments.seed)
+
+            def find_opportunities():
+                finder = opportunity_finder(arguments.search_engine, conversions, tokens, arguments.max_steps, min_rate)
+                return finder.find_opportunities(base_token, max_engagement, arguments.max_steps)
+
+            measurement = measure(find_opportunities, arguments.repeat)
+            opportunities = measurement['result']
+            report(tokens, orders_per_pair, 'find_opportunities', measurement, len(opportunities))
+
+            def set_amounts():
+                for opportunity in opportunities:
+                    opportunity.set_amounts(max_engagement)
+                return opportunities
+
+            measurement = measure(set_amounts, arguments.repeat)
+            report(tokens, orders_per_pair, 'set_amounts', measurement, len(opportunities))
+
+            def profitable_opportunities():
+                finder = opportunity_finder(arguments.search_engine, conversions, tokens, arguments.max_steps, min_rate)
+                return most_profitable(finder.iterate_opportunities(base_token, arguments.max_steps),
+                                       base_token, max_engagement, min_rate, Wad(0), 1)
+
+            measurement = measure(profitable_opportunities, arguments.repeat)
+            report(tokens, orders_per_pair, 'profitable_opportunities', measurement, len(measurement['result']))
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,89 @@
+# This file is part of Maker Keeper Framework.
+#
+# Copyright (C) 2018 reverendus
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from arbitrage_keeper.approval import Approval, missing_approvals, recorded_approvals
+from arbitrage_keeper.arbitrage_keeper import ArbitrageKeeper
+from pymaker.approval import directly
+from pymaker.deployment import Deployment
+from tests.helper import args
+
+
+class TestApprovals:
+    def test_should_record_approvals_instead_of_approving(self, deployment: Deployment):
+        # given
+        nonce = deployment.web3.eth.getTransactionCount(deployment.our_address.address)
+
+        # when
+        approvals = recorded_approvals(deployment.our_address,
+                                       lambda approval_method: deployment.otc.approve([deployment.gem, deployment.sai], approval_method))
+
+        # then
+        assert list(map(lambda approval: approval.token.address, approvals)) == [deployment.gem.address, deployment.sai.address]
+        assert all(map(lambda approval: approval.owner == deployment.our_address, approvals))
+        assert all(map(lambda approval: approval.spender == deployment.otc.address, approvals))
+
+        # and
+        assert deployment.web3.eth.getTransactionCount(deployment.our_address.address) == nonce
+
+    def test_should_return_only_missing_approvals(self, deployment: Deployment):
+        # given
+        deployment.otc.approve([deployment.gem], directly())
+        approvals = [Approval(deployment.our_address, deployment.gem, deployment.otc.address, 'OasisDEX'),
+                     Approval(deployment.our_address, deployment.sai, deployment.otc.address, 'OasisDEX')]
+
+        # when
+        missing = missing_approvals(deployment.web3, approvals, deployment.web3.eth.blockNumber)
+
+        # then
+        assert missing == [approvals[1]]
+
+    def test_should_return_duplicate_approvals_only_once(self, deployment: Deployment):
+        # given
+        approvals = [Approval(deployment.our_address, deployment.sai, deployment.otc.address, 'OasisDEX'),
+                     Approval(deployment.our_address, deployment.sai, deployment.otc.address, 'OasisDEX')]
+
+        # when
+        missing = missing_approvals(deployment.web3, approvals, deployment.web3.eth.blockNumber)
+
+        # then
+        assert len(missing) == 1
+
+
+class TestArbitrageKeeperApprovals:
+    def test_should_not_send_anything_if_already_approved(self, deployment: Deployment):
+        # given
+        keeper = ArbitrageKeeper(args=args(f"--eth-from {deployment.our_address.address}"
+                                           f" --tub-address {deployment.tub.address}"
+                                           f" --tap-address {deployment.tap.address}"
+                                           f" --oasis-address {deployment.otc.address}"
+                                           f" --base-token {deployment.sai.address}"
+                                           f" --min-profit 1.0 --max-engagement 1000.0"),
+                                 web3=deployment.web3)
+
+        # when
+        keeper.approve()
+
+        # then
+        assert deployment.sai.allowance_of(deployment.our_address, deployment.otc.address) >= Approval.SUFFICIENT_ALLOWANCE
+        assert deployment.gem.allowance_of(deployment.our_address, deployment.tub.address) >= Approval.SUFFICIENT_ALLOWANCE
+
+        # when
+        nonce = deployment.web3.eth.getTransactionCount(deployment.our_address.address)
+        keeper.approve()
+
+        # then
+        assert deployment.web3.eth.getTransactionCount(deployment.our_address.address) == nonce
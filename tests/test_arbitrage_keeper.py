@@ -15,6 +15,7 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 import json
+import threading
 import time
 
 import pkg_resources
@@ -589,3 +590,138 @@ class TestArbitrageKeeper:
         assert deployment.otc.get_orders()[0].buy_amount == Wad.from_number(100)
         assert deployment.otc.get_orders()[1].buy_amount == Wad.from_number(105)
         assert deployment.otc.get_orders()[2].buy_amount == Wad.from_number(110)
+
+    def test_should_identify_multi_step_arbitrage_with_negative_cycles_search_engine(self, deployment: Deployment):
+        # given
+        keeper = ArbitrageKeeper(args=args(f"--eth-from {deployment.our_address.address}"
+                                        f" --tub-address {deployment.tub.address}"
+                                        f" --tap-address {deployment.tap.address}"
+                                        f" --oasis-address {deployment.otc.address}"
+                                        f" --base-token {deployment.sai.address}"
+                                        f" --min-profit 13.0 --max-engagement 100.0"
+                                        f" --search-engine negative-cycles"),
+                                 web3=deployment.web3)
+
+        # and
+        DSValue(web3=deployment.web3, address=deployment.tub.pip()).poke_with_int(Wad.from_number(500).value).transact()
+        deployment.tub.mold_gap(Wad.from_number(1.05)).transact()
+        deployment.tub.join(Wad.from_number(1000)).transact()
+        deployment.tap.mold_gap(Wad.from_number(1.05)).transact()
+
+        # and
+        deployment.sai.mint(Wad.from_number(1000)).transact()
+
+        # and
+        deployment.otc.approve([deployment.gem, deployment.sai, deployment.skr], directly())
+        deployment.otc.add_token_pair_whitelist(deployment.sai.address, deployment.skr.address).transact()
+        deployment.otc.add_token_pair_whitelist(deployment.skr.address, deployment.gem.address).transact()
+        deployment.otc.add_token_pair_whitelist(deployment.gem.address, deployment.sai.address).transact()
+        deployment.otc.make(deployment.skr.address, Wad.from_number(105), deployment.sai.address, Wad.from_number(100)).transact()
+        deployment.otc.make(deployment.gem.address, Wad.from_number(110), deployment.skr.address, Wad.from_number(105)).transact()
+        deployment.otc.make(deployment.sai.address, Wad.from_number(115), deployment.gem.address, Wad.from_number(110)).transact()
+        assert len(deployment.otc.get_orders()) == 3
+
+        # when
+        keeper.approve()
+        keeper.process_block()
+
+        # then
+        assert len(deployment.otc.get_orders()) == 0
+
+    def test_should_identify_multi_step_arbitrage_with_templates_search_engine(self, deployment: Deployment):
+        # given
+        keeper = ArbitrageKeeper(args=args(f"--eth-from {deployment.our_address.address}"
+                                        f" --tub-address {deployment.tub.address}"
+                                        f" --tap-address {deployment.tap.address}"
+                                        f" --oasis-address {deployment.otc.address}"
+                                        f" --base-token {deployment.sai.address}"
+                                        f" --min-profit 13.0 --max-engagement 100.0"
+                                        f" --search-engine templates"),
+                                 web3=deployment.web3)
+
+        # and
+        DSValue(web3=deployment.web3, address=deployment.tub.pip()).poke_with_int(Wad.from_number(500).value).transact()
+        deployment.tub.mold_gap(Wad.from_number(1.05)).transact()
+        deployment.tub.join(Wad.from_number(1000)).transact()
+        deployment.tap.mold_gap(Wad.from_number(1.05)).transact()
+
+        # and
+        deployment.sai.mint(Wad.from_number(1000)).transact()
+
+        # and
+        deployment.otc.approve([deployment.gem, deployment.sai, deployment.skr], directly())
+        deployment.otc.add_token_pair_whitelist(deployment.sai.address, deployment.skr.address).transact()
+        deployment.otc.add_token_pair_whitelist(deployment.skr.address, deployment.gem.address).transact()
+        deployment.otc.add_token_pair_whitelist(deployment.gem.address, deployment.sai.address).transact()
+        deployment.otc.make(deployment.skr.address, Wad.from_number(105), deployment.sai.address, Wad.from_number(100)).transact()
+        deployment.otc.make(deployment.gem.address, Wad.from_number(110), deployment.skr.address, Wad.from_number(105)).transact()
+        deployment.otc.make(deployment.sai.address, Wad.from_number(115), deployment.gem.address, Wad.from_number(110)).transact()
+        assert len(deployment.otc.get_orders()) == 3
+
+        # when
+        keeper.approve()
+        keeper.process_block()
+
+        # then
+        assert len(deployment.otc.get_orders()) == 0
+
+    def test_should_fetch_venues_concurrently_and_return_them_in_order(self, deployment: Deployment):
+        # given
+        keeper = ArbitrageKeeper(args=args(f"--eth-from {deployment.our_address.address}"
+                                        f" --tub-address {deployment.tub.address}"
+                                        f" --tap-address {deployment.tap.address}"
+                                        f" --oasis-address {deployment.otc.address}"
+                                        f" --base-token {deployment.sai.address}"
+                                        f" --min-profit 1.0 --max-engagement 1000.0"),
+                                 web3=deployment.web3)
+
+        # and
+        barrier = threading.Barrier(3, timeout=10)
+
+        def venue(result, delay):
+            def fetch(*args):
+                barrier.wait()
+                time.sleep(delay)
+                return result
+            return fetch
+
+        keeper.tub_conversions = venue('tub', 0.3)
+        keeper.otc_orders = venue('otc', 0.2)
+        keeper.zrx_orders_and_unavailable_buy_amounts = venue('zrx', 0.1)
+
+        # when
+        venues = keeper.fetch_venues()
+
+        # then
+        assert venues == ('tub', 'otc', 'zrx')
+
+    def test_should_fetch_token_pairs_concurrently_and_return_them_in_order(self, deployment: Deployment):
+        # given
+        keeper = ArbitrageKeeper(args=args(f"--eth-from {deployment.our_address.address}"
+                                        f" --tub-address {deployment.tub.address}"
+                                        f" --tap-address {deployment.tap.address}"
+                                        f" --oasis-address {deployment.otc.address}"
+                                        f" --base-token {deployment.sai.address}"
+                                        f" --min-profit 1.0 --max-engagement 1000.0"
+                                        f" --fetch-threads 6"),
+                                 web3=deployment.web3)
+
+        # and
+        tokens = keeper.tokens()
+        pairs = keeper.token_pairs(tokens)
+        barrier = threading.Barrier(len(pairs), timeout=10)
+
+        def get_orders(pay_token, buy_token):
+            barrier.wait()
+            time.sleep(0.1 * (len(pairs) - pairs.index((pay_token, buy_token))))
+            return [(pay_token, buy_token)]
+
+        keeper.otc.get_orders = get_orders
+        keeper.tub_conversions = lambda: []
+        keeper.zrx_orders_and_unavailable_buy_amounts = lambda tokens: ([], [])
+
+        # when
+        tub_conversions, otc_orders, zrx_orders = keeper.fetch_venues()
+
+        # then
+        assert otc_orders == pairs
@@ -0,0 +1,55 @@
+# This file is part of Maker Keeper Framework.
+#
+# Copyright (C) 2018 reverendus
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from arbitrage_keeper.batch import ContractCall, batch_call
+from pymaker import Address
+from pymaker.deployment import Deployment
+from pymaker.feed import DSValue
+from pymaker.numeric import Wad
+
+
+class TestBatchCall:
+    def test_should_return_the_same_results_as_individual_calls(self, deployment: Deployment):
+        # given
+        DSValue(web3=deployment.web3, address=deployment.tub.pip()).poke_with_int(Wad.from_number(500).value).transact()
+        calls = [ContractCall(deployment.tub, 'gem', [], Address),
+                 ContractCall(deployment.tub, 'ask', [Wad.from_number(1)], Wad),
+                 ContractCall(deployment.tap, 'bid', [Wad.from_number(2)], Wad),
+                 ContractCall(deployment.tap, 'woe', [], Wad)]
+
+        # when
+        results = batch_call(deployment.web3, calls, deployment.web3.eth.blockNumber)
+
+        # then
+        assert results == [deployment.tub.gem(),
+                           deployment.tub.ask(Wad.from_number(1)),
+                           deployment.tap.bid(Wad.from_number(2)),
+                           deployment.tap.woe()]
+
+    def test_should_read_the_state_as_of_given_block(self, deployment: Deployment):
+        # given
+        DSValue(web3=deployment.web3, address=deployment.tub.pip()).poke_with_int(Wad.from_number(500).value).transact()
+        block_number = deployment.web3.eth.blockNumber
+        calls = [ContractCall(deployment.tap, 'bid', [Wad.from_number(1)], Wad)]
+
+        # when
+        DSValue(web3=deployment.web3, address=deployment.tub.pip()).poke_with_int(Wad.from_number(600).value).transact()
+
+        # then
+        assert batch_call(deployment.web3, calls, block_number) == [Wad.from_number(500)]
+        assert batch_call(deployment.web3, calls, deployment.web3.eth.blockNumber) == [Wad.from_number(600)]
+
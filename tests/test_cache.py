@@ -0,0 +1,99 @@
+# This file is part of Maker Keeper Framework.
+#
+# Copyright (C) 2018 reverendus
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from arbitrage_keeper.cache import CachedContract, prefetch
+from pymaker import Address
+from pymaker.deployment import Deployment
+from pymaker.feed import DSValue
+from pymaker.numeric import Wad
+
+
+class TestCachedContract:
+    def poke(self, deployment: Deployment, price: int):
+        DSValue(web3=deployment.web3, address=deployment.tub.pip()).poke_with_int(Wad.from_number(price).value).transact()
+
+    def test_should_keep_mutable_values_until_the_block_changes(self, deployment: Deployment):
+        # given
+        tap = CachedContract(deployment.tap, immutable=[], mutable=['bid'])
+        self.poke(deployment, 500)
+        tap.on_block(deployment.web3.eth.blockNumber)
+        assert tap.bid(Wad.from_number(1)) == Wad.from_number(500)
+
+        # when
+        self.poke(deployment, 600)
+
+        # then
+        assert tap.bid(Wad.from_number(1)) == Wad.from_number(500)
+
+        # when
+        tap.on_block(deployment.web3.eth.blockNumber)
+
+        # then
+        assert tap.bid(Wad.from_number(1)) == Wad.from_number(600)
+
+    def test_should_not_cache_mutable_values_if_block_is_unknown(self, deployment: Deployment):
+        # given
+        tap = CachedContract(deployment.tap, immutable=[], mutable=['bid'])
+        self.poke(deployment, 500)
+        assert tap.bid(Wad.from_number(1)) == Wad.from_number(500)
+
+        # when
+        self.poke(deployment, 600)
+
+        # then
+        assert tap.bid(Wad.from_number(1)) == Wad.from_number(600)
+
+    def test_should_pin_immutable_values(self, deployment: Deployment):
+        # given
+        tub = CachedContract(deployment.tub, immutable=['gem'], mutable=[])
+        tub.on_block(1)
+        assert tub.gem() == deployment.gem.address
+
+        # when
+        tub.on_block(2)
+
+        # then
+        assert tub.is_cached(tub.call('gem', [], Address))
+        assert tub.gem() == deployment.gem.address
+
+    def test_should_delegate_other_attributes(self, deployment: Deployment):
+        # given
+        tap = CachedContract(deployment.tap, immutable=[], mutable=['bid'])
+
+        # expect
+        assert tap.address == deployment.tap.address
+        assert tap.woe() == deployment.tap.woe()
+
+
+class TestPrefetch:
+    def test_should_fill_caches_with_values_read_in_one_batch(self, deployment: Deployment):
+        # given
+        DSValue(web3=deployment.web3, address=deployment.tub.pip()).poke_with_int(Wad.from_number(500).value).transact()
+        tub = CachedContract(deployment.tub, immutable=['gem'], mutable=[])
+        tap = CachedContract(deployment.tap, immutable=[], mutable=['bid', 'woe'])
+
+        # when
+        prefetch(deployment.web3, deployment.web3.eth.blockNumber, [(tub, tub.call('gem', [], Address)),
+                                                                    (tap, tap.call('bid', [Wad.from_number(1)], Wad)),
+                                                                    (tap, tap.call('woe', [], Wad))])
+
+        # then
+        assert tub.is_cached(tub.call('gem', [], Address))
+        assert tap.is_cached(tap.call('bid', [Wad.from_number(1)], Wad))
+        assert tap.is_cached(tap.call('woe', [], Wad))
+        assert tub.gem() == deployment.gem.address
+        assert tap.bid(Wad.from_number(1)) == Wad.from_number(500)
@@ -17,9 +17,10 @@
 
 import pytest
 
-from arbitrage_keeper.conversion import Conversion
+from arbitrage_keeper.conversion import Conversion, OasisBookConversion
 from pymaker import Address
 from pymaker.numeric import Wad, Ray
+from pymaker.oasis import Order
 
 
 @pytest.fixture
@@ -32,6 +33,11 @@ def token2():
     return Address('0x0202020202020202020202020202020202020202')
 
 
+def order(order_id: int, pay_token: Address, pay_amount: Wad, buy_token: Address, buy_amount: Wad) -> Order:
+    return Order(market=None, order_id=order_id, maker=Address('0x0000000000000000000000000000000000000000'),
+                 pay_token=pay_token, pay_amount=pay_amount, buy_token=buy_token, buy_amount=buy_amount, timestamp=0)
+
+
 def test_nicely_convert_to_string_without_amounts(token1, token2):
     # given
     conversion = Conversion(token1, token2, Ray.from_number(1.01), Wad.from_number(1000), 'met()')
@@ -49,3 +55,48 @@ def test_nicely_convert_to_string_with_amounts(token1, token2):
     # expect
     assert str(conversion) == "[50.000000000000000000 0x0101010101010101010101010101010101010101 -> 50.500000000000000000 0x0202020202020202020202020202020202020202 @1.010000000000000000000000000" \
                               " by met() (max=1000.000000000000000000 0x0101010101010101010101010101010101010101)]"
+
+
+class TestOasisBookConversion:
+    @pytest.fixture
+    def conversion(self, token1, token2):
+        return OasisBookConversion(None, [order(1, token2, Wad.from_number(100), token1, Wad.from_number(50)),
+                                          order(2, token2, Wad.from_number(60), token1, Wad.from_number(20)),
+                                          order(3, token2, Wad.from_number(10), token1, Wad.from_number(10))])
+
+    def test_should_use_the_best_order_as_the_rate(self, conversion, token1, token2):
+        assert conversion.source_token == token1
+        assert conversion.target_token == token2
+        assert conversion.rate == Ray.from_number(3)
+        assert conversion.max_source_amount == Wad.from_number(80)
+        assert conversion.method == "otc.take(2,1,3)"
+
+    def test_should_use_each_order_as_a_separate_resource(self, conversion):
+        assert conversion.resources() == ["otc.take(2)", "otc.take(1)", "otc.take(3)"]
+
+    def test_should_walk_through_the_depth_of_the_book(self, conversion):
+        assert conversion.target_amount_for(Wad.from_number(10)) == Wad.from_number(30)
+        assert conversion.target_amount_for(Wad.from_number(20)) == Wad.from_number(60)
+        assert conversion.target_amount_for(Wad.from_number(45)) == Wad.from_number(110)
+        assert conversion.target_amount_for(Wad.from_number(75)) == Wad.from_number(165)
+        assert conversion.target_amount_for(Wad.from_number(1000)) == Wad.from_number(170)
+
+    def test_should_walk_back_through_the_depth_of_the_book(self, conversion):
+        assert conversion.source_amount_for(Wad.from_number(30)) == Wad.from_number(10)
+        assert conversion.source_amount_for(Wad.from_number(60)) == Wad.from_number(20)
+        assert conversion.source_amount_for(Wad.from_number(110)) == Wad.from_number(45)
+        assert conversion.source_amount_for(Wad.from_number(165)) == Wad.from_number(75)
+
+    def test_should_split_target_amount_between_orders(self, conversion):
+        # given
+        conversion.target_amount = Wad.from_number(110)
+
+        # when
+        quantities = conversion.quantities()
+
+        # then
+        assert len(quantities) == 2
+        assert quantities[0][0].order_id == 2
+        assert quantities[0][1] == Wad.from_number(60)
+        assert quantities[1][0].order_id == 1
+        assert quantities[1][1] == Wad.from_number(50)
@@ -0,0 +1,85 @@
+# This file is part of Maker Keeper Framework.
+#
+# Copyright (C) 2018 reverendus
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import pytest
+
+from arbitrage_keeper.gas import ProfitScaledGasPrice
+from pymaker.numeric import Wad
+
+GWEI = 1000000000
+
+
+class TestProfitScaledGasPrice:
+    def test_should_bid_a_share_of_profit(self):
+        # given
+        gas_price = ProfitScaledGasPrice(profit=Wad.from_number(0.1), gas=100000, share=0.2,
+                                         min_price=1*GWEI, max_price=1000*GWEI)
+
+        # expect
+        assert gas_price.get_gas_price(0) == 200*GWEI
+        assert gas_price.get_gas_price(9) == 200*GWEI
+
+    def test_should_increase_gas_price_up_to_the_whole_profit(self):
+        # given
+        gas_price = ProfitScaledGasPrice(profit=Wad.from_number(0.1), gas=100000, share=0.5,
+                                         min_price=1*GWEI, max_price=10000*GWEI, increase_by=1.5, every_secs=10)
+
+        # expect
+        assert gas_price.get_gas_price(0) == 500*GWEI
+        assert gas_price.get_gas_price(10) == 750*GWEI
+        assert gas_price.get_gas_price(20) == 1000*GWEI
+        assert gas_price.get_gas_price(1000000) == 1000*GWEI
+
+    def test_should_skip_increases_below_ten_percent(self):
+        # given
+        gas_price = ProfitScaledGasPrice(profit=Wad.from_number(0.105), gas=100000, share=0.8,
+                                         min_price=1*GWEI, max_price=10000*GWEI, increase_by=1.25, every_secs=10)
+
+        # expect
+        assert gas_price.get_gas_price(0) == 840*GWEI
+        assert gas_price.get_gas_price(10) == 1050*GWEI
+
+        # and
+        gas_price = ProfitScaledGasPrice(profit=Wad.from_number(0.1), gas=100000, share=0.95,
+                                         min_price=1*GWEI, max_price=10000*GWEI, increase_by=1.25, every_secs=10)
+
+        # expect
+        assert gas_price.get_gas_price(0) == 950*GWEI
+        assert gas_price.get_gas_price(10) == 950*GWEI
+        assert gas_price.get_gas_price(1000) == 950*GWEI
+
+    def test_should_not_exceed_max_price(self):
+        # given
+        gas_price = ProfitScaledGasPrice(profit=Wad.from_number(10), gas=100000, share=0.5,
+                                         min_price=1*GWEI, max_price=100*GWEI)
+
+        # expect
+        assert gas_price.get_gas_price(0) == 100*GWEI
+        assert gas_price.get_gas_price(60) == 100*GWEI
+
+    def test_should_not_go_below_min_price_if_profit_allows(self):
+        # given
+        gas_price = ProfitScaledGasPrice(profit=Wad.from_number(0.001), gas=100000, share=0.1,
+                                         min_price=5*GWEI, max_price=100*GWEI)
+
+        # expect
+        assert gas_price.get_gas_price(0) == 5*GWEI
+
+    def test_should_reject_too_small_increases(self):
+        with pytest.raises(AssertionError):
+            ProfitScaledGasPrice(profit=Wad.from_number(1), gas=100000, share=0.1,
+                                 min_price=1*GWEI, max_price=100*GWEI, increase_by=1.05)
@@ -15,12 +15,17 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+import itertools
+import random
+
 import pytest
 
-from arbitrage_keeper.conversion import Conversion
-from arbitrage_keeper.opportunity import Sequence, OpportunityFinder
+from arbitrage_keeper.conversion import Conversion, OasisBookConversion, raw_ray_div, raw_ray_mul
+from arbitrage_keeper.opportunity import NegativeCycleFinder, Sequence, OpportunityFinder, TemplateFinder
+from arbitrage_keeper.opportunity import most_profitable, select_non_conflicting
 from pymaker import Address
 from pymaker.numeric import Wad, Ray
+from pymaker.oasis import Order
 
 
 class TestSequence:
@@ -59,6 +64,327 @@ class TestSequence:
         assert sequence.profit(token1) == Wad.from_number(3.02)
         assert sequence.profit(token2) == Wad.from_number(0)
 
+    def test_should_sweep_several_orders_of_book_conversion(self, token1, token2):
+        # given
+        def order(order_id: int, pay_amount: Wad, buy_amount: Wad) -> Order:
+            return Order(market=None, order_id=order_id, maker=Address('0x0000000000000000000000000000000000000000'),
+                         pay_token=token1, pay_amount=pay_amount, buy_token=token2, buy_amount=buy_amount, timestamp=0)
+
+        step1 = Conversion(token1, token2, Ray.from_number(2.0), Wad.from_number(1000), 'met1')
+        step2 = OasisBookConversion(None, [order(1, Wad.from_number(30), Wad.from_number(50)),
+                                           order(2, Wad.from_number(60), Wad.from_number(100))])
+
+        # when
+        sequence = Sequence([step1, step2])
+        sequence.set_amounts(Wad.from_number(100))
+
+        # then
+        assert sequence.steps[0].source_amount == Wad.from_number(75)
+        assert sequence.steps[0].target_amount == Wad.from_number(150)
+        assert sequence.steps[1].source_amount == Wad.from_number(150)
+        assert sequence.steps[1].target_amount == Wad.from_number(90)
+        assert sequence.profit(token1) == Wad.from_number(15)
+
+    def test_should_set_optimal_amounts_when_deeper_orders_are_not_profitable(self, token1, token2):
+        # given
+        def order(order_id: int, pay_amount: Wad, buy_amount: Wad) -> Order:
+            return Order(market=None, order_id=order_id, maker=Address('0x0000000000000000000000000000000000000000'),
+                         pay_token=token1, pay_amount=pay_amount, buy_token=token2, buy_amount=buy_amount, timestamp=0)
+
+        step1 = Conversion(token1, token2, Ray.from_number(1.0), Wad.from_number(1000), 'met1')
+        step2 = OasisBookConversion(None, [order(1, Wad.from_number(60), Wad.from_number(50)),
+                                           order(2, Wad.from_number(90), Wad.from_number(100))])
+        sequence = Sequence([step1, step2])
+
+        # when
+        sequence.set_optimal_amounts(Wad.from_number(150), token1)
+
+        # then
+        assert sequence.steps[0].source_amount == Wad.from_number(50)
+        assert sequence.steps[1].target_amount == Wad.from_number(60)
+        assert sequence.profit(token1) == Wad.from_number(10)
+
+    def test_should_set_optimal_amounts_when_worse_orders_are_followed_by_capped_step(self, token1, token2):
+        # given
+        def order(order_id: int, pay_amount: Wad, buy_amount: Wad) -> Order:
+            return Order(market=None, order_id=order_id, maker=Address('0x0000000000000000000000000000000000000000'),
+                         pay_token=token2, pay_amount=pay_amount, buy_token=token1, buy_amount=buy_amount, timestamp=0)
+
+        step1 = OasisBookConversion(None, [order(1, Wad.from_number(20), Wad.from_number(10)),
+                                           order(2, Wad.from_number(50), Wad.from_number(100))])
+        step2 = Conversion(token2, token1, Ray.from_number(0.6), Wad.from_number(50), 'met2')
+        sequence = Sequence([step1, step2])
+
+        # when
+        sequence.set_optimal_amounts(Wad.from_number(100), token1)
+
+        # then
+        assert sequence.steps[0].source_amount == Wad.from_number(10)
+        assert sequence.steps[1].target_amount == Wad.from_number(12)
+        assert sequence.profit(token1) == Wad.from_number(2)
+
+    def test_should_set_optimal_amounts_same_as_max_amount_for_constant_rates(self, token1, token2):
+        # given
+        step1 = Conversion(token1, token2, Ray.from_number(2.0), Wad.from_number(1000), 'met1')
+        step2 = Conversion(token2, token1, Ray.from_number(0.6), Wad.from_number(150), 'met2')
+        sequence = Sequence([step1, step2])
+
+        # when
+        sequence.set_optimal_amounts(Wad.from_number(100), token1)
+
+        # then
+        assert sequence.steps[0].source_amount == Wad.from_number(75)
+        assert sequence.steps[1].target_amount == Wad.from_number(90)
+        assert sequence.profit(token1) == Wad.from_number(15)
+
+    def test_should_not_exceed_max_initial_amount_when_setting_optimal_amounts(self, token1, token2):
+        # given
+        step1 = Conversion(token1, token2, Ray.from_number(2.0), Wad.from_number(1000), 'met1')
+        step2 = Conversion(token2, token1, Ray.from_number(0.6), Wad.from_number(150), 'met2')
+        sequence = Sequence([step1, step2])
+
+        # when
+        sequence.set_optimal_amounts(Wad.from_number(10), token1)
+
+        # then
+        assert sequence.steps[0].source_amount == Wad.from_number(10)
+        assert sequence.profit(token1) == Wad.from_number(2)
+
+    def test_should_calculate_raw_total_rate_same_as_total_rate(self, token1, token2):
+        # given
+        step1 = Conversion(token1, token2, Ray.from_number(1.01) / Ray.from_number(3), Wad.from_number(1000), 'met1')
+        step2 = Conversion(token2, token1, Ray.from_number(3.07) / Ray.from_number(1.1), Wad.from_number(1000), 'met2')
+
+        # when
+        sequence = Sequence([step1, step2])
+
+        # then
+        assert sequence.raw_total_rate() == sequence.total_rate().value
+
+    @pytest.mark.parametrize("seed", range(10))
+    def test_should_calculate_raw_total_rate_same_as_total_rate_for_any_rates(self, token1, token2, seed):
+        # given
+        generator = random.Random(seed)
+        rays = [Ray(generator.randrange(5 * 10 ** 26, 15 * 10 ** 26)) for _ in range(4)]
+        steps = [Conversion(token1 if index % 2 == 0 else token2, token2 if index % 2 == 0 else token1,
+                            ray, Wad.from_number(1000), f"met{index}") for index, ray in enumerate(rays)]
+
+        # when
+        sequence = Sequence(steps)
+
+        # then
+        assert sequence.raw_total_rate() == sequence.total_rate().value
+
+    def test_should_round_raw_ray_multiplication_same_as_ray_multiplication(self):
+        # given
+        value1 = 412489869392898776925027888
+        value2 = 2553275717259214090673075260
+
+        # expect
+        assert raw_ray_mul(value1, value2) == (Ray(value1) * Ray(value2)).value
+        assert raw_ray_mul(value1, value2) == 1053200367136313165768209471
+
+    def test_should_round_raw_ray_division_same_as_ray_division(self, token1, token2):
+        # given
+        conversion = Conversion(token1, token2, Ray(6179353387245271562323219), Wad(10 ** 30), 'met1')
+        target_amount = Wad(32104344501048283123015)
+
+        # expect
+        assert raw_ray_div(Ray(target_amount).value, conversion.rate.value) == (Ray(target_amount) / conversion.rate).value
+        assert conversion.raw_source_amount_for(target_amount.value) == conversion.source_amount_for(target_amount).value
+        assert conversion.raw_source_amount_for(target_amount.value) == 5195421347371793224846313
+
+    @pytest.mark.parametrize("initial_amount", [0.5, 7, 13.333333, 100, 125.75, 400, 5000])
+    def test_should_calculate_raw_amounts_and_profit_same_as_set_amounts(self, token1, token2, initial_amount):
+        # given
+        token3 = Address('0x0303030303030303030303030303030303030303')
+
+        def order(order_id: int, pay_amount: Wad, buy_amount: Wad) -> Order:
+            return Order(market=None, order_id=order_id, maker=Address('0x0000000000000000000000000000000000000000'),
+                         pay_token=token1, pay_amount=pay_amount, buy_token=token3, buy_amount=buy_amount, timestamp=0)
+
+        step1 = Conversion(token1, token2, Ray.from_number(2.0) / Ray.from_number(3), Wad.from_number(300), 'met1')
+        step2 = Conversion(token2, token3, Ray.from_number(1.7), Wad.from_number(150), 'met2')
+        step3 = OasisBookConversion(None, [order(1, Wad.from_number(33), Wad.from_number(29)),
+                                           order(2, Wad.from_number(71), Wad.from_number(70)),
+                                           order(3, Wad.from_number(13), Wad.from_number(17))])
+        sequence = Sequence([step1, step2, step3])
+
+        # when
+        source_amounts, target_amounts = sequence.raw_amounts(Wad.from_number(initial_amount).value)
+        raw_profit = sequence.raw_profit(Wad.from_number(initial_amount).value, token1)
+        sequence.set_amounts(Wad.from_number(initial_amount))
+
+        # then
+        assert source_amounts == list(map(lambda step: step.source_amount.value, sequence.steps))
+        assert target_amounts == list(map(lambda step: step.target_amount.value, sequence.steps))
+        assert raw_profit == sequence.profit(token1).value
+
+    @pytest.mark.parametrize("seed", range(20))
+    def test_should_calculate_raw_amounts_and_profit_same_as_set_amounts_for_any_amounts(self, token1, token2, seed):
+        # given
+        token3 = Address('0x0303030303030303030303030303030303030303')
+        generator = random.Random(seed)
+
+        def amount() -> Wad:
+            return Wad(generator.randrange(10 ** 23, 10 ** 26))
+
+        def order(order_id: int) -> Order:
+            return Order(market=None, order_id=order_id, maker=Address('0x0000000000000000000000000000000000000000'),
+                         pay_token=token1, pay_amount=amount(), buy_token=token3, buy_amount=amount(), timestamp=0)
+
+        def max_amount() -> Wad:
+            return Wad(generator.randrange(10 ** 24, 10 ** 27))
+
+        step1 = Conversion(token1, token2, Ray(generator.randrange(10 ** 23, 10 ** 28)), max_amount(), 'met1')
+        step2 = Conversion(token2, token3, Ray(generator.randrange(10 ** 23, 10 ** 28)), max_amount(), 'met2')
+        step3 = OasisBookConversion(None, [order(1), order(2), order(3)])
+        sequence = Sequence([step1, step2, step3])
+
+        for initial_amount in [amount() for _ in range(100)]:
+            # when
+            source_amounts, target_amounts = sequence.raw_amounts(initial_amount.value)
+            raw_profit = sequence.raw_profit(initial_amount.value, token1)
+            sequence.set_amounts(initial_amount)
+
+            # then
+            assert source_amounts == list(map(lambda step: step.source_amount.value, sequence.steps))
+            assert target_amounts == list(map(lambda step: step.target_amount.value, sequence.steps))
+            assert raw_profit == sequence.profit(token1).value
+
+    def test_should_not_copy_nor_modify_conversions_when_setting_amounts(self, token1, token2):
+        # given
+        step1 = Conversion(token1, token2, Ray.from_number(1.01), Wad.from_number(1000), 'met1')
+        step2 = Conversion(token2, token1, Ray.from_number(1.02), Wad.from_number(1000), 'met2')
+
+        # when
+        sequence = Sequence([step1, step2])
+        sequence.set_amounts(Wad.from_number(100))
+
+        # then
+        assert sequence.conversions[0] is step1
+        assert sequence.conversions[1] is step2
+        assert step1.source_amount is None
+        assert step2.target_amount is None
+
+        # and
+        assert sequence.steps[0].source_amount == Wad.from_number(100)
+        assert sequence.steps[1].target_amount == Wad.from_number(103.02)
+
+    def test_should_not_allow_arbitrary_attributes_on_conversions(self, token1, token2):
+        # given
+        conversion = Conversion(token1, token2, Ray.from_number(1.01), Wad.from_number(1000), 'met1')
+
+        # expect
+        with pytest.raises(AttributeError):
+            conversion.something = 1
+
+
+class TestMostProfitable:
+    @pytest.fixture
+    def token1(self):
+        return Address('0x0101010101010101010101010101010101010101')
+
+    @pytest.fixture
+    def token2(self):
+        return Address('0x0202020202020202020202020202020202020202')
+
+    @staticmethod
+    def sequence(token1, token2, rate: float, max_amount: float) -> Sequence:
+        return Sequence([Conversion(token1, token2, Ray.from_number(rate), Wad.from_number(max_amount), 'met1'),
+                         Conversion(token2, token1, Ray.from_number(1.0), Wad.from_number(max_amount), 'met2')])
+
+    def test_should_pick_the_most_profitable_opportunities(self, token1, token2):
+        # given
+        sequence1 = self.sequence(token1, token2, 1.1, 1000)
+        sequence2 = self.sequence(token1, token2, 1.2, 1000)
+        sequence3 = self.sequence(token1, token2, 1.3, 10)
+
+        # when
+        opportunities = most_profitable(iter([sequence1, sequence2, sequence3]), token1, Wad.from_number(100),
+                                        Ray.from_number(1.000001), Wad(0), 2)
+
+        # then
+        assert opportunities == [sequence2, sequence1]
+        assert opportunities[0].steps[0].source_amount == Wad.from_number(100)
+        assert opportunities[0].profit(token1) == Wad.from_number(20)
+
+    def test_should_skip_opportunities_below_min_rate_and_min_profit(self, token1, token2):
+        # given
+        sequence1 = self.sequence(token1, token2, 0.9, 1000)
+        sequence2 = self.sequence(token1, token2, 1.01, 1000)
+
+        # when
+        opportunities = most_profitable(iter([sequence1, sequence2]), token1, Wad.from_number(100),
+                                        Ray.from_number(1.000001), Wad.from_number(5), 2)
+
+        # then
+        assert opportunities == []
+
+    def test_should_stop_as_soon_as_no_longer_current(self, token1, token2):
+        # given
+        sequence1 = self.sequence(token1, token2, 1.1, 1000)
+        sequence2 = self.sequence(token1, token2, 1.2, 1000)
+        checks = itertools.chain([True], itertools.repeat(False))
+
+        # when
+        opportunities = most_profitable(iter([sequence1, sequence2]), token1, Wad.from_number(100),
+                                        Ray.from_number(1.000001), Wad(0), 2, is_current=lambda: next(checks))
+
+        # then
+        assert opportunities == [sequence1]
+        assert sequence2.steps[0].source_amount is None
+
+
+class TestSelectNonConflicting:
+    @pytest.fixture
+    def token1(self):
+        return Address('0x0101010101010101010101010101010101010101')
+
+    @pytest.fixture
+    def token2(self):
+        return Address('0x0202020202020202020202020202020202020202')
+
+    @staticmethod
+    def sequence(token1, token2, method1: str, method2: str, amount: float) -> Sequence:
+        sequence = Sequence([Conversion(token1, token2, Ray.from_number(1.1), Wad.from_number(1000), method1),
+                             Conversion(token2, token1, Ray.from_number(1.1), Wad.from_number(1000), method2)])
+        sequence.set_amounts(Wad.from_number(amount))
+        return sequence
+
+    def test_should_skip_opportunities_sharing_orders_or_actions(self, token1, token2):
+        # given
+        opportunity1 = self.sequence(token1, token2, 'otc.take(1)', 'tub.join()', 10)
+        opportunity2 = self.sequence(token1, token2, 'otc.take(2)', 'tub.join()', 10)
+        opportunity3 = self.sequence(token1, token2, 'otc.take(3)', 'otc.take(4)', 10)
+
+        # when
+        selected = select_non_conflicting([opportunity1, opportunity2, opportunity3], 5, Wad.from_number(100))
+
+        # then
+        assert selected == [opportunity1, opportunity3]
+
+    def test_should_keep_combined_engagement_within_available_amount(self, token1, token2):
+        # given
+        opportunity1 = self.sequence(token1, token2, 'otc.take(1)', 'otc.take(2)', 60)
+        opportunity2 = self.sequence(token1, token2, 'otc.take(3)', 'otc.take(4)', 50)
+        opportunity3 = self.sequence(token1, token2, 'otc.take(5)', 'otc.take(6)', 40)
+
+        # when
+        selected = select_non_conflicting([opportunity1, opportunity2, opportunity3], 5, Wad.from_number(100))
+
+        # then
+        assert selected == [opportunity1, opportunity3]
+
+    def test_should_select_at_most_max_count_opportunities(self, token1, token2):
+        # given
+        opportunity1 = self.sequence(token1, token2, 'otc.take(1)', 'otc.take(2)', 10)
+        opportunity2 = self.sequence(token1, token2, 'otc.take(3)', 'otc.take(4)', 10)
+
+        # expect
+        assert select_non_conflicting([opportunity1, opportunity2], 1, Wad.from_number(100)) == [opportunity1]
+        assert select_non_conflicting([], 1, Wad.from_number(100)) == []
+
 
 class TestOpportunityFinder:
     @pytest.fixture
@@ -232,3 +558,421 @@ class TestOpportunityFinder:
         assert opportunities[0].steps[3].method == "met4"
         assert opportunities[0].steps[3].source_amount == Wad.from_number(120)
         assert opportunities[0].steps[3].target_amount == Wad.from_number(132)
+
+    def test_should_only_identify_opportunities_up_to_max_steps(self, token1, token2, token3, token4):
+        # given
+        conversion1 = Conversion(token1, token2, Ray.from_number(1.02), Wad.from_number(10000), 'met1')
+        conversion2 = Conversion(token2, token1, Ray.from_number(1.03), Wad.from_number(10000), 'met2')
+        conversion3 = Conversion(token2, token3, Ray.from_number(1.04), Wad.from_number(10000), 'met3')
+        conversion4 = Conversion(token3, token4, Ray.from_number(1.05), Wad.from_number(10000), 'met4')
+        conversion5 = Conversion(token4, token1, Ray.from_number(1.06), Wad.from_number(10000), 'met5')
+        conversions = [conversion1, conversion2, conversion3, conversion4, conversion5]
+        base_token = token1
+
+        # expect
+        assert len(OpportunityFinder(conversions).find_opportunities(base_token, Wad.from_number(100))) == 2
+        assert len(OpportunityFinder(conversions).find_opportunities(base_token, Wad.from_number(100), max_steps=4)) == 2
+        assert len(OpportunityFinder(conversions).find_opportunities(base_token, Wad.from_number(100), max_steps=3)) == 1
+        assert len(OpportunityFinder(conversions).find_opportunities(base_token, Wad.from_number(100), max_steps=1)) == 0
+
+    def test_should_calculate_amounts_when_max_steps_specified(self, token1, token2):
+        # given
+        conversion1 = Conversion(token1, token2, Ray.from_number(2.0), Wad.from_number(10000), 'met1')
+        conversion2 = Conversion(token2, token1, Ray.from_number(1.5), Wad.from_number(10000), 'met2')
+        conversions = [conversion1, conversion2]
+        base_token = token1
+
+        # when
+        opportunities = OpportunityFinder(conversions).find_opportunities(base_token, Wad.from_number(100), max_steps=2)
+
+        # then
+        assert len(opportunities) == 1
+        assert opportunities[0].steps[0].method == "met1"
+        assert opportunities[0].steps[0].source_amount == Wad.from_number(100)
+        assert opportunities[0].steps[1].method == "met2"
+        assert opportunities[0].steps[1].target_amount == Wad.from_number(300)
+
+    def test_should_recognize_if_there_are_no_opportunities_when_max_steps_specified(self, token1, token2, token3):
+        # given
+        conversion1 = Conversion(token2, token3, Ray.from_number(1.03), Wad.from_number(10000), 'met1')
+        conversions = [conversion1]
+        base_token = token1
+
+        # when
+        opportunities = OpportunityFinder(conversions).find_opportunities(base_token, Wad.from_number(100), max_steps=5)
+
+        # then
+        assert len(opportunities) == 0
+
+    def test_should_iterate_opportunities_lazily(self, token1, token2, token3):
+        # given
+        conversion1 = Conversion(token1, token2, Ray.from_number(1.02), Wad.from_number(10000), 'met1')
+        conversion2 = Conversion(token2, token1, Ray.from_number(1.03), Wad.from_number(10000), 'met2')
+        conversion3 = Conversion(token2, token3, Ray.from_number(1.04), Wad.from_number(10000), 'met3')
+        conversion4 = Conversion(token3, token1, Ray.from_number(1.05), Wad.from_number(10000), 'met4')
+        conversions = [conversion1, conversion2, conversion3, conversion4]
+        base_token = token1
+
+        # when
+        opportunities = OpportunityFinder(conversions).iterate_opportunities(base_token)
+
+        # then
+        assert list(map(lambda step: step.method, next(opportunities).steps)) == ["met1", "met2"]
+        assert list(map(lambda step: step.method, next(opportunities).steps)) == ["met1", "met3", "met4"]
+        assert next(opportunities, None) is None
+
+    def test_should_iterate_over_no_opportunities(self, token1, token2, token3):
+        # given
+        conversion1 = Conversion(token2, token3, Ray.from_number(1.03), Wad.from_number(10000), 'met1')
+        conversions = [conversion1]
+        base_token = token1
+
+        # expect
+        assert list(OpportunityFinder(conversions).iterate_opportunities(base_token)) == []
+        assert list(OpportunityFinder(conversions).iterate_opportunities(base_token, max_steps=3)) == []
+
+    def test_should_prune_conversions_which_can_not_be_profitable(self, token1, token2, token3):
+        # given
+        conversion1 = Conversion(token1, token2, Ray.from_number(2.0), Wad.from_number(10000), 'met1')
+        conversion2 = Conversion(token2, token1, Ray.from_number(0.6), Wad.from_number(10000), 'met2')
+        conversion3 = Conversion(token2, token1, Ray.from_number(0.4), Wad.from_number(10000), 'met3')
+        conversion4 = Conversion(token2, token3, Ray.from_number(1.0), Wad.from_number(10000), 'met4')
+        conversion5 = Conversion(token3, token1, Ray.from_number(0.3), Wad.from_number(10000), 'met5')
+        conversions = [conversion1, conversion2, conversion3, conversion4, conversion5]
+        base_token = token1
+
+        # when
+        pruned = OpportunityFinder(conversions, min_rate=Ray.from_number(1.000001))._prune_conversions(base_token, None)
+
+        # then
+        assert pruned == [conversion1, conversion2]
+
+    def test_should_prune_everything_if_nothing_can_be_profitable(self, token1, token2):
+        # given
+        conversion1 = Conversion(token1, token2, Ray.from_number(2.0), Wad.from_number(10000), 'met1')
+        conversion2 = Conversion(token2, token1, Ray.from_number(0.4), Wad.from_number(10000), 'met2')
+        conversions = [conversion1, conversion2]
+        base_token = token1
+
+        # expect
+        assert OpportunityFinder(conversions, min_rate=Ray.from_number(1.000001))._prune_conversions(base_token, None) == []
+
+    def test_should_find_the_same_profitable_opportunities_with_pruning(self, token1, token2, token3, token4):
+        # given
+        conversions = [Conversion(token1, token2, Ray.from_number(1.02), Wad.from_number(10000), 'met1'),
+                       Conversion(token2, token1, Ray.from_number(1.03), Wad.from_number(10000), 'met2'),
+                       Conversion(token2, token1, Ray.from_number(0.90), Wad.from_number(10000), 'met3'),
+                       Conversion(token2, token3, Ray.from_number(1.04), Wad.from_number(10000), 'met4'),
+                       Conversion(token3, token4, Ray.from_number(0.50), Wad.from_number(10000), 'met5'),
+                       Conversion(token4, token1, Ray.from_number(1.06), Wad.from_number(10000), 'met6'),
+                       Conversion(token3, token1, Ray.from_number(0.95), Wad.from_number(10000), 'met7')]
+        base_token = token1
+        min_rate = Ray.from_number(1.000001)
+
+        def profitable_methods(opportunity_finder: OpportunityFinder, max_steps):
+            opportunities = opportunity_finder.find_opportunities(base_token, Wad.from_number(100), max_steps)
+            opportunities = filter(lambda opportunity: opportunity.total_rate() > min_rate, opportunities)
+            return sorted(map(lambda opportunity: tuple(map(lambda step: step.method, opportunity.steps)), opportunities))
+
+        # expect
+        for max_steps in [None, 2, 3, 4]:
+            assert profitable_methods(OpportunityFinder(conversions, min_rate=min_rate), max_steps) == \
+                   profitable_methods(OpportunityFinder(conversions), max_steps)
+
+    def test_should_only_generate_opportunities_above_min_rate(self, token1, token2, token3):
+        # given
+        conversion1 = Conversion(token1, token2, Ray.from_number(2.0), Wad.from_number(10000), 'met1')
+        conversion2 = Conversion(token2, token1, Ray.from_number(0.6), Wad.from_number(10000), 'met2')
+        conversion3 = Conversion(token2, token3, Ray.from_number(3.0), Wad.from_number(10000), 'met3')
+        conversion4 = Conversion(token3, token1, Ray.from_number(0.1), Wad.from_number(10000), 'met4')
+        conversion5 = Conversion(token3, token1, Ray.from_number(0.2), Wad.from_number(10000), 'met5')
+        conversions = [conversion1, conversion2, conversion3, conversion4, conversion5]
+        base_token = token1
+
+        # when
+        opportunities = list(OpportunityFinder(conversions, min_rate=Ray.from_number(1.000001)).iterate_opportunities(base_token))
+
+        # then
+        assert len(opportunities) == 2
+        assert opportunities[0].conversions == [conversion1, conversion2]
+        assert opportunities[1].conversions == [conversion1, conversion3, conversion5]
+
+    def test_should_find_the_same_profitable_opportunities_with_branch_and_bound(self, token1, token2, token3, token4):
+        # given
+        tokens = [token1, token2, token3, token4]
+        rates = [0.5, 0.9, 1.01, 1.1, 2.0]
+        conversions = []
+        for index, (src, dst) in enumerate(itertools.permutations(tokens, 2)):
+            for rate in rates[index % 3:index % 3 + 3]:
+                conversions.append(Conversion(src, dst, Ray.from_number(rate), Wad.from_number(10000), f"met{len(conversions)}"))
+        base_token = token1
+        min_rate = Ray.from_number(1.000001)
+
+        def profitable_methods(opportunity_finder: OpportunityFinder, max_steps):
+            opportunities = opportunity_finder.iterate_opportunities(base_token, max_steps)
+            opportunities = filter(lambda opportunity: opportunity.total_rate() > min_rate, opportunities)
+            return sorted(map(lambda opportunity: tuple(map(lambda step: step.method, opportunity.steps)), opportunities))
+
+        # expect
+        for max_steps in [None, 1, 2, 3]:
+            assert profitable_methods(OpportunityFinder(conversions, min_rate=min_rate), max_steps) == \
+                   profitable_methods(OpportunityFinder(conversions), max_steps)
+
+
+    @pytest.mark.parametrize("min_rate", [None, Ray.from_number(1.000001)])
+    def test_should_stop_searching_as_soon_as_no_longer_current(self, token1, token2, token3, min_rate):
+        # given
+        conversion1 = Conversion(token1, token2, Ray.from_number(1.02), Wad.from_number(10000), 'met1')
+        conversion2 = Conversion(token2, token1, Ray.from_number(1.03), Wad.from_number(10000), 'met2')
+        conversion3 = Conversion(token2, token3, Ray.from_number(1.01), Wad.from_number(10000), 'met3')
+        conversion4 = Conversion(token3, token1, Ray.from_number(1.04), Wad.from_number(10000), 'met4')
+        conversions = [conversion1, conversion2, conversion3, conversion4]
+        finder = OpportunityFinder(conversions, min_rate=min_rate)
+
+        # expect
+        assert len(list(finder.iterate_opportunities(token1, is_current=lambda: True))) == 2
+        assert list(finder.iterate_opportunities(token1, is_current=lambda: False)) == []
+
+
+class TestNegativeCycleFinder:
+    @pytest.fixture
+    def token1(self):
+        return Address('0x0101010101010101010101010101010101010101')
+
+    @pytest.fixture
+    def token2(self):
+        return Address('0x0202020202020202020202020202020202020202')
+
+    @pytest.fixture
+    def token3(self):
+        return Address('0x0303030303030303030303030303030303030303')
+
+    @pytest.fixture
+    def token4(self):
+        return Address('0x0404040404040404040404040404040404040404')
+
+    def test_should_identify_opportunity(self, token1, token2):
+        # given
+        conversion1 = Conversion(token1, token2, Ray.from_number(1.02), Wad.from_number(10000), 'met1')
+        conversion2 = Conversion(token2, token1, Ray.from_number(1.03), Wad.from_number(10000), 'met2')
+        conversions = [conversion1, conversion2]
+        base_token = token1
+
+        # when
+        opportunities = NegativeCycleFinder(conversions).find_opportunities(base_token, Wad.from_number(100))
+
+        # then
+        assert len(opportunities) == 1
+        assert len(opportunities[0].steps) == 2
+        assert opportunities[0].steps[0].method == "met1"
+        assert opportunities[0].steps[1].method == "met2"
+
+    def test_should_identify_multi_step_opportunities(self, token1, token2, token3, token4):
+        # given
+        conversion1 = Conversion(token1, token2, Ray.from_number(1.02), Wad.from_number(10000), 'met1')
+        conversion2 = Conversion(token2, token3, Ray.from_number(1.03), Wad.from_number(10000), 'met2')
+        conversion3 = Conversion(token3, token4, Ray.from_number(1.05), Wad.from_number(10000), 'met3')
+        conversion4 = Conversion(token4, token1, Ray.from_number(1.07), Wad.from_number(10000), 'met4')
+        conversions = [conversion1, conversion2, conversion3, conversion4]
+        base_token = token1
+
+        # when
+        opportunities = NegativeCycleFinder(conversions).find_opportunities(base_token, Wad.from_number(100))
+
+        # then
+        assert len(opportunities) == 1
+        assert list(map(lambda step: step.method, opportunities[0].steps)) == ["met1", "met2", "met3", "met4"]
+
+    def test_should_identify_cycle_not_extending_the_best_path(self, token1, token2, token3, token4):
+        # given
+        # [the best path to token3 goes through token2, which blocks the best cycle closing with token2]
+        conversion1 = Conversion(token1, token2, Ray.from_number(2.0), Wad.from_number(10000), 'met1')
+        conversion2 = Conversion(token2, token3, Ray.from_number(1.0), Wad.from_number(10000), 'met2')
+        conversion3 = Conversion(token1, token4, Ray.from_number(1.0), Wad.from_number(10000), 'met3')
+        conversion4 = Conversion(token4, token3, Ray.from_number(1.5), Wad.from_number(10000), 'met4')
+        conversion5 = Conversion(token3, token2, Ray.from_number(1.0), Wad.from_number(10000), 'met5')
+        conversion6 = Conversion(token2, token1, Ray.from_number(1.0), Wad.from_number(10000), 'met6')
+        conversions = [conversion1, conversion2, conversion3, conversion4, conversion5, conversion6]
+        base_token = token1
+
+        # when
+        opportunities = NegativeCycleFinder(conversions).find_opportunities(base_token, Wad.from_number(100))
+
+        # then
+        assert ["met3", "met4", "met5", "met6"] in list(map(lambda opportunity: list(map(lambda step: step.method, opportunity.steps)),
+                                                            opportunities))
+
+    @pytest.mark.parametrize("seed", range(20))
+    def test_should_find_the_same_best_cycle_as_exhaustive_search(self, token1, token2, token3, token4, seed):
+        # given
+        generator = random.Random(seed)
+        tokens = [token1, token2, token3, token4]
+        conversions = [Conversion(source_token, target_token, Ray.from_number(generator.uniform(0.5, 1.5)),
+                                  Wad.from_number(10000), f"met{index}")
+                       for index, (source_token, target_token) in enumerate(itertools.permutations(tokens, 2))]
+        base_token = token1
+
+        # when
+        best = max(map(lambda op: op.total_rate(), OpportunityFinder(conversions).iterate_opportunities(base_token)))
+        opportunities = list(NegativeCycleFinder(conversions).iterate_opportunities(base_token))
+
+        # then
+        if best > Ray.from_number(1):
+            assert max(map(lambda op: op.total_rate(), opportunities)) == best
+        else:
+            assert opportunities == []
+
+    def test_should_only_identify_profitable_opportunities(self, token1, token2, token3):
+        # given
+        conversion1 = Conversion(token1, token2, Ray.from_number(1.1), Wad.from_number(10000), 'met1')
+        conversion2 = Conversion(token2, token1, Ray.from_number(0.6), Wad.from_number(10000), 'met2')
+        conversion3 = Conversion(token2, token3, Ray.from_number(1.2), Wad.from_number(10000), 'met3')
+        conversion4 = Conversion(token3, token1, Ray.from_number(0.8), Wad.from_number(10000), 'met4')
+        conversions = [conversion1, conversion2, conversion3, conversion4]
+        base_token = token1
+
+        # when
+        opportunities = NegativeCycleFinder(conversions).find_opportunities(base_token, Wad.from_number(100))
+
+        # then
+        assert len(opportunities) == 1
+        assert list(map(lambda step: step.method, opportunities[0].steps)) == ["met1", "met3", "met4"]
+        assert opportunities[0].total_rate() > Ray.from_number(1)
+
+    def test_should_pick_the_best_conversion_for_each_step(self, token1, token2):
+        # given
+        conversion1 = Conversion(token1, token2, Ray.from_number(1.02), Wad.from_number(10000), 'met1')
+        conversion2 = Conversion(token1, token2, Ray.from_number(1.04), Wad.from_number(10000), 'met2')
+        conversion3 = Conversion(token2, token1, Ray.from_number(1.03), Wad.from_number(10000), 'met3')
+        conversions = [conversion1, conversion2, conversion3]
+        base_token = token1
+
+        # when
+        opportunities = NegativeCycleFinder(conversions).find_opportunities(base_token, Wad.from_number(100))
+
+        # then
+        assert len(opportunities) == 1
+        assert list(map(lambda step: step.method, opportunities[0].steps)) == ["met2", "met3"]
+
+    def test_should_obey_max_steps(self, token1, token2, token3):
+        # given
+        conversion1 = Conversion(token1, token2, Ray.from_number(1.02), Wad.from_number(10000), 'met1')
+        conversion2 = Conversion(token2, token3, Ray.from_number(1.03), Wad.from_number(10000), 'met2')
+        conversion3 = Conversion(token3, token1, Ray.from_number(1.05), Wad.from_number(10000), 'met3')
+        conversions = [conversion1, conversion2, conversion3]
+        base_token = token1
+
+        # expect
+        assert len(NegativeCycleFinder(conversions).find_opportunities(base_token, Wad.from_number(100), max_steps=3)) == 1
+        assert len(NegativeCycleFinder(conversions).find_opportunities(base_token, Wad.from_number(100), max_steps=2)) == 0
+
+    def test_should_calculate_amounts_based_on_rates(self, token1, token2):
+        # given
+        conversion1 = Conversion(token1, token2, Ray.from_number(2.0), Wad.from_number(10000), 'met1')
+        conversion2 = Conversion(token2, token1, Ray.from_number(0.6), Wad.from_number(150), 'met2')
+        conversions = [conversion1, conversion2]
+        base_token = token1
+
+        # when
+        opportunities = NegativeCycleFinder(conversions).find_opportunities(base_token, Wad.from_number(100))
+
+        # then
+        assert len(opportunities) == 1
+        assert opportunities[0].steps[0].source_amount == Wad.from_number(75)
+        assert opportunities[0].steps[0].target_amount == Wad.from_number(150)
+        assert opportunities[0].steps[1].source_amount == Wad.from_number(150)
+        assert opportunities[0].steps[1].target_amount == Wad.from_number(90)
+
+    def test_should_recognize_if_there_are_no_opportunities(self, token1, token2, token3):
+        # given
+        conversion1 = Conversion(token1, token2, Ray.from_number(1.02), Wad.from_number(10000), 'met1')
+        conversion2 = Conversion(token2, token3, Ray.from_number(1.03), Wad.from_number(10000), 'met2')
+        conversions = [conversion1, conversion2]
+        base_token = token1
+
+        # when
+        opportunities = NegativeCycleFinder(conversions).find_opportunities(base_token, Wad.from_number(100))
+
+        # then
+        assert len(opportunities) == 0
+
+
+    def test_should_stop_searching_as_soon_as_no_longer_current(self, token1, token2):
+        # given
+        conversion1 = Conversion(token1, token2, Ray.from_number(1.02), Wad.from_number(10000), 'met1')
+        conversion2 = Conversion(token2, token1, Ray.from_number(1.03), Wad.from_number(10000), 'met2')
+        finder = NegativeCycleFinder([conversion1, conversion2])
+
+        # expect
+        assert len(list(finder.iterate_opportunities(token1, is_current=lambda: True))) == 1
+        assert list(finder.iterate_opportunities(token1, is_current=lambda: False)) == []
+
+
+class TestTemplateFinder:
+    @pytest.fixture
+    def token1(self):
+        return Address('0x0101010101010101010101010101010101010101')
+
+    @pytest.fixture
+    def token2(self):
+        return Address('0x0202020202020202020202020202020202020202')
+
+    @pytest.fixture
+    def token3(self):
+        return Address('0x0303030303030303030303030303030303030303')
+
+    def test_should_enumerate_templates(self, token1, token2, token3):
+        # when
+        templates = TemplateFinder.templates([token1, token2, token3], token1)
+
+        # then
+        assert templates == [[token1, token2], [token1, token3], [token1, token2, token3], [token1, token3, token2]]
+
+    def test_should_enumerate_templates_up_to_max_steps(self, token1, token2, token3):
+        # expect
+        assert TemplateFinder.templates([token1, token2, token3], token1, max_steps=2) == [[token1, token2], [token1, token3]]
+        assert TemplateFinder.templates([token1, token2, token3], token1, max_steps=1) == []
+
+    def test_should_pick_the_best_conversion_for_each_hop(self, token1, token2, token3):
+        # given
+        conversion1 = Conversion(token1, token2, Ray.from_number(1.02), Wad.from_number(10000), 'met1')
+        conversion2 = Conversion(token1, token2, Ray.from_number(1.05), Wad.from_number(10000), 'met2')
+        conversion3 = Conversion(token2, token1, Ray.from_number(1.01), Wad.from_number(10000), 'met3')
+        conversion4 = Conversion(token2, token3, Ray.from_number(1.04), Wad.from_number(10000), 'met4')
+        conversions = [conversion1, conversion2, conversion3, conversion4]
+        base_token = token1
+
+        # when
+        templates = TemplateFinder.templates([token1, token2, token3], base_token)
+        opportunities = TemplateFinder(conversions, templates).find_opportunities(base_token, Wad.from_number(100))
+
+        # then
+        assert len(opportunities) == 1
+        assert opportunities[0].conversions == [conversion2, conversion3]
+        assert opportunities[0].steps[0].source_amount == Wad.from_number(100)
+        assert opportunities[0].steps[1].target_amount == Wad.from_number(106.05)
+
+    def test_should_identify_multi_step_opportunities(self, token1, token2, token3):
+        # given
+        conversion1 = Conversion(token1, token2, Ray.from_number(1.02), Wad.from_number(10000), 'met1')
+        conversion2 = Conversion(token2, token3, Ray.from_number(1.03), Wad.from_number(10000), 'met2')
+        conversion3 = Conversion(token3, token1, Ray.from_number(1.04), Wad.from_number(10000), 'met3')
+        conversions = [conversion1, conversion2, conversion3]
+        base_token = token1
+
+        # when
+        templates = TemplateFinder.templates([token1, token2, token3], base_token)
+
+        # then
+        assert len(TemplateFinder(conversions, templates).find_opportunities(base_token, Wad.from_number(100))) == 1
+        assert len(TemplateFinder(conversions, templates).find_opportunities(base_token, Wad.from_number(100), max_steps=2)) == 0
+
+    def test_should_stop_searching_as_soon_as_no_longer_current(self, token1, token2, token3):
+        # given
+        conversion1 = Conversion(token1, token2, Ray.from_number(1.02), Wad.from_number(10000), 'met1')
+        conversion2 = Conversion(token2, token1, Ray.from_number(1.03), Wad.from_number(10000), 'met2')
+        finder = TemplateFinder([conversion1, conversion2], TemplateFinder.templates([token1, token2, token3], token1))
+
+        # expect
+        assert len(list(finder.iterate_opportunities(token1, is_current=lambda: True))) == 1
+        assert list(finder.iterate_opportunities(token1, is_current=lambda: False)) == []
@@ -0,0 +1,272 @@
+# This file is part of Maker Keeper Framework.
+#
+# Copyright (C) 2018 reverendus
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import pytest
+
+from arbitrage_keeper.batch import ContractCall, batch_call
+from arbitrage_keeper.order_book import OasisOrderBook, ZrxOrderBook, zrx_order_hash, zrx_order_key
+from pymaker import Address
+from pymaker.approval import directly
+from pymaker.deployment import Deployment, deploy_contract
+from pymaker.numeric import Wad
+from pymaker.zrx import ZrxExchange
+
+
+class TestOasisOrderBook:
+    @pytest.fixture
+    def deployment(self, deployment: Deployment) -> Deployment:
+        deployment.gem.mint(Wad.from_number(1000)).transact()
+        deployment.tub.join(Wad.from_number(500)).transact()
+        deployment.otc.approve([deployment.gem, deployment.skr], directly())
+        deployment.otc.add_token_pair_whitelist(deployment.skr.address, deployment.gem.address).transact()
+        return deployment
+
+    def test_should_download_all_orders_on_first_sync(self, deployment: Deployment):
+        # given
+        deployment.otc.make(deployment.gem.address, Wad.from_number(10), deployment.skr.address, Wad.from_number(5)).transact()
+        deployment.otc.make(deployment.skr.address, Wad.from_number(5), deployment.gem.address, Wad.from_number(12)).transact()
+        order_book = OasisOrderBook(deployment.otc, [deployment.gem.address, deployment.skr.address])
+
+        # when
+        order_book.sync()
+
+        # then
+        assert len(order_book.get_orders()) == 2
+        assert len(order_book.get_orders(deployment.gem.address, deployment.skr.address)) == 1
+        assert len(order_book.get_orders(deployment.skr.address, deployment.gem.address)) == 1
+        assert order_book.last_block_number == deployment.web3.eth.blockNumber
+
+    def test_should_add_new_orders(self, deployment: Deployment):
+        # given
+        order_book = OasisOrderBook(deployment.otc, [deployment.gem.address, deployment.skr.address])
+        order_book.sync()
+        assert len(order_book.get_orders()) == 0
+
+        # when
+        deployment.otc.make(deployment.gem.address, Wad.from_number(10), deployment.skr.address, Wad.from_number(5)).transact()
+        order_book.sync()
+
+        # then
+        assert len(order_book.get_orders()) == 1
+        assert order_book.get_orders()[0].pay_amount == Wad.from_number(10)
+        assert order_book.get_orders()[0].buy_amount == Wad.from_number(5)
+
+    def test_should_update_partially_taken_orders(self, deployment: Deployment):
+        # given
+        deployment.otc.make(deployment.gem.address, Wad.from_number(10), deployment.skr.address, Wad.from_number(5)).transact()
+        order_book = OasisOrderBook(deployment.otc, [deployment.gem.address, deployment.skr.address])
+        order_book.sync()
+
+        # when
+        deployment.otc.take(order_book.get_orders()[0].order_id, Wad.from_number(4)).transact()
+        order_book.sync()
+
+        # then
+        assert len(order_book.get_orders()) == 1
+        assert order_book.get_orders()[0].pay_amount == Wad.from_number(6)
+        assert order_book.get_orders()[0].buy_amount == Wad.from_number(3)
+
+    def test_should_remove_fully_taken_orders(self, deployment: Deployment):
+        # given
+        deployment.otc.make(deployment.gem.address, Wad.from_number(10), deployment.skr.address, Wad.from_number(5)).transact()
+        order_book = OasisOrderBook(deployment.otc, [deployment.gem.address, deployment.skr.address])
+        order_book.sync()
+
+        # when
+        deployment.otc.take(order_book.get_orders()[0].order_id, Wad.from_number(10)).transact()
+        order_book.sync()
+
+        # then
+        assert len(order_book.get_orders()) == 0
+
+    def test_should_remove_cancelled_orders(self, deployment: Deployment):
+        # given
+        deployment.otc.make(deployment.gem.address, Wad.from_number(10), deployment.skr.address, Wad.from_number(5)).transact()
+        order_book = OasisOrderBook(deployment.otc, [deployment.gem.address, deployment.skr.address])
+        order_book.sync()
+
+        # when
+        deployment.otc.kill(order_book.get_orders()[0].order_id).transact()
+        order_book.sync()
+
+        # then
+        assert len(order_book.get_orders()) == 0
+
+    def test_should_read_changes_from_the_given_blocks_regardless_of_newer_blocks(self, deployment: Deployment):
+        # given
+        deployment.otc.make(deployment.gem.address, Wad.from_number(10), deployment.skr.address, Wad.from_number(5)).transact()
+        deployment.otc.make(deployment.gem.address, Wad.from_number(20), deployment.skr.address, Wad.from_number(5)).transact()
+        order_book = OasisOrderBook(deployment.otc, [deployment.gem.address, deployment.skr.address])
+        order_book.sync()
+        killed_order_id = order_book.get_orders()[0].order_id
+
+        # and
+        deployment.otc.kill(killed_order_id).transact()
+        kill_block_number = deployment.web3.eth.blockNumber
+        deployment.otc.take(order_book.get_orders()[1].order_id, Wad.from_number(4)).transact()
+        deployment.otc.make(deployment.gem.address, Wad.from_number(30), deployment.skr.address, Wad.from_number(5)).transact()
+
+        # expect
+        assert order_book._changed_order_ids(kill_block_number, kill_block_number) == {killed_order_id}
+
+    def test_should_ignore_orders_of_other_tokens(self, deployment: Deployment):
+        # given
+        deployment.otc.add_token_pair_whitelist(deployment.sai.address, deployment.gem.address).transact()
+        deployment.otc.make(deployment.gem.address, Wad.from_number(10), deployment.sai.address, Wad.from_number(5)).transact()
+        order_book = OasisOrderBook(deployment.otc, [deployment.gem.address, deployment.skr.address])
+
+        # when
+        order_book.sync()
+
+        # then
+        assert len(order_book.get_orders()) == 0
+
+        # when
+        deployment.otc.make(deployment.gem.address, Wad.from_number(20), deployment.sai.address, Wad.from_number(5)).transact()
+        order_book.sync()
+
+        # then
+        assert len(order_book.get_orders()) == 0
+
+
+class FakeFeed:
+    """Stand-in for `RelayerFeed`, passing on the changes queued with `add` and `remove`."""
+
+    def __init__(self):
+        self.added_orders = []
+        self.removed_keys = []
+
+    def add(self, order):
+        self.added_orders.append(order)
+
+    def remove(self, order):
+        self.removed_keys.append(zrx_order_key(order.maker.address, order.salt))
+
+    def poll(self):
+        result = self.added_orders, self.removed_keys
+        self.added_orders, self.removed_keys = [], []
+        return result
+
+
+class TestZrxOrderBook:
+    @pytest.fixture
+    def exchange(self, deployment: Deployment) -> ZrxExchange:
+        return ZrxExchange(web3=deployment.web3, address=Address('0x0101010101010101010101010101010101010101'))
+
+    @staticmethod
+    def create_order(exchange: ZrxExchange, deployment: Deployment, expiration: int):
+        return exchange.create_order(pay_token=deployment.sai.address, pay_amount=Wad.from_number(10),
+                                     buy_token=deployment.gem.address, buy_amount=Wad.from_number(5), expiration=expiration)
+
+    def test_should_add_new_orders(self, deployment: Deployment, exchange: ZrxExchange):
+        # given
+        feed = FakeFeed()
+        order_book = ZrxOrderBook(feed)
+        order1 = self.create_order(exchange, deployment, 2000)
+        order2 = self.create_order(exchange, deployment, 3000)
+
+        # when
+        feed.add(order1)
+        order_book.sync(now=1000)
+        feed.add(order2)
+        order_book.sync(now=1000)
+
+        # then
+        assert order_book.get_orders() == [order1, order2]
+        assert order_book.get_orders(pay_token=deployment.gem.address) == []
+
+    def test_should_remove_orders_removed_by_the_feed(self, deployment: Deployment, exchange: ZrxExchange):
+        # given
+        feed = FakeFeed()
+        order_book = ZrxOrderBook(feed)
+        order1 = self.create_order(exchange, deployment, 2000)
+        order2 = self.create_order(exchange, deployment, 3000)
+        feed.add(order1)
+        feed.add(order2)
+        order_book.sync(now=1000)
+
+        # when
+        feed.remove(order1)
+        order_book.sync(now=1000)
+
+        # then
+        assert order_book.get_orders() == [order2]
+
+    def test_should_evict_expired_orders(self, deployment: Deployment, exchange: ZrxExchange):
+        # given
+        feed = FakeFeed()
+        order_book = ZrxOrderBook(feed)
+        order1 = self.create_order(exchange, deployment, 3000)
+        order2 = self.create_order(exchange, deployment, 2000)
+        order3 = self.create_order(exchange, deployment, 4000)
+        feed.add(order1)
+        feed.add(order2)
+        feed.add(order3)
+
+        # when
+        order_book.sync(now=1000)
+        # then
+        assert order_book.get_orders() == [order1, order2, order3]
+
+        # when
+        order_book.sync(now=2000)
+        # then
+        assert order_book.get_orders() == [order1, order3]
+
+        # when
+        order_book.sync(now=3500)
+        # then
+        assert order_book.get_orders() == [order3]
+
+    def test_should_keep_orders_removed_and_added_again(self, deployment: Deployment, exchange: ZrxExchange):
+        # given
+        feed = FakeFeed()
+        order_book = ZrxOrderBook(feed)
+        order = self.create_order(exchange, deployment, 2000)
+        feed.add(order)
+        order_book.sync(now=1000)
+        order_book.remove(order)
+        order_book.sync(now=1000)
+
+        # when
+        feed.add(order)
+        order_book.sync(now=1500)
+
+        # then
+        assert order_book.get_orders() == [order]
+        assert order_book.expirations[0][0] == 2000
+
+
+class TestZrxOrderHash:
+    def test_should_calculate_the_same_hash_as_the_exchange(self, deployment: Deployment):
+        # given
+        zrx_token_address = deploy_contract(deployment.web3, 'ZRXToken')
+        token_transfer_proxy_address = deploy_contract(deployment.web3, 'TokenTransferProxy')
+        exchange = ZrxExchange.deploy(deployment.web3, zrx_token_address, token_transfer_proxy_address)
+        order = exchange.create_order(pay_token=deployment.sai.address, pay_amount=Wad.from_number(10),
+                                      buy_token=deployment.gem.address, buy_amount=Wad.from_number(5), expiration=2000)
+
+        # when
+        order_hash = batch_call(deployment.web3, [ContractCall(exchange, 'getOrderHash',
+                                                               [[order.maker, order.taker, order.pay_token,
+                                                                 order.buy_token, order.fee_recipient],
+                                                                [order.pay_amount, order.buy_amount, order.maker_fee,
+                                                                 order.taker_fee, order.expiration, order.salt]], bytes)],
+                                deployment.web3.eth.blockNumber)[0]
+
+        # then
+        assert zrx_order_hash(exchange.address, order) == order_hash
@@ -0,0 +1,135 @@
+# This file is part of Maker Keeper Framework.
+#
+# Copyright (C) 2018 reverendus
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import threading
+import time
+
+from arbitrage_keeper.pipeline import LatestBlockPipeline, BlockJob
+
+
+def wait_until(condition, timeout: float = 5.0):
+    started = time.time()
+    while not condition():
+        assert time.time() - started < timeout
+        time.sleep(0.01)
+
+
+class TestLatestBlockPipeline:
+    def test_should_process_submitted_blocks(self):
+        # given
+        processed = []
+        pipeline = LatestBlockPipeline(process=lambda job: processed.append(job.block_number))
+        pipeline.start()
+
+        # when
+        pipeline.submit(1)
+        wait_until(lambda: processed == [1])
+        pipeline.submit(2)
+        wait_until(lambda: processed == [1, 2])
+        pipeline.stop()
+
+        # then
+        assert pipeline.processed_blocks == 2
+        assert pipeline.skipped_blocks == 0
+
+    def test_should_jump_to_the_newest_block(self):
+        # given
+        processed = []
+        release = threading.Event()
+
+        def process(job: BlockJob):
+            processed.append(job.block_number)
+            release.wait()
+
+        pipeline = LatestBlockPipeline(process=process)
+        pipeline.start()
+
+        # when
+        pipeline.submit(1)
+        wait_until(lambda: processed == [1])
+        pipeline.submit(2)
+        pipeline.submit(3)
+        pipeline.submit(4)
+        release.set()
+        wait_until(lambda: pipeline.processed_blocks == 2)
+        pipeline.stop()
+
+        # then
+        assert processed == [1, 4]
+        assert pipeline.skipped_blocks == 2
+
+    def test_should_ignore_older_blocks(self):
+        # given
+        pipeline = LatestBlockPipeline(process=lambda job: None)
+
+        # when
+        pipeline.submit(5)
+        pipeline.submit(4)
+
+        # then
+        assert pipeline.latest_block_number == 5
+
+    def test_should_tell_if_job_is_superseded(self):
+        # given
+        jobs = []
+        pipeline = LatestBlockPipeline(process=lambda job: jobs.append(job))
+        pipeline.submit(1)
+
+        # when
+        pipeline.process_block(1)
+
+        # then
+        assert jobs[0].is_current()
+
+        # when
+        pipeline.submit(2)
+
+        # then
+        assert jobs[0].is_superseded()
+        assert not jobs[0].is_current()
+
+    def test_should_tell_if_job_is_overdue(self):
+        # given
+        pipeline = LatestBlockPipeline(process=lambda job: time.sleep(0.1), deadline=0.05)
+        pipeline.submit(1)
+
+        # when
+        pipeline.process_block(1)
+
+        # then
+        assert pipeline.overdue_blocks == 1
+
+    def test_should_survive_processing_errors(self):
+        # given
+        processed = []
+
+        def process(job: BlockJob):
+            processed.append(job.block_number)
+            raise Exception("Processing failed")
+
+        pipeline = LatestBlockPipeline(process=process)
+        pipeline.start()
+
+        # when
+        pipeline.submit(1)
+        wait_until(lambda: pipeline.processed_blocks == 1)
+        pipeline.submit(2)
+        wait_until(lambda: pipeline.processed_blocks == 2)
+        pipeline.stop()
+
+        # then
+        assert processed == [1, 2]
@@ -0,0 +1,168 @@
+# This file is part of Maker Keeper Framework.
+#
+# Copyright (C) 2018 reverendus
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import json
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+from urllib.parse import urlparse, parse_qs
+
+import pytest
+
+from arbitrage_keeper.relayer import RelayerClient, RelayerFeed
+from pymaker import Address
+from pymaker.deployment import Deployment
+from pymaker.zrx import ZrxExchange
+
+
+class ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+def raw_order(index: int) -> dict:
+    return {'exchangeContractAddress': '0x0101010101010101010101010101010101010101',
+            'maker': '0x0404040404040404040404040404040404040404',
+            'taker': '0x0000000000000000000000000000000000000000',
+            'makerTokenAddress': '0x0202020202020202020202020202020202020202',
+            'takerTokenAddress': '0x0303030303030303030303030303030303030303',
+            'feeRecipient': '0x0000000000000000000000000000000000000000',
+            'makerTokenAmount': '1000000000000000000',
+            'takerTokenAmount': '2000000000000000000',
+            'makerFee': '0',
+            'takerFee': '0',
+            'expirationUnixTimestampSec': '4102444800',
+            'salt': str(index),
+            'ecSignature': {'v': 27,
+                            'r': '0x' + '00' * 32,
+                            's': '0x' + '00' * 32}}
+
+
+class FakeRelayer:
+    """Serves fake orders from `first_order` to `number_of_orders`, paginated like the Standard Relayer API does."""
+
+    def __init__(self, number_of_orders: int):
+        relayer = self
+        self.first_order = 0
+        self.number_of_orders = number_of_orders
+        self.requested_pages = []
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_GET(self):
+                params = parse_qs(urlparse(self.path).query)
+                page = int(params['page'][0])
+                per_page = int(params['per_page'][0])
+                relayer.requested_pages.append(page)
+
+                indexes = range(relayer.first_order, relayer.number_of_orders)
+                orders = list(map(raw_order, indexes[(page - 1) * per_page:page * per_page]))
+                body = json.dumps(orders).encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.server.server_port}/v0"
+
+    def shutdown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class TestRelayerClient:
+    @pytest.fixture
+    def exchange(self, deployment: Deployment) -> ZrxExchange:
+        return ZrxExchange(web3=deployment.web3, address=Address('0x0101010101010101010101010101010101010101'))
+
+    @pytest.mark.parametrize("number_of_orders", [0, 3, 10, 11, 45, 80])
+    def test_should_fetch_all_pages(self, exchange, number_of_orders):
+        # given
+        relayer = FakeRelayer(number_of_orders)
+        client = RelayerClient(exchange, relayer.url(), per_page=10, pages_per_wave=4)
+
+        # when
+        orders = client.get_raw_orders(Address('0x0202020202020202020202020202020202020202'),
+                                       Address('0x0303030303030303030303030303030303030303'))
+        relayer.shutdown()
+
+        # then
+        assert list(map(lambda order: int(order['salt']), orders)) == list(range(number_of_orders))
+
+    def test_should_fetch_pages_in_waves(self, exchange):
+        # given
+        relayer = FakeRelayer(45)
+        client = RelayerClient(exchange, relayer.url(), per_page=10, pages_per_wave=4)
+
+        # when
+        client.get_raw_orders(Address('0x0202020202020202020202020202020202020202'),
+                              Address('0x0303030303030303030303030303030303030303'))
+        relayer.shutdown()
+
+        # then
+        assert sorted(relayer.requested_pages) == [1, 2, 3, 4, 5]
+
+    def test_should_fetch_only_the_first_page_if_it_is_not_full(self, exchange):
+        # given
+        relayer = FakeRelayer(7)
+        client = RelayerClient(exchange, relayer.url(), per_page=10, pages_per_wave=4)
+
+        # when
+        client.get_raw_orders(Address('0x0202020202020202020202020202020202020202'),
+                              Address('0x0303030303030303030303030303030303030303'))
+        relayer.shutdown()
+
+        # then
+        assert relayer.requested_pages == [1]
+
+
+class TestRelayerFeed:
+    @pytest.fixture
+    def exchange(self, deployment: Deployment) -> ZrxExchange:
+        return ZrxExchange(web3=deployment.web3, address=Address('0x0101010101010101010101010101010101010101'))
+
+    def test_should_pass_on_new_and_removed_orders(self, exchange):
+        # given
+        relayer = FakeRelayer(3)
+        feed = RelayerFeed(RelayerClient(exchange, relayer.url(), per_page=10),
+                           [(Address('0x0202020202020202020202020202020202020202'),
+                             Address('0x0303030303030303030303030303030303030303'))],
+                           ThreadPoolExecutor(max_workers=2))
+
+        # when
+        first_added_orders, first_removed_keys = feed.poll()
+        relayer.first_order = 1
+        relayer.number_of_orders = 5
+        second_added_orders, second_removed_keys = feed.poll()
+        relayer.shutdown()
+
+        # then
+        assert sorted(map(lambda order: order.salt, first_added_orders)) == [0, 1, 2]
+        assert first_removed_keys == []
+
+        # and
+        assert sorted(map(lambda order: order.salt, second_added_orders)) == [3, 4]
+        assert second_removed_keys == [('0x0404040404040404040404040404040404040404', 0)]
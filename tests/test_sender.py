@@ -0,0 +1,116 @@
+# This file is part of Maker Keeper Framework.
+#
+# Copyright (C) 2018 reverendus
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from concurrent.futures import ThreadPoolExecutor
+
+from arbitrage_keeper.sender import PipelinedSender
+from pymaker import Address
+from pymaker.deployment import Deployment
+from pymaker.gas import FixedGasPrice
+from pymaker.numeric import Wad
+
+
+def transaction(transact) -> dict:
+    invocation = transact.invocation()
+    return {'to': invocation.address.address, 'data': invocation.calldata.value}
+
+
+class TestPipelinedSender:
+    def test_should_send_transactions_with_consecutive_nonces(self, deployment: Deployment):
+        # given
+        other_address = Address('0x0101010101010101010101010101010101010101')
+        deployment.sai.mint(Wad.from_number(10)).transact()
+        sender = PipelinedSender(deployment.web3, deployment.our_address, ThreadPoolExecutor(max_workers=2), gas=100000)
+        nonce = deployment.web3.eth.getTransactionCount(deployment.our_address.address, 'pending')
+
+        # when
+        receipts = sender.execute([transaction(deployment.sai.transfer(other_address, Wad.from_number(3))),
+                                   transaction(deployment.sai.transfer(other_address, Wad.from_number(4)))],
+                                  FixedGasPrice(deployment.web3.eth.gasPrice))
+
+        # then
+        assert len(receipts) == 2
+        assert all(receipts)
+        assert deployment.sai.balance_of(other_address) == Wad.from_number(7)
+        assert deployment.web3.eth.getTransactionCount(deployment.our_address.address, 'pending') == nonce + 2
+
+    def test_should_report_failed_transactions(self, deployment: Deployment):
+        # given
+        other_address = Address('0x0101010101010101010101010101010101010101')
+        sender = PipelinedSender(deployment.web3, deployment.our_address, ThreadPoolExecutor(max_workers=2), gas=100000)
+
+        # when
+        receipts = sender.execute([transaction(deployment.sai.transfer(other_address, Wad.from_number(3)))],
+                                  FixedGasPrice(deployment.web3.eth.gasPrice))
+
+        # then
+        assert receipts == [None]
+        assert deployment.sai.balance_of(other_address) == Wad(0)
+
+    def test_should_cancel_transactions_following_the_failed_one(self, deployment: Deployment):
+        # given
+        other_address = Address('0x0101010101010101010101010101010101010101')
+        deployment.sai.mint(Wad.from_number(10)).transact()
+        sender = PipelinedSender(deployment.web3, deployment.our_address, ThreadPoolExecutor(max_workers=2), gas=100000)
+
+        # when
+        receipts = sender.execute([transaction(deployment.sai.transfer(other_address, Wad.from_number(30))),
+                                   transaction(deployment.sai.transfer(other_address, Wad.from_number(4)))],
+                                  FixedGasPrice(deployment.web3.eth.gasPrice))
+
+        # then
+        assert receipts == [None, None]
+        assert deployment.sai.balance_of(other_address) == Wad(0)
+
+    def test_should_not_cancel_independent_transactions_following_the_failed_one(self, deployment: Deployment):
+        # given
+        other_address = Address('0x0101010101010101010101010101010101010101')
+        deployment.sai.mint(Wad.from_number(10)).transact()
+        sender = PipelinedSender(deployment.web3, deployment.our_address, ThreadPoolExecutor(max_workers=2), gas=100000)
+
+        # when
+        receipts = sender.execute([transaction(deployment.sai.transfer(other_address, Wad.from_number(30))),
+                                   transaction(deployment.sai.transfer(other_address, Wad.from_number(4)))],
+                                  FixedGasPrice(deployment.web3.eth.gasPrice), independent=True)
+
+        # then
+        assert receipts[0] is None
+        assert receipts[1] is not None
+        assert deployment.sai.balance_of(other_address) == Wad.from_number(4)
+
+    def test_should_do_nothing_if_no_transactions(self, deployment: Deployment):
+        # given
+        sender = PipelinedSender(deployment.web3, deployment.our_address, ThreadPoolExecutor(max_workers=2), gas=100000)
+
+        # expect
+        assert sender.execute([], FixedGasPrice(deployment.web3.eth.gasPrice)) == []
+
+    def test_should_wait_for_any_of_the_transactions_sent_with_the_same_nonce(self, deployment: Deployment):
+        # given
+        other_address = Address('0x0101010101010101010101010101010101010101')
+        deployment.sai.mint(Wad.from_number(10)).transact()
+        sender = PipelinedSender(deployment.web3, deployment.our_address, ThreadPoolExecutor(max_workers=2), gas=100000)
+        nonce = deployment.web3.eth.getTransactionCount(deployment.our_address.address, 'pending')
+
+        # when
+        tx_hashes = sender.send([transaction(deployment.sai.transfer(other_address, Wad.from_number(3)))],
+                                deployment.web3.eth.gasPrice)
+        receipt = sender._wait_for_receipt([bytes(32)] + tx_hashes, nonce)
+
+        # then
+        assert receipt is not None
+        assert receipt['status'] == 1
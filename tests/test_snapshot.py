@@ -0,0 +1,153 @@
+# This file is part of Maker Keeper Framework.
+#
+# Copyright (C) 2018 reverendus
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from arbitrage_keeper.arbitrage_keeper import ArbitrageKeeper
+from arbitrage_keeper.snapshot import Snapshot, oasis_order_from_json, oasis_order_to_json
+from pymaker import Address
+from pymaker.approval import directly
+from pymaker.deployment import Deployment
+from pymaker.numeric import Wad
+from pymaker.oasis import Order
+from tests.helper import args
+
+
+def snapshot(block_number: int = 10) -> Snapshot:
+    return Snapshot(block_number=block_number,
+                    contracts={'tub': '0x0101010101010101010101010101010101010101'},
+                    metadata={'tub': {'sai': '0x0202020202020202020202020202020202020202'}},
+                    oasis_orders=[{'orderId': 1}],
+                    zrx_orders=[{'salt': '2'}])
+
+
+class TestSnapshot:
+    def test_should_save_and_load(self, tmpdir):
+        # given
+        path = str(tmpdir.join('snapshot.json.gz'))
+
+        # when
+        snapshot().save(path)
+        loaded = Snapshot.load(path)
+
+        # then
+        assert loaded.block_number == 10
+        assert loaded.contracts == {'tub': '0x0101010101010101010101010101010101010101'}
+        assert loaded.metadata == {'tub': {'sai': '0x0202020202020202020202020202020202020202'}}
+        assert loaded.oasis_orders == [{'orderId': 1}]
+        assert loaded.zrx_orders == [{'salt': '2'}]
+
+    def test_should_replace_previous_snapshot(self, tmpdir):
+        # given
+        path = str(tmpdir.join('snapshot.json.gz'))
+        snapshot(10).save(path)
+
+        # when
+        snapshot(20).save(path)
+
+        # then
+        assert Snapshot.load(path).block_number == 20
+        assert tmpdir.listdir() == [tmpdir.join('snapshot.json.gz')]
+
+    def test_should_return_none_if_no_snapshot(self, tmpdir):
+        # expect
+        assert Snapshot.load(str(tmpdir.join('snapshot.json.gz'))) is None
+
+    def test_should_return_none_if_snapshot_can_not_be_read(self, tmpdir):
+        # given
+        path = tmpdir.join('snapshot.json.gz')
+        path.write('garbage')
+
+        # expect
+        assert Snapshot.load(str(path)) is None
+
+    def test_should_check_contracts(self):
+        # expect
+        assert snapshot().is_for({'tub': '0x0101010101010101010101010101010101010101'})
+        assert not snapshot().is_for({'tub': '0x0303030303030303030303030303030303030303'})
+
+    def test_should_convert_oasis_orders(self):
+        # given
+        order = Order(market=None, order_id=7, maker=Address('0x0101010101010101010101010101010101010101'),
+                      pay_token=Address('0x0202020202020202020202020202020202020202'), pay_amount=Wad.from_number(1.5),
+                      buy_token=Address('0x0303030303030303030303030303030303030303'), buy_amount=Wad.from_number(3),
+                      timestamp=1500000000)
+
+        # when
+        restored = oasis_order_from_json(None, oasis_order_to_json(order))
+
+        # then
+        assert restored.order_id == 7
+        assert restored.maker == order.maker
+        assert restored.pay_token == order.pay_token
+        assert restored.pay_amount == order.pay_amount
+        assert restored.buy_token == order.buy_token
+        assert restored.buy_amount == order.buy_amount
+        assert restored.timestamp == order.timestamp
+
+
+class TestArbitrageKeeperSnapshot:
+    @staticmethod
+    def keeper(deployment: Deployment, snapshot_file: str) -> ArbitrageKeeper:
+        return ArbitrageKeeper(args=args(f"--eth-from {deployment.our_address.address}"
+                                         f" --tub-address {deployment.tub.address}"
+                                         f" --tap-address {deployment.tap.address}"
+                                         f" --oasis-address {deployment.otc.address}"
+                                         f" --oasis-order-book"
+                                         f" --snapshot-file {snapshot_file}"
+                                         f" --base-token {deployment.sai.address}"
+                                         f" --min-profit 1.0 --max-engagement 1000.0"),
+                               web3=deployment.web3)
+
+    def test_should_warm_start_from_snapshot(self, deployment: Deployment, tmpdir):
+        # given
+        deployment.gem.mint(Wad.from_number(1000)).transact()
+        deployment.tub.join(Wad.from_number(500)).transact()
+        deployment.otc.approve([deployment.gem, deployment.skr], directly())
+        deployment.otc.add_token_pair_whitelist(deployment.skr.address, deployment.gem.address).transact()
+        deployment.otc.make(deployment.gem.address, Wad.from_number(10), deployment.skr.address, Wad.from_number(5)).transact()
+
+        # and
+        snapshot_file = str(tmpdir.join('snapshot.json.gz'))
+        keeper = self.keeper(deployment, snapshot_file)
+        keeper.otc_order_book.sync()
+        keeper.save_snapshot()
+
+        # when
+        deployment.otc.make(deployment.skr.address, Wad.from_number(5), deployment.gem.address, Wad.from_number(12)).transact()
+        restarted_keeper = self.keeper(deployment, snapshot_file)
+
+        # then
+        assert len(restarted_keeper.otc_order_book.get_orders()) == 1
+        assert restarted_keeper.otc_order_book.last_block_number == keeper.otc_order_book.last_block_number
+        assert restarted_keeper.tub.is_cached(restarted_keeper.tub.call('sai', [], Address))
+
+        # when
+        restarted_keeper.otc_order_book.sync()
+
+        # then
+        assert len(restarted_keeper.otc_order_book.get_orders()) == 2
+
+    def test_should_ignore_snapshot_taken_for_different_contracts(self, deployment: Deployment, tmpdir):
+        # given
+        snapshot_file = str(tmpdir.join('snapshot.json.gz'))
+        snapshot().save(snapshot_file)
+
+        # when
+        keeper = self.keeper(deployment, snapshot_file)
+
+        # then
+        assert keeper.snapshot is None
+        assert keeper.otc_order_book.last_block_number is None
@@ -0,0 +1,169 @@
+# This file is part of Maker Keeper Framework.
+#
+# Copyright (C) 2018 reverendus
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import pytest
+from eth_abi import encode_abi
+from eth_utils import encode_hex
+
+from arbitrage_keeper.arbitrage_keeper import ArbitrageKeeper
+from arbitrage_keeper.conversion import OasisTakeConversion
+from arbitrage_keeper.opportunity import Sequence
+from arbitrage_keeper.speculation import OASIS_TAKE, OASIS_KILL, OASIS_BUY, is_still_valid, project_oasis_orders
+from pymaker import Address
+from pymaker.deployment import Deployment
+from pymaker.numeric import Wad
+from pymaker.oasis import Order
+from tests.helper import args
+
+
+@pytest.fixture
+def token1():
+    return Address('0x0101010101010101010101010101010101010101')
+
+
+@pytest.fixture
+def token2():
+    return Address('0x0202020202020202020202020202020202020202')
+
+
+def order(order_id: int, pay_token: Address, pay_amount: Wad, buy_token: Address, buy_amount: Wad) -> Order:
+    return Order(market=None, order_id=order_id, maker=Address('0x0000000000000000000000000000000000000000'),
+                 pay_token=pay_token, pay_amount=pay_amount, buy_token=buy_token, buy_amount=buy_amount, timestamp=0)
+
+
+def transaction(selector: bytes, types: list, args: list) -> dict:
+    return {'input': encode_hex(selector + encode_abi(types, args))}
+
+
+def take(order_id: int, quantity: Wad) -> dict:
+    return transaction(OASIS_TAKE, ['bytes32', 'uint128'], [order_id.to_bytes(32, byteorder='big'), quantity.value])
+
+
+class TestProjectOasisOrders:
+    def test_should_reduce_partially_taken_orders(self, token1, token2):
+        # given
+        orders = [order(1, token1, Wad.from_number(10), token2, Wad.from_number(20))]
+
+        # when
+        projected = project_oasis_orders(orders, [take(1, Wad.from_number(4))])
+
+        # then
+        assert len(projected) == 1
+        assert projected[0].pay_amount == Wad.from_number(6)
+        assert projected[0].buy_amount == Wad.from_number(12)
+
+        # and
+        assert orders[0].pay_amount == Wad.from_number(10)
+        assert orders[0].buy_amount == Wad.from_number(20)
+
+    def test_should_remove_fully_taken_orders(self, token1, token2):
+        # given
+        orders = [order(1, token1, Wad.from_number(10), token2, Wad.from_number(20)),
+                  order(2, token1, Wad.from_number(10), token2, Wad.from_number(20))]
+
+        # when
+        projected = project_oasis_orders(orders, [transaction(OASIS_BUY, ['uint256', 'uint256'], [2, Wad.from_number(15).value])])
+
+        # then
+        assert list(map(lambda order: order.order_id, projected)) == [1]
+
+    def test_should_remove_killed_orders(self, token1, token2):
+        # given
+        orders = [order(1, token1, Wad.from_number(10), token2, Wad.from_number(20))]
+
+        # when
+        projected = project_oasis_orders(orders, [transaction(OASIS_KILL, ['bytes32'], [(1).to_bytes(32, byteorder='big')])])
+
+        # then
+        assert projected == []
+
+    def test_should_ignore_unrelated_transactions(self, token1, token2):
+        # given
+        orders = [order(1, token1, Wad.from_number(10), token2, Wad.from_number(20))]
+
+        # when
+        projected = project_oasis_orders(orders, [take(5, Wad.from_number(4)), {'input': '0x12345678'}, {'input': '0x'}])
+
+        # then
+        assert projected == orders
+
+
+class TestIsStillValid:
+    def test_should_accept_unchanged_conversions(self, token1, token2):
+        # given
+        conversions = [OasisTakeConversion(None, order(1, token2, Wad.from_number(20), token1, Wad.from_number(10))),
+                       OasisTakeConversion(None, order(2, token1, Wad.from_number(11), token2, Wad.from_number(20)))]
+        opportunity = Sequence(conversions)
+        opportunity.set_amounts(Wad.from_number(10))
+
+        # expect
+        assert is_still_valid(opportunity, conversions)
+
+    def test_should_reject_if_conversion_is_gone_or_smaller(self, token1, token2):
+        # given
+        conversions = [OasisTakeConversion(None, order(1, token2, Wad.from_number(20), token1, Wad.from_number(10))),
+                       OasisTakeConversion(None, order(2, token1, Wad.from_number(11), token2, Wad.from_number(20)))]
+        opportunity = Sequence(conversions)
+        opportunity.set_amounts(Wad.from_number(10))
+
+        # expect
+        assert not is_still_valid(opportunity, conversions[:1])
+        assert not is_still_valid(opportunity, [conversions[0], OasisTakeConversion(None, order(2, token1, Wad.from_number(5.5),
+                                                                                               token2, Wad.from_number(10)))])
+
+
+class TestArbitrageKeeperSpeculation:
+    @staticmethod
+    def keeper(deployment: Deployment) -> ArbitrageKeeper:
+        return ArbitrageKeeper(args=args(f"--eth-from {deployment.our_address.address}"
+                                         f" --tub-address {deployment.tub.address}"
+                                         f" --tap-address {deployment.tap.address}"
+                                         f" --oasis-address {deployment.otc.address}"
+                                         f" --speculative"
+                                         f" --base-token {deployment.sai.address}"
+                                         f" --min-profit 1.0 --max-engagement 1000.0"),
+                               web3=deployment.web3)
+
+    def test_should_not_speculate_before_the_first_block_is_processed(self, deployment: Deployment):
+        # given
+        keeper = self.keeper(deployment)
+        keeper.fetch_venues = lambda: pytest.fail("Venues should only be fetched by the pipeline")
+
+        # when
+        keeper.speculate()
+
+        # then
+        assert keeper.speculation_state is None
+        assert keeper.speculative_opportunity is None
+
+    def test_should_project_pending_transactions_on_venues_fetched_by_the_pipeline(self, deployment: Deployment):
+        # given
+        keeper = self.keeper(deployment)
+        keeper.process_block()
+        block_number, _ = keeper.latest_venues
+
+        # and
+        keeper.fetch_venues = lambda: pytest.fail("Venues should only be fetched by the pipeline")
+        keeper.pending_transactions.transactions = {b'\x01': take(1, Wad.from_number(4))}
+        keeper.pending_transactions.poll = lambda: list(keeper.pending_transactions.transactions.values())
+        keeper.pending_transactions.prune = lambda: None
+
+        # when
+        keeper.speculate()
+
+        # then
+        assert keeper.speculation_state == (block_number, frozenset([b'\x01']))